@@ -1,5 +1,16 @@
-"""API接口层"""
-from .volleyball_api import VolleyballAPI
+"""
+API接口层
+
+VolleyballAPI 按需导入：schema / uploads 单独使用时不加载模型
+"""
+import importlib
 
 __all__ = ['VolleyballAPI']
 
+
+def __getattr__(name):
+    if name != 'VolleyballAPI':
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = importlib.import_module('.volleyball_api', __name__).VolleyballAPI
+    globals()[name] = value
+    return value
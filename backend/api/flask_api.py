@@ -2,18 +2,18 @@
 Flask REST API for Volleyball Training System
 提供HTTP接口供前端调用
 """
-from flask import Flask, request, jsonify, send_file, send_from_directory
+from flask import Flask, Response, request, jsonify, send_file, send_from_directory
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 import os
 import sys
 from pathlib import Path
-import tempfile
+import time
+import uuid
 import base64
-import cv2
-import numpy as np
-from PIL import Image
-import io
+import json
+import shutil
+from contextlib import nullcontext
 
 # 加载环境变量
 try:
@@ -98,28 +98,402 @@ sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
 
 from backend.api.volleyball_api import VolleyballAPI
 from backend.services.volleyball_service import VolleyballService
-from config.settings import OUTPUT_DIR
+from backend.services.job_queue import (
+    JobQueue, MemoryJobStore, SQLiteJobStore, QueueFullError, FINISHED_STATES, SUCCEEDED
+)
+from backend.services.admission import (
+    AdmissionController, MemoryAdmissionStore, SQLiteAdmissionStore, AdmissionRejected,
+    estimate_cost, video_cost_basis
+)
+from backend.core.cancellation import CancelToken
+from backend.core.image_store import ImageStore
+from backend.api.uploads import configure_uploads, claim_upload
+from backend.api.schema import FastJSONProvider, respond, parse_schema_version, format_analysis_result
+from backend.core.video_writer import get_ffmpeg_capabilities
+from backend.core.process_memory import process_memory
+from backend.core.thread_budget import plan_thread_budget, apply_thread_budget, get_thread_budget
+from config.settings import (
+    OUTPUT_DIR, ENCODE_PROFILES, DEFAULT_ENCODE_PROFILE, VISUALIZATION_CONFIG, HLS_CONFIG,
+    PREVIEW_CONFIG, JOB_CONFIG, DEADLINE_CONFIG, VIDEO_CONFIG, UPLOAD_CONFIG, IMAGE_CONFIG,
+    WARMUP_CONFIG, WORKER_CONFIG, THREAD_BUDGET_CONFIG, ADMISSION_CONFIG
+)
 
 # 创建Flask应用
 app = Flask(__name__, 
             static_folder='../../frontend',
             static_url_path='')
 CORS(app)  # 允许跨域请求
+# 响应 JSON 编码（有 orjson 时使用 orjson，原生支持 numpy 类型）
+app.json = FastJSONProvider(app)
+# 上传文件边接收边写入唯一命名的暂存文件，超过大小上限立即拒绝
+configure_uploads(app, UPLOAD_CONFIG['spool_dir'], VIDEO_CONFIG['max_file_size_mb'])
 
-# 初始化API
-volleyball_api = VolleyballAPI()
 # 使用 V3 智能评分系统（支持人球位置评分）
-volleyball_service = VolleyballService(scorer_version='v3', enable_ball_detection=True)
+# preload 模式下在 gunicorn master 中只加载模型权重，进程内状态在 init_worker() 中创建
+volleyball_service = VolleyballService(
+    scorer_version='v3', enable_ball_detection=True, preload=WORKER_CONFIG['preload']
+)
+# 初始化API（复用同一个服务，进程内只有一份模型）
+volleyball_api = VolleyballAPI(service=volleyball_service)
+
+# 分析结果图像（按内容寻址）
+image_store = ImageStore(IMAGE_CONFIG['directory'], IMAGE_CONFIG['format'], IMAGE_CONFIG['quality'])
 
 # 允许的文件扩展名
 ALLOWED_EXTENSIONS = {'mp4', 'avi', 'mov', 'mkv'}
 
+JOB_UPLOAD_DIR = Path(JOB_CONFIG['upload_dir'])
+
+
+def _job_upload_path(job_id, filename):
+    return JOB_UPLOAD_DIR / job_id / filename
+
+
+def _remove_job_upload(job_id):
+    shutil.rmtree(JOB_UPLOAD_DIR / job_id, ignore_errors=True)
+
+
+def _to_json_result(result):
+    """结果转成纯 JSON 对象（dataclass 等按 Flask 的规则序列化）后存入任务存储"""
+    return json.loads(app.json.dumps(result))
+
+
+def run_analyze_job(params, progress_callback, cancel_token):
+    """后台任务：视频分析（序列模式在执行线程中等待准入，直到任务截止时间）"""
+    video_path = str(_job_upload_path(params['job_id'], params['filename']))
+    try:
+        with admitted(analysis_cost(video_path, params), wait=DEADLINE_CONFIG['job_seconds'],
+                      cancel_token=cancel_token):
+            result = volleyball_service.analyze_video(
+                video_path, mode=params['mode'], high_accuracy=params['high_accuracy'],
+                progress_callback=progress_callback, cancel_token=cancel_token
+            )
+        return _to_json_result(format_analysis_result(serialize_analysis_result(result), params['schema']))
+    finally:
+        _remove_job_upload(params['job_id'])
+
+
+def run_visualize_job(params, progress_callback, cancel_token):
+    """后台任务：生成可视化视频"""
+    video_path = str(_job_upload_path(params['job_id'], params['filename']))
+    try:
+        with admitted(visualization_cost(video_path, params['vis_types']),
+                      wait=DEADLINE_CONFIG['job_seconds'], cancel_token=cancel_token):
+            response, _ = run_visualization(
+                video_path, output_name(params['sha256'], params['filename']), params['vis_types'],
+                params['profile'], params['max_height'], params['output_fps'],
+                progress_callback=progress_callback, cancel_token=cancel_token,
+                content_digest=params['sha256']
+            )
+        return _to_json_result(response)
+    finally:
+        _remove_job_upload(params['job_id'])
+
+
+def run_hls_job(params, progress_callback, cancel_token):
+    """后台任务：生成 HLS 可视化视频（请求线程等待首个播放列表发布后返回地址，见 start_hls_render）"""
+    video_path = str(_job_upload_path(params['job_id'], params['filename']))
+    render_id = params['render_id']
+    try:
+        with admitted(visualization_cost(video_path, params['vis_types']),
+                      wait=DEADLINE_CONFIG['hls_seconds'], cancel_token=cancel_token):
+            result = volleyball_service.generate_visualization_videos(
+                video_path=video_path,
+                output_paths=_hls_playlist_paths(render_id, params['vis_types']),
+                detect_ball=True,
+                highlight_ball=True,
+                profile=params['profile'],
+                max_height=params['max_height'],
+                output_fps=params['output_fps'],
+                progress_callback=progress_callback,
+                cancel_token=cancel_token,
+                content_digest=params['sha256']
+            )
+        print(f"✅ HLS 渲染 {render_id} 结束: {result.get('success', False)}")
+        if not result['success']:
+            return _to_json_result(result)
+        return {
+            'success': True,
+            'render_id': render_id,
+            'landmarks_id': result.get('landmarks_id'),
+            'videos': _hls_videos(render_id, params['vis_types'])
+        }
+    finally:
+        _remove_job_upload(params['job_id'])
+
+
+def create_admission_controller():
+    if not ADMISSION_CONFIG['enabled']:
+        return None
+    if ADMISSION_CONFIG['backend'] == 'sqlite':
+        store = SQLiteAdmissionStore(
+            ADMISSION_CONFIG['db_path'],
+            max_ticket_seconds=max(DEADLINE_CONFIG['job_seconds'], DEADLINE_CONFIG['hls_seconds']) + 60
+        )
+    else:
+        store = MemoryAdmissionStore()
+    return AdmissionController(
+        store,
+        capacity=ADMISSION_CONFIG['capacity'],
+        max_wait=ADMISSION_CONFIG['max_wait_seconds'],
+        poll_interval=ADMISSION_CONFIG['poll_interval'],
+        min_retry_after=ADMISSION_CONFIG['min_retry_after'],
+        max_retry_after=ADMISSION_CONFIG['max_retry_after']
+    )
+
+
+# 重型请求的准入控制（未启用时为 None）
+admission = create_admission_controller()
+
+
+def analysis_cost(video_path, params):
+    """视频分析的估算成本；单帧模式不经过准入控制，返回 None"""
+    if params['mode'] == 'single':
+        return None
+    factors = ADMISSION_CONFIG['factors']
+    factor = factors['analyze_sequence']
+    if params['high_accuracy']:
+        factor *= factors['high_accuracy']
+    return estimate_cost(*video_cost_basis(video_path), factor=factor)
+
+
+def visualization_cost(video_path, vis_types):
+    factors = ADMISSION_CONFIG['factors']
+    factor = factors['visualize'] + factors['per_vis_type'] * len(vis_types)
+    return estimate_cost(*video_cost_basis(video_path), factor=factor)
+
+
+def landmarks_render_cost(vis_types):
+    """关键点渲染不读取原视频，按最长时长和默认输出尺寸估算"""
+    frames = VIDEO_CONFIG['max_duration_seconds'] * VISUALIZATION_CONFIG['output_fps']
+    height = VISUALIZATION_CONFIG['max_height']
+    factor = ADMISSION_CONFIG['factors']['landmarks_per_vis_type'] * len(vis_types)
+    return estimate_cost(frames, height * 16 // 9, height, factor=factor)
+
+
+def admitted(cost, wait=None, cancel_token=None):
+    """准入控制的上下文；未启用或 cost 为 None（轻量请求）时直接放行"""
+    if admission is None or cost is None:
+        return nullcontext()
+    return admission.admit(cost, wait=wait, cancel_token=cancel_token)
+
+
+def busy_response(error):
+    """在途成本已满：429 + Retry-After"""
+    response = jsonify({
+        'success': False,
+        'error': str(error),
+        'busy': True,
+        'retry_after': error.retry_after
+    })
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 429
+
+
+def models_busy_response(result):
+    """模型被其他视频（通常是后台任务）占用：503 + Retry-After，长视频请提交 /api/jobs"""
+    retry_after = DEADLINE_CONFIG['model_busy_retry_after']
+    response = jsonify({**result, 'retry_after': retry_after})
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 503
+
+
+def create_job_queue():
+    """
+    后台任务队列；执行线程与请求线程共用 volleyball_service，
+    模型调用由 VolleyballService.exclusive_models() 串行化
+    """
+    if JOB_CONFIG['backend'] == 'sqlite':
+        store = SQLiteJobStore(JOB_CONFIG['db_path'])
+    else:
+        store = MemoryJobStore()
+    return JobQueue(
+        store,
+        handlers={'analyze': run_analyze_job, 'visualize': run_visualize_job, 'hls': run_hls_job},
+        workers=JOB_CONFIG['workers'],
+        max_pending=JOB_CONFIG['max_pending'],
+        progress_interval=JOB_CONFIG['progress_interval'],
+        poll_interval=JOB_CONFIG['poll_interval'],
+        retention_seconds=JOB_CONFIG['retention_hours'] * 3600,
+        on_purge=_remove_job_upload,
+        job_timeout={'analyze': DEADLINE_CONFIG['job_seconds'], 'visualize': DEADLINE_CONFIG['job_seconds'],
+                     'hls': DEADLINE_CONFIG['hls_seconds']}
+    )
+
+
+# 任务队列（工作线程在第一次提交任务时启动）
+job_queue = create_job_queue()
+
+# 启动预热状态：worker 在开始接受请求之前同步完成预热，/api/ready 报告各组件的预热结果
+readiness = {
+    'ready': not WARMUP_CONFIG['enabled'],
+    'started_at': None,
+    'finished_at': None,
+    'warmup_seconds': None,
+    'components': {},
+    'error': None
+}
+
+
+def run_warmup(heartbeat=None):
+    """
+    预热所有模型；失败时记录错误，/api/ready 随后返回 503
+
+    Args:
+        heartbeat: 每个组件预热完成后调用（gunicorn worker.notify，避免预热时间较长时被 master 判定超时）
+    """
+    if readiness['ready']:
+        return
+    readiness['started_at'] = time.time()
+    t0 = time.perf_counter()
+    try:
+        readiness['components'] = volleyball_service.warmup(on_step=heartbeat)
+        print(f"✅ 预热完成，用时 {time.perf_counter() - t0:.1f} 秒")
+    except Exception as e:
+        readiness['error'] = str(e)
+        print(f"⚠️ 预热失败: {e}")
+    readiness['warmup_seconds'] = round(time.perf_counter() - t0, 3)
+    readiness['finished_at'] = time.time()
+    readiness['ready'] = True
+    memory = process_memory()
+    if memory:
+        print(f"📊 worker {os.getpid()} 内存: 独占 {memory['uss_mb']} MB, "
+              f"共享 {memory['shared_mb']} MB, PSS {memory['pss_mb']} MB")
+
+
+def init_worker(heartbeat=None):
+    """
+    worker 进程初始化：设置线程预算、创建 MediaPipe 计算图等进程内状态并完成预热
+
+    预热是同步的：返回之前 worker 不接受请求，预热与真实请求不会同时使用模型。
+    preload 模式下由 gunicorn 的 post_worker_init 钩子在 fork 之后调用；
+    否则在导入时直接调用（master 中不启动任何线程，fork 之后线程不会被继承）
+
+    Args:
+        heartbeat: 传给 run_warmup()
+    """
+    if THREAD_BUDGET_CONFIG['enabled']:
+        apply_thread_budget(plan_thread_budget(
+            workers=THREAD_BUDGET_CONFIG['workers'],
+            cpus=THREAD_BUDGET_CONFIG['cpus'],
+            torch_threads=THREAD_BUDGET_CONFIG['torch_threads'],
+            opencv_threads=THREAD_BUDGET_CONFIG['opencv_threads'],
+            ffmpeg_threads=THREAD_BUDGET_CONFIG['ffmpeg_threads']
+        ))
+    volleyball_service.init_process()
+    run_warmup(heartbeat)
+
+
+if not WORKER_CONFIG['preload']:
+    init_worker()
+
+def parse_int_field(name, default, limit):
+    """
+    读取表单中的正整数参数
+
+    Returns:
+        (value, error): 缺省时返回 default；不合法时 error 为错误信息
+    """
+    raw = request.form.get(name)
+    if raw in (None, ''):
+        return default, None
+    try:
+        value = int(raw)
+    except ValueError:
+        return None, f'{name} 必须是整数'
+    if not 0 < value <= limit:
+        return None, f'{name} 必须在 1 到 {limit} 之间'
+    return value, None
+
+def parse_analysis_params():
+    """
+    读取分析参数
+
+    Returns:
+        (params, error): params 为 {mode, high_accuracy, schema}：分析模式；高精度模式（教练复盘，
+            对置信度模糊的帧追加 TTA / 集成推理），未传时为 None（使用配置默认值）；响应格式版本
+            （见 backend/api/schema.py）。不合法时 error 为错误信息
+    """
+    analysis_mode = request.form.get('mode', 'single')
+    high_accuracy = request.form.get('high_accuracy')
+    if high_accuracy is not None:
+        high_accuracy = high_accuracy.lower() in ('1', 'true', 'yes')
+    schema, error = parse_schema_version(request.form.get('schema') or request.args.get('schema'))
+    if error:
+        return None, error
+    return {'mode': analysis_mode, 'high_accuracy': high_accuracy, 'schema': schema}, None
+
+def parse_visualization_params():
+    """
+    读取并校验可视化参数
+
+    Returns:
+        (params, error): params 为 {vis_types, profile, max_height, output_fps, format}；
+            不合法时 error 为错误信息
+    """
+    # 可视化类型：vis_types（逗号分隔或多值）一次生成多种，否则只生成 vis_type
+    vis_types = []
+    for value in request.form.getlist('vis_types'):
+        vis_types.extend(t.strip() for t in value.split(',') if t.strip())
+    vis_types = list(dict.fromkeys(vis_types)) or [request.form.get('vis_type', 'overlay')]
+    
+    valid_types = ['overlay', 'skeleton', 'comparison', 'trajectory']
+    if any(t not in valid_types for t in vis_types):
+        return None, f'不支持的可视化类型。支持: {", ".join(valid_types)}'
+    
+    # 编码档位：preview（快速低清）/ share（默认）/ archive（高画质）
+    profile = request.form.get('profile') or DEFAULT_ENCODE_PROFILE
+    if profile not in ENCODE_PROFILES:
+        return None, f'不支持的编码档位。支持: {", ".join(ENCODE_PROFILES)}'
+    
+    # 输出尺寸和帧率
+    max_height, error = parse_int_field(
+        'max_height', VISUALIZATION_CONFIG['max_height'], VISUALIZATION_CONFIG['max_height_limit'])
+    if error:
+        return None, error
+    output_fps, error = parse_int_field(
+        'output_fps', VISUALIZATION_CONFIG['output_fps'], VISUALIZATION_CONFIG['output_fps_limit'])
+    if error:
+        return None, error
+    
+    # 输出格式：mp4（生成完成后返回）/ hls（边生成边播放）
+    output_format = request.form.get('format', 'mp4')
+    if output_format not in ('mp4', 'hls') or (output_format == 'hls' and not HLS_CONFIG['enabled']):
+        return None, '不支持的输出格式'
+    
+    return {
+        'vis_types': vis_types,
+        'profile': profile,
+        'max_height': max_height,
+        'output_fps': output_fps,
+        'format': output_format
+    }, None
+
 def allowed_file(filename):
     """检查文件扩展名是否允许"""
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+@app.before_request
+def parse_uploads():
+    """
+    在进入视图之前解析 multipart 上传：超过大小上限时由 413 处理函数返回，
+    不会被视图里的通用异常处理吞掉
+    """
+    if request.mimetype == 'multipart/form-data':
+        request.files
+
+
+@app.errorhandler(413)
+def request_too_large(e):
+    """上传超过大小上限（带 Content-Length 时读取前即拒绝，否则写入暂存文件超限时中止）"""
+    return jsonify({
+        'success': False,
+        'error': f"文件过大，最大支持 {VIDEO_CONFIG['max_file_size_mb']}MB"
+    }), 413
+
+
 @app.route('/')
 def index():
     """主页 - 返回前端HTML"""
@@ -129,18 +503,129 @@ def index():
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """健康检查接口"""
+    ffmpeg = get_ffmpeg_capabilities()
     return jsonify({
         'status': 'ok',
         'message': 'Volleyball AI Training System API is running',
-        'version': '1.0.0'
+        'version': '1.0.0',
+        'pid': os.getpid(),
+        # 本 worker 的内存：uss 为独占部分（每多一个 worker 增加的内存）
+        'memory': process_memory(),
+        # 本 worker 生效的线程数（torch / OpenCV / ffmpeg）
+        'threads': get_thread_budget(),
+        # 重型请求的在途成本（所有 worker 共享）
+        'admission': admission.status() if admission else None,
+        'ffmpeg': {
+            'available': ffmpeg.get('available', False),
+            'version': ffmpeg.get('version'),
+            'encoder': (ffmpeg.get('selected') or {}).get('encoder'),
+            'encoders': sorted(ffmpeg.get('encoders', {})),
+            'rejected': sorted(ffmpeg.get('rejected', {}))
+        }
     })
 
 
+@app.route('/api/ready', methods=['GET'])
+def readiness_check():
+    """
+    就绪检查接口：预热完成且没有出错、姿态模型已加载、任务存储可访问时返回 200，否则返回 503
+
+    worker 在预热结束后才开始接受请求，因此 503 通常表示预热失败或任务存储（SQLite）不可用；
+    /api/health 只表示进程存活；编排系统的就绪探针应使用本接口
+    """
+    components = readiness['components'] or {
+        name: {'load_seconds': round(seconds, 3), 'warmup_seconds': None}
+        for name, seconds in volleyball_service.load_timings.items()
+    }
+    problems = []
+    if readiness['error']:
+        problems.append(f"预热失败: {readiness['error']}")
+    if volleyball_service.pose_detector is None:
+        problems.append('姿态模型未加载')
+    try:
+        jobs = job_queue.status()
+    except Exception as e:
+        jobs = None
+        problems.append(f'任务存储不可用: {e}')
+    ready = readiness['ready'] and not problems
+    if ready:
+        status = 'ready'
+    else:
+        status = 'warming_up' if not readiness['ready'] else 'unavailable'
+    payload = {
+        'status': status,
+        'ready': ready,
+        'pid': os.getpid(),
+        'warmup_seconds': readiness['warmup_seconds'],
+        'components': components,
+        'error': readiness['error'],
+        'problems': problems,
+        'jobs': jobs,
+        'preloaded': WORKER_CONFIG['preload'],
+        'memory': process_memory(),
+        'threads': get_thread_budget()
+    }
+    return jsonify(payload), 200 if ready else 503
+
+
+def store_result_image(image):
+    """
+    结果图像写入图像目录
+
+    Returns:
+        (url, filename)：图像为空或编码失败时为 (None, None)
+    """
+    try:
+        filename = image_store.save(image)
+    except Exception as e:
+        print(f"警告：结果图像保存失败: {str(e)}")
+        return None, None
+    if filename is None:
+        return None, None
+    return f'/api/output/images/{filename}', filename
+
+
+def _inline_base64(filename):
+    with open(os.path.join(IMAGE_CONFIG['directory'], filename), 'rb') as f:
+        return base64.b64encode(f.read()).decode('utf-8')
+
+
+def serialize_analysis_result(result):
+    """分析结果中的图像写成文件返回地址，预览转访问地址（之后由 format_analysis_result 按版本整理字段）"""
+    # 姿态图：单帧模式为 pose_image，序列模式优先取最佳标注帧
+    pose_image = result.pop('pose_image', None)
+    annotated_frames = result.pop('annotated_frames', None)
+    if isinstance(annotated_frames, list) and annotated_frames:
+        best_idx = result.get('best_frame_idx', 0)
+        if best_idx < len(annotated_frames):
+            pose_image = annotated_frames[best_idx]
+    
+    # 轨迹图（TrajectoryVisualizer 返回的是 PIL Image）
+    trajectory_plot = result.pop('trajectory_plot', None)
+    
+    for name, image in (('pose_image', pose_image), ('trajectory_plot', trajectory_plot)):
+        url, filename = store_result_image(image)
+        if url is None:
+            continue
+        result[f'{name}_url'] = url
+        if IMAGE_CONFIG['inline_base64']:
+            result[f'{name}_base64'] = _inline_base64(filename)
+
+    # 预览文件名转换为访问地址
+    preview = result.get('preview')
+    if preview:
+        preview['animation_url'] = f"/api/output/previews/{preview['animation']}"
+        preview['sprite_url'] = f"/api/output/previews/{preview['sprite']}"
+
+    return result
+
+
 @app.route('/api/analyze/video', methods=['POST'])
 def analyze_video():
     """
     分析视频接口
     接收上传的视频文件，返回AI分析结果
+    模型正被后台任务占用时不排队，直接返回 503 + Retry-After（长视频建议提交 /api/jobs）
     """
     try:
         # 检查是否有文件
@@ -163,87 +648,32 @@ def analyze_video():
                 'error': '不支持的文件格式，请上传MP4、AVI、MOV或MKV格式'
             }), 400
         
-        # 获取分析模式
-        analysis_mode = request.form.get('mode', 'single')
+        params, error = parse_analysis_params()
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }), 400
         
-        # 保存上传的文件到临时目录
-        filename = secure_filename(file.filename)
-        temp_path = os.path.join(tempfile.gettempdir(), filename)
-        file.save(temp_path)
+        # 上传时已写入唯一命名的暂存文件，直接使用
+        temp_path = claim_upload(file).path
         
         try:
-            # 调用服务分析视频
-            result = volleyball_service.analyze_video(temp_path, mode=analysis_mode)
-            
-            # 将图像转换为base64 - 修复颜色问题
-            if result.get('pose_image') is not None:
-                pose_img = result['pose_image']
-                # 确保是numpy array
-                if isinstance(pose_img, np.ndarray) and pose_img.size > 0:
-                    try:
-                        # BGR → RGB 转换
-                        pose_img_rgb = cv2.cvtColor(pose_img, cv2.COLOR_BGR2RGB)
-                        # 使用 PIL 编码（避免 cv2.imencode 的 BGR 假设问题）
-                        pil_img = Image.fromarray(pose_img_rgb)
-                        buffer = io.BytesIO()
-                        pil_img.save(buffer, format='JPEG', quality=95)
-                        pose_img_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-                        result['pose_image_base64'] = pose_img_base64
-                    except Exception as e:
-                        print(f"警告：姿态图像转换失败: {str(e)}")
-                        import traceback
-                        traceback.print_exc()
-                # 删除numpy array，不能JSON序列化
-                if 'pose_image' in result:
-                    del result['pose_image']
-            
-            # 处理landmarks，转换为可序列化格式
-            if result.get('landmarks') is not None:
-                result['landmarks'] = str(result['landmarks'])
-            
-            # 处理轨迹图 - 修复颜色问题
-            if result.get('trajectory_plot') is not None:
-                traj_img = result['trajectory_plot']
-                # 确保是numpy array
-                if isinstance(traj_img, np.ndarray) and traj_img.size > 0:
-                    try:
-                        # BGR → RGB 转换
-                        traj_img_rgb = cv2.cvtColor(traj_img, cv2.COLOR_BGR2RGB)
-                        # 使用 PIL 编码
-                        pil_img = Image.fromarray(traj_img_rgb)
-                        buffer = io.BytesIO()
-                        pil_img.save(buffer, format='JPEG', quality=95)
-                        traj_img_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-                        result['trajectory_plot_base64'] = traj_img_base64
-                    except Exception as e:
-                        print(f"警告：轨迹图像转换失败: {str(e)}")
-                # 删除numpy array
-                if 'trajectory_plot' in result:
-                    del result['trajectory_plot']
-            
-            # 处理annotated_frames（序列分析模式下可能有多个帧）- 修复颜色问题
-            if result.get('annotated_frames') is not None:
-                # 只保留最佳帧
-                if isinstance(result['annotated_frames'], list) and len(result['annotated_frames']) > 0:
-                    best_idx = result.get('best_frame_idx', 0)
-                    if best_idx < len(result['annotated_frames']):
-                        best_frame = result['annotated_frames'][best_idx]
-                        if isinstance(best_frame, np.ndarray) and best_frame.size > 0:
-                            try:
-                                # BGR → RGB 转换
-                                best_frame_rgb = cv2.cvtColor(best_frame, cv2.COLOR_BGR2RGB)
-                                # 使用 PIL 编码
-                                pil_img = Image.fromarray(best_frame_rgb)
-                                buffer = io.BytesIO()
-                                pil_img.save(buffer, format='JPEG', quality=95)
-                                result['pose_image_base64'] = base64.b64encode(buffer.getvalue()).decode('utf-8')
-                            except:
-                                pass
-                # 删除annotated_frames
-                if 'annotated_frames' in result:
-                    del result['annotated_frames']
+            # 调用服务分析视频（超过截止时间后停止，释放 worker）
+            # 序列模式先等待准入（排队时间计入截止时间），单帧模式直接执行
+            cancel_token = CancelToken(DEADLINE_CONFIG['request_seconds'])
+            with admitted(analysis_cost(temp_path, params), cancel_token=cancel_token):
+                result = volleyball_service.analyze_video(
+                    temp_path, mode=params['mode'], high_accuracy=params['high_accuracy'],
+                    cancel_token=cancel_token, model_wait=DEADLINE_CONFIG['model_wait_seconds']
+                )
+            if result.get('busy'):
+                return models_busy_response(result)
+            if result.get('timeout'):
+                return jsonify(result), 504
             
-            return jsonify(result)
+            # Accept: application/msgpack 时返回 MessagePack
+            return respond(format_analysis_result(serialize_analysis_result(result), params['schema']))
             
         finally:
             # 清理临时文件
@@ -253,6 +683,8 @@ def analyze_video():
                 except:
                     pass
     
+    except AdmissionRejected as e:
+        return busy_response(e)
     except Exception as e:
         return jsonify({
             'success': False,
@@ -265,8 +697,13 @@ def visualize_video():
     """
     生成可视化视频接口
     支持4种可视化类型：overlay, skeleton, comparison, trajectory
+    传 vis_types（如 "overlay,skeleton"）时一次分析生成多种视频，结果在 videos 字段中
+    profile 选择编码档位：preview / share（默认）/ archive
+    max_height / output_fps 限制输出高度和帧率（默认 720p / 15 FPS，帧在渲染前缩放）
+    format=hls 时输出 fMP4 HLS：首个分片发布后立即返回播放列表地址，后台继续生成
     
     注意：这是一个长时间操作，可能需要1-3分钟
+    MP4 输出在请求线程中执行：模型正被后台任务占用时直接返回 503 + Retry-After
     """
     try:
         if 'video' not in request.files:
@@ -282,74 +719,35 @@ def visualize_video():
                 'error': '不支持的文件格式'
             }), 400
         
-        # 获取可视化类型
-        vis_type = request.form.get('vis_type', 'overlay')
-        
-        # 验证可视化类型
-        valid_types = ['overlay', 'skeleton', 'comparison', 'trajectory']
-        if vis_type not in valid_types:
+        params, error = parse_visualization_params()
+        if error:
             return jsonify({
                 'success': False,
-                'error': f'不支持的可视化类型。支持: {", ".join(valid_types)}'
+                'error': error
             }), 400
         
-        # 保存上传的文件
-        filename = secure_filename(file.filename)
-        temp_input = os.path.join(tempfile.gettempdir(), filename)
-        file.save(temp_input)
+        if params['format'] == 'hls':
+            # 渲染作为后台任务执行（与其他任务共用执行线程和准入控制），上传文件保存到任务目录
+            return start_hls_render(file, params['vis_types'], params['profile'],
+                                    params['max_height'], params['output_fps'])
         
-        # 生成输出文件名
-        output_filename = f"vis_{vis_type}_{filename}"
-        output_path = os.path.join(OUTPUT_DIR, output_filename)
-        
-        # 确保输出目录存在
-        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        # 上传时已写入唯一命名的暂存文件并计算了内容哈希
+        upload = claim_upload(file)
+        temp_input = upload.path
+        cost = visualization_cost(temp_input, params['vis_types'])
         
         try:
-            print(f"🎬 开始生成{vis_type}可视化视频...")
-            print(f"📁 输入: {temp_input}")
-            print(f"📁 输出: {output_path}")
-            
-            # 生成可视化视频
-            result = volleyball_service.generate_visualization_video(
-                video_path=temp_input,
-                output_path=output_path,
-                vis_type=vis_type,
-                detect_ball=True,
-                highlight_ball=True
-            )
-            
-            print(f"✅ 生成完成: {result.get('success', False)}")
-            
-            if result['success']:
-                # 检查文件是否真的生成了
-                if os.path.exists(output_path):
-                    file_size = os.path.getsize(output_path) / (1024 * 1024)
-                    print(f"📦 文件大小: {file_size:.2f} MB")
-                    
-                    return jsonify({
-                        'success': True,
-                        'video_url': f'/api/output/{output_filename}',
-                        'filename': output_filename,
-                        'vis_type': vis_type,
-                        'file_size_mb': round(file_size, 2)
-                    })
-                else:
-                    return jsonify({
-                        'success': False,
-                        'error': '视频生成成功但文件未找到'
-                    }), 500
-            else:
-                return jsonify(result), 500
-                
-        except Exception as e:
-            print(f"❌ 生成失败: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            return jsonify({
-                'success': False,
-                'error': f'生成失败: {str(e)}'
-            }), 500
+            cancel_token = CancelToken(DEADLINE_CONFIG['request_seconds'])
+            with admitted(cost, cancel_token=cancel_token):
+                response, status = run_visualization(
+                    temp_input, output_name(upload.sha256, upload.filename), params['vis_types'],
+                    params['profile'], params['max_height'], params['output_fps'],
+                    cancel_token=cancel_token, content_digest=upload.sha256,
+                    model_wait=DEADLINE_CONFIG['model_wait_seconds']
+                )
+            if response.get('busy'):
+                return models_busy_response(response)
+            return jsonify(response), status
         finally:
             if os.path.exists(temp_input):
                 try:
@@ -358,6 +756,8 @@ def visualize_video():
                 except:
                     pass
     
+    except AdmissionRejected as e:
+        return busy_response(e)
     except Exception as e:
         print(f"❌ 请求处理失败: {str(e)}")
         return jsonify({
@@ -366,6 +766,431 @@ def visualize_video():
         }), 500
 
 
+def output_name(sha256, filename):
+    """输出文件名带上内容哈希前缀，不同视频同名上传时互不覆盖"""
+    return f"{sha256[:12]}_{filename}"
+
+
+def run_visualization(temp_input, filename, vis_types, profile, max_height, output_fps,
+                      progress_callback=None, cancel_token=None, content_digest=None, model_wait=None):
+    """
+    生成 MP4 可视化视频并组装响应
+
+    Args:
+        filename: 输出文件名的基础部分
+        content_digest: 输入视频的 SHA-256（上传时已计算）
+        model_wait: 等待模型的最长秒数，None 时一直等待（后台任务）
+
+    Returns:
+        (response, status): 响应字典和 HTTP 状态码
+    """
+    # 生成输出文件名（不同档位/尺寸/帧率的结果分开保存）
+    variant = ''
+    if profile != DEFAULT_ENCODE_PROFILE:
+        variant += f"{profile}_"
+    if (max_height, output_fps) != (VISUALIZATION_CONFIG['max_height'], VISUALIZATION_CONFIG['output_fps']):
+        variant += f"{max_height}p{output_fps}_"
+    output_filenames = {t: f"vis_{t}_{variant}{filename}" for t in vis_types}
+    output_paths = {t: os.path.join(OUTPUT_DIR, name) for t, name in output_filenames.items()}
+    
+    # 确保输出目录存在
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    
+    try:
+        print(f"🎬 开始生成{', '.join(vis_types)}可视化视频...")
+        print(f"📁 输入: {temp_input}")
+        
+        # 一次分析生成所有请求的可视化视频
+        result = volleyball_service.generate_visualization_videos(
+            video_path=temp_input,
+            output_paths=output_paths,
+            detect_ball=True,
+            highlight_ball=True,
+            profile=profile,
+            max_height=max_height,
+            output_fps=output_fps,
+            progress_callback=progress_callback,
+            cancel_token=cancel_token,
+            content_digest=content_digest,
+            model_wait=model_wait
+        )
+        
+        print(f"✅ 生成完成: {result.get('success', False)}")
+        
+        if not result['success']:
+            if result.get('busy'):
+                return result, 503
+            return result, 504 if result.get('timeout') else 500
+        
+        videos = {}
+        for vis_type, output_path in output_paths.items():
+            # 检查文件是否真的生成了
+            if not os.path.exists(output_path):
+                return {
+                    'success': False,
+                    'error': '视频生成成功但文件未找到'
+                }, 500
+            file_size = os.path.getsize(output_path) / (1024 * 1024)
+            print(f"📦 {vis_type} 文件大小: {file_size:.2f} MB")
+            videos[vis_type] = {
+                'video_url': f'/api/output/{output_filenames[vis_type]}',
+                'filename': output_filenames[vis_type],
+                'vis_type': vis_type,
+                'file_size_mb': round(file_size, 2)
+            }
+        
+        # 顶层字段保持单个视频的响应格式（第一个类型）
+        response = dict(videos[vis_types[0]])
+        response['success'] = True
+        response['profile'] = profile
+        response['max_height'] = max_height
+        response['output_fps'] = output_fps
+        # 之后可用 /api/visualize/landmarks 直接渲染骨架 / 轨迹视频
+        response['landmarks_id'] = result.get('landmarks_id')
+        response['videos'] = videos
+        return response, 200
+            
+    except Exception as e:
+        print(f"❌ 生成失败: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return {
+            'success': False,
+            'error': f'生成失败: {str(e)}'
+        }, 500
+
+
+def _hls_playlist_paths(render_id, vis_types):
+    return {t: os.path.join(HLS_CONFIG['directory'], render_id, t, 'playlist.m3u8') for t in vis_types}
+
+
+def _hls_videos(render_id, vis_types):
+    videos = {}
+    for vis_type in vis_types:
+        playlist_url = f'/api/output/hls/{render_id}/{vis_type}/playlist.m3u8'
+        videos[vis_type] = {
+            'video_url': playlist_url,
+            'playlist_url': playlist_url,
+            'vis_type': vis_type,
+            'format': 'hls'
+        }
+    return videos
+
+
+def start_hls_render(file, vis_types, profile, max_height, output_fps):
+    """
+    提交 HLS 渲染任务，首个播放列表发布后立即返回地址，之后由任务队列继续生成
+
+    每次渲染使用独立的 render_id 目录，分片地址不会复用，反向代理可以长期缓存；
+    渲染进度也可以用返回的 job_id 通过 /api/jobs/<job_id> 查询
+    """
+    job_id = uuid.uuid4().hex
+    render_id = uuid.uuid4().hex
+    filename = secure_filename(file.filename)
+    upload = claim_upload(file, str(_job_upload_path(job_id, filename)))
+    params = {
+        'job_id': job_id, 'filename': filename, 'sha256': upload.sha256, 'render_id': render_id,
+        'vis_types': vis_types, 'profile': profile, 'max_height': max_height, 'output_fps': output_fps
+    }
+    try:
+        job_queue.submit('hls', params, job_id=job_id)
+    except QueueFullError as e:
+        _remove_job_upload(job_id)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 429
+    output_paths = _hls_playlist_paths(render_id, vis_types)
+
+    # 等到每个类型的播放列表都出现（首个分片已发布），或任务提前结束
+    deadline = time.time() + HLS_CONFIG['first_segment_timeout']
+    job = job_queue.get(job_id)
+    while job is not None and job['status'] not in FINISHED_STATES and time.time() < deadline:
+        if all(os.path.exists(path) for path in output_paths.values()):
+            break
+        time.sleep(0.2)
+        job = job_queue.get(job_id)
+
+    done = job is not None and job['status'] in FINISHED_STATES
+    if done and job['status'] != SUCCEEDED:
+        return jsonify({
+            'success': False,
+            'error': job.get('error') or '生成失败'
+        }), 500
+    if not all(os.path.exists(path) for path in output_paths.values()):
+        # 客户端拿不到播放地址，后台渲染没有意义
+        job_queue.cancel(job_id)
+        return jsonify({
+            'success': False,
+            'error': '等待首个视频分片超时'
+        }), 504
+
+    videos = _hls_videos(render_id, vis_types)
+    response = dict(videos[vis_types[0]])
+    response.update({
+        'success': True,
+        'render_id': render_id,
+        'job_id': job_id,
+        'status_url': f'/api/jobs/{job_id}',
+        'status': 'done' if done else 'rendering',
+        'profile': profile,
+        'max_height': max_height,
+        'output_fps': output_fps,
+        'videos': videos
+    })
+    if done:
+        response['landmarks_id'] = (job.get('result') or {}).get('landmarks_id')
+    return jsonify(response)
+
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """
+    提交后台任务，立即返回 job_id
+    type=analyze：参数同 /api/analyze/video
+    type=visualize：参数同 /api/visualize/video（不支持 format=hls）
+    之后用 GET /api/jobs/<job_id> 查询进度和结果
+    """
+    try:
+        job_type = request.form.get('type', 'analyze')
+        if job_type not in ('analyze', 'visualize'):
+            return jsonify({
+                'success': False,
+                'error': '不支持的任务类型。支持: analyze, visualize'
+            }), 400
+        
+        if 'video' not in request.files:
+            return jsonify({
+                'success': False,
+                'error': '请上传视频文件'
+            }), 400
+        
+        file = request.files['video']
+        if not allowed_file(file.filename):
+            return jsonify({
+                'success': False,
+                'error': '不支持的文件格式，请上传MP4、AVI、MOV或MKV格式'
+            }), 400
+        
+        if job_type == 'analyze':
+            params, error = parse_analysis_params()
+        else:
+            params, error = parse_visualization_params()
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }), 400
+        if job_type == 'visualize' and params.pop('format') != 'mp4':
+            return jsonify({
+                'success': False,
+                'error': '后台任务只支持 mp4 输出，HLS 请使用 /api/visualize/video'
+            }), 400
+        
+        # 上传的视频保存到任务目录，任务结束或过期时删除
+        job_id = uuid.uuid4().hex
+        filename = secure_filename(file.filename)
+        upload = claim_upload(file, str(_job_upload_path(job_id, filename)))
+        params.update(job_id=job_id, filename=filename, sha256=upload.sha256)
+        
+        try:
+            job_queue.submit(job_type, params, job_id=job_id)
+        except QueueFullError as e:
+            _remove_job_upload(job_id)
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 429
+        
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'status': 'queued',
+            'status_url': f'/api/jobs/{job_id}'
+        }), 202
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'服务器错误: {str(e)}'
+        }), 500
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """
+    查询任务状态：status（queued / running / cancelling / succeeded / failed / cancelled）、
+    progress、result、error
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({
+            'success': False,
+            'error': '任务不存在或已过期'
+        }), 404
+    job['success'] = True
+    return respond(job)
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """
+    取消任务：排队中的任务直接取消；执行中的任务在下一个批次之前停下，编码中的 ffmpeg 进程被终止
+    前端在页面关闭时用 navigator.sendBeacon 调用
+    """
+    status = job_queue.cancel(job_id)
+    if status is None:
+        return jsonify({
+            'success': False,
+            'error': '任务不存在或已过期'
+        }), 404
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status': status
+    })
+
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """
+    任务进度的 Server-Sent Events 流
+    - progress：状态或进度变化（含已解码 / 已分析帧数、球检出率等统计）
+    - score：当前最佳帧得分变化（第一次得到得分估计时立即推送）
+    - done：任务结束，data 与 GET /api/jobs/<job_id> 相同，之后关闭连接
+    单个连接最长 events_max_seconds，到时关闭，EventSource 会自动重连并从当前状态继续
+    """
+    if job_queue.get(job_id) is None:
+        return jsonify({
+            'success': False,
+            'error': '任务不存在或已过期'
+        }), 404
+    
+    def generate():
+        deadline = time.time() + JOB_CONFIG['events_max_seconds']
+        last_progress = last_score = None
+        last_sent = time.time()
+        yield "retry: 1000\n\n"
+        while True:
+            job = job_queue.get(job_id)
+            if job is None:
+                yield _sse('done', {'success': False, 'status': 'failed', 'error': '任务不存在或已过期'})
+                return
+            if job['status'] in FINISHED_STATES:
+                job['success'] = True
+                yield _sse('done', job)
+                return
+            
+            progress = {'status': job['status'], 'progress': job['progress'],
+                        'queue_position': job.get('queue_position')}
+            if progress != last_progress:
+                last_progress = progress
+                last_sent = time.time()
+                yield _sse('progress', progress)
+            
+            stats = job['progress'].get('stats') or {}
+            if stats.get('best_score') is not None:
+                score = {k: stats.get(k) for k in ('best_score', 'best_frame_idx', 'ball_detection_rate')}
+                if score['best_score'] != (last_score or {}).get('best_score'):
+                    last_score = score
+                    last_sent = time.time()
+                    yield _sse('score', score)
+            
+            now = time.time()
+            if now >= deadline:
+                return
+            if now - last_sent >= JOB_CONFIG['events_heartbeat']:
+                last_sent = now
+                yield ": heartbeat\n\n"
+            time.sleep(JOB_CONFIG['events_interval'])
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # 关闭 nginx 缓冲，事件立即送达
+    })
+
+
+@app.route('/api/visualize/landmarks', methods=['POST'])
+def visualize_landmarks():
+    """
+    用缓存的关键点序列生成骨架 / 轨迹视频，不需要重新上传和解码视频
+    参数（表单或 JSON）：landmarks_id（/api/visualize/video 返回）、vis_types（skeleton,trajectory）、profile
+    """
+    try:
+        params = request.get_json(silent=True) or request.form
+        landmarks_id = params.get('landmarks_id', '')
+        if not volleyball_service.landmark_store or not volleyball_service.landmark_store.is_valid_id(landmarks_id):
+            return jsonify({
+                'success': False,
+                'error': '缺少或无效的 landmarks_id'
+            }), 400
+        
+        vis_types = params.get('vis_types') or params.get('vis_type') or 'skeleton'
+        if isinstance(vis_types, str):
+            vis_types = [t.strip() for t in vis_types.split(',') if t.strip()]
+        vis_types = list(dict.fromkeys(vis_types))
+        valid_types = ['skeleton', 'trajectory']
+        invalid_types = [t for t in vis_types if t not in valid_types]
+        if not vis_types or invalid_types:
+            return jsonify({
+                'success': False,
+                'error': f'关键点渲染只支持: {", ".join(valid_types)}'
+            }), 400
+        
+        profile = params.get('profile') or DEFAULT_ENCODE_PROFILE
+        if profile not in ENCODE_PROFILES:
+            return jsonify({
+                'success': False,
+                'error': f'不支持的编码档位。支持: {", ".join(ENCODE_PROFILES)}'
+            }), 400
+        
+        variant = '' if profile == DEFAULT_ENCODE_PROFILE else f"{profile}_"
+        output_filenames = {t: f"vis_{t}_{variant}{landmarks_id}.mp4" for t in vis_types}
+        output_paths = {t: os.path.join(OUTPUT_DIR, name) for t, name in output_filenames.items()}
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        
+        cancel_token = CancelToken(DEADLINE_CONFIG['request_seconds'])
+        with admitted(landmarks_render_cost(vis_types), cancel_token=cancel_token):
+            result = volleyball_service.render_from_landmarks(
+                landmarks_id, output_paths, highlight_ball=True, profile=profile,
+                cancel_token=cancel_token
+            )
+        if not result['success']:
+            if result.get('timeout'):
+                return jsonify(result), 504
+            return jsonify(result), 404 if result.get('not_found') else 500
+        
+        videos = {}
+        for vis_type, output_path in output_paths.items():
+            file_size = os.path.getsize(output_path) / (1024 * 1024)
+            videos[vis_type] = {
+                'video_url': f'/api/output/{output_filenames[vis_type]}',
+                'filename': output_filenames[vis_type],
+                'vis_type': vis_type,
+                'file_size_mb': round(file_size, 2)
+            }
+        
+        response = dict(videos[vis_types[0]])
+        response['success'] = True
+        response['profile'] = profile
+        response['landmarks_id'] = landmarks_id
+        response['videos'] = videos
+        return jsonify(response)
+    
+    except AdmissionRejected as e:
+        return busy_response(e)
+    except Exception as e:
+        print(f"❌ 关键点渲染失败: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': f'服务器错误: {str(e)}'
+        }), 500
+
+
 @app.route('/api/output/<filename>')
 def get_output_file(filename):
     """获取输出文件"""
@@ -375,6 +1200,54 @@ def get_output_file(filename):
         return jsonify({'error': '文件不存在'}), 404
 
 
+@app.route('/api/output/previews/<filename>')
+def get_preview_file(filename):
+    """分析预览（动画 WebP / GIF、雪碧图），文件名随机且内容不变，可长期缓存"""
+    try:
+        response = send_from_directory(PREVIEW_CONFIG['directory'], secure_filename(filename))
+    except Exception:
+        return jsonify({'error': '文件不存在'}), 404
+    response.headers['Cache-Control'] = 'public, max-age=86400, immutable'
+    return response
+
+
+@app.route('/api/output/images/<filename>')
+def get_result_image(filename):
+    """分析结果图像，文件名为内容哈希，可长期缓存"""
+    try:
+        response = send_from_directory(IMAGE_CONFIG['directory'], secure_filename(filename))
+    except Exception:
+        return jsonify({'error': '文件不存在'}), 404
+    response.headers['Cache-Control'] = f"public, max-age={IMAGE_CONFIG['max_age']}, immutable"
+    return response
+
+
+@app.route('/api/output/hls/<render_id>/<vis_type>/<segment>')
+def get_hls_file(render_id, vis_type, segment):
+    """
+    HLS 播放列表和分片
+
+    分片和 init.mp4 写完后不再变化，允许反向代理长期缓存；
+    播放列表在生成过程中不断追加，结束（#EXT-X-ENDLIST）前只短暂缓存
+    """
+    directory = os.path.join(HLS_CONFIG['directory'], secure_filename(render_id), secure_filename(vis_type))
+    segment = secure_filename(segment)
+    path = os.path.join(directory, segment)
+    if not os.path.isfile(path):
+        return jsonify({'error': '文件不存在'}), 404
+
+    if segment.endswith('.m3u8'):
+        with open(path, 'r', encoding='utf-8') as f:
+            finished = '#EXT-X-ENDLIST' in f.read()
+        response = send_from_directory(directory, segment, mimetype='application/vnd.apple.mpegurl')
+        max_age = HLS_CONFIG['segment_max_age'] if finished else HLS_CONFIG['live_playlist_max_age']
+        response.headers['Cache-Control'] = f'public, max-age={max_age}'
+    else:
+        response = send_from_directory(directory, segment, mimetype='video/mp4')
+        response.headers['Cache-Control'] = f"public, max-age={HLS_CONFIG['segment_max_age']}, immutable"
+    return response
+
+
 @app.route('/api/tactics/questions', methods=['GET'])
 def get_tactics_questions():
     """获取战术题库"""
@@ -0,0 +1,243 @@
+"""
+分析结果的响应格式与序列化
+
+响应格式版本（请求参数 schema，默认 2）：
+
+- 1：旧格式。landmarks 为 str(dict)，序列模式原样返回 frames_data / ball_detections 等嵌套结构
+- 2：紧凑格式，所有字段都是 JSON 原生类型，浮点数按精度取整，逐帧数据按列存放：
+    schema_version: 2
+    landmarks:        最佳帧关键点 {names: [K], x: [K], y: [K], z: [K], visibility: [K]} 或 null
+    ball_detection:   最佳帧排球 {label, score, bbox: [4], center: [x, y]} 或 null
+    frames:           逐帧结果（序列模式）
+        {count, frame_idx: [N], has_pose: [N],
+         landmarks: {names: [K], x: [N][K], y: [N][K], z: [N][K], visibility: [N][K]}}
+        没有姿态的帧在 x / y / z / visibility 中为 null
+    ball_detections:  所有排球检测结果展开成一张表（序列模式）
+        {frame: [M], score: [M], center_x: [M], center_y: [M], bbox: [M][4]}
+    trajectories:     {关键点: {x: [N], y: [N], visibility: [N]}}，不可见处为 null
+    ball_trajectory:  {x: [N], y: [N], confidence: [N]}，未检出处为 null
+  其余字段（score、sequence_scores、图像地址、preview 等）与旧格式相同
+
+序列化：
+- FastJSONProvider：安装了 orjson 时用 orjson 编码（原生支持 numpy 数组 / 标量和 dataclass），
+  否则退回标准库 json 并把 numpy 类型转成内置类型
+- respond()：请求头 Accept 为 application/msgpack 且安装了 msgpack 时返回 MessagePack
+"""
+import dataclasses
+import json
+
+import numpy as np
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+SCHEMA_VERSION = 2
+SUPPORTED_SCHEMA_VERSIONS = (1, 2)
+MSGPACK_MIMETYPE = 'application/msgpack'
+
+# 取整精度：归一化坐标 4 位小数（4K 画面下约 0.4 像素），置信度 3 位
+COORD_DIGITS = 4
+SCORE_DIGITS = 3
+
+
+def _to_builtin(value):
+    """numpy 类型、dataclass 转成内置类型"""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return dataclasses.asdict(value)
+    raise TypeError(f"无法序列化 {type(value).__name__}")
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """jsonify 使用的 JSON 编码（app.json = FastJSONProvider(app)）"""
+
+    def dumps(self, obj, **kwargs):
+        if orjson is not None and not kwargs:
+            return self._orjson_dumps(obj).decode('utf-8')
+        kwargs.setdefault('default', _to_builtin)
+        kwargs.setdefault('ensure_ascii', False)
+        return json.dumps(obj, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = args[0] if len(args) == 1 else (args or kwargs)
+        if orjson is not None:
+            data = self._orjson_dumps(obj)
+        else:
+            data = self.dumps(obj)
+        return self._app.response_class(data, mimetype=self.mimetype)
+
+    @staticmethod
+    def _orjson_dumps(obj):
+        return orjson.dumps(
+            obj, default=_to_builtin,
+            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        )
+
+
+def respond(payload, status=200):
+    """按 Accept 头返回 MessagePack 或 JSON"""
+    from flask import current_app, jsonify
+    if msgpack is not None and request.accept_mimetypes.best == MSGPACK_MIMETYPE:
+        data = msgpack.packb(payload, default=_to_builtin, use_bin_type=True)
+        return current_app.response_class(data, status=status, mimetype=MSGPACK_MIMETYPE)
+    return jsonify(payload), status
+
+
+def parse_schema_version(value):
+    """
+    Returns:
+        (version, error)
+    """
+    if value in (None, ''):
+        return SCHEMA_VERSION, None
+    try:
+        version = int(value)
+    except (TypeError, ValueError):
+        version = None
+    if version not in SUPPORTED_SCHEMA_VERSIONS:
+        supported = ', '.join(str(v) for v in SUPPORTED_SCHEMA_VERSIONS)
+        return None, f'不支持的响应格式版本。支持: {supported}'
+    return version, None
+
+
+# ----------------- 紧凑格式 -----------------
+
+def _round_list(values, digits):
+    """数值列表取整，None / NaN 保留为 None"""
+    array = np.array([np.nan if v is None else v for v in values], dtype=float)
+    rounded = np.round(array, digits).tolist()
+    return [None if v != v else v for v in rounded]
+
+
+def _landmark_names(landmarks_list):
+    for landmarks in landmarks_list:
+        if landmarks:
+            return list(landmarks)
+    return []
+
+
+def compact_landmarks(landmarks):
+    """单帧关键点 dict → {names, x, y, z, visibility}"""
+    if not landmarks:
+        return None
+    names = list(landmarks)
+    table = np.array([[landmarks[n].get(k, np.nan) for k in ('x', 'y', 'z', 'visibility')] for n in names],
+                     dtype=float)
+    return {
+        'names': names,
+        'x': np.round(table[:, 0], COORD_DIGITS).tolist(),
+        'y': np.round(table[:, 1], COORD_DIGITS).tolist(),
+        'z': np.round(table[:, 2], COORD_DIGITS).tolist(),
+        'visibility': np.round(table[:, 3], SCORE_DIGITS).tolist(),
+    }
+
+
+def compact_frames(frames_data):
+    """逐帧结果按列存放"""
+    landmarks_list = [frame.get('landmarks') for frame in frames_data]
+    names = _landmark_names(landmarks_list)
+    columns = {'x': [], 'y': [], 'z': [], 'visibility': []}
+    for landmarks in landmarks_list:
+        compact = compact_landmarks({n: landmarks[n] for n in names if n in landmarks}) \
+            if landmarks else None
+        for key, column in columns.items():
+            column.append(compact[key] if compact else None)
+    return {
+        'count': len(frames_data),
+        'frame_idx': [int(frame.get('frame_idx', i)) for i, frame in enumerate(frames_data)],
+        'has_pose': [bool(frame.get('has_pose', frame.get('landmarks') is not None)) for frame in frames_data],
+        'landmarks': dict(names=names, **columns),
+    }
+
+
+def compact_ball_detections(frames_data):
+    """所有帧的排球检测结果展开成一张表"""
+    table = {'frame': [], 'score': [], 'center_x': [], 'center_y': [], 'bbox': []}
+    for i, frame in enumerate(frames_data):
+        for detection in frame.get('ball_detections') or []:
+            table['frame'].append(int(frame.get('frame_idx', i)))
+            table['score'].append(detection['score'])
+            table['center_x'].append(detection['center']['x'])
+            table['center_y'].append(detection['center']['y'])
+            table['bbox'].append([int(v) for v in detection['bbox']])
+    table['score'] = _round_list(table['score'], SCORE_DIGITS)
+    table['center_x'] = _round_list(table['center_x'], COORD_DIGITS)
+    table['center_y'] = _round_list(table['center_y'], COORD_DIGITS)
+    return table
+
+
+def compact_ball_detection(detection):
+    """单个排球检测结果（VolleyballDetection 或 dict）"""
+    if detection is None:
+        return None
+    if dataclasses.is_dataclass(detection):
+        center = detection.center
+        detection = dataclasses.asdict(detection)
+        detection['center'] = {'x': center[0], 'y': center[1]}
+    center = detection.get('center') or {}
+    return {
+        'label': detection.get('label'),
+        'score': round(float(detection.get('score', 0)), SCORE_DIGITS),
+        'bbox': [int(v) for v in detection.get('bbox', ())],
+        'center': _round_list([center.get('x'), center.get('y')], COORD_DIGITS),
+    }
+
+
+def compact_trajectory(trajectory, digits_by_key):
+    return {key: _round_list(values, digits_by_key.get(key, COORD_DIGITS))
+            for key, values in trajectory.items()}
+
+
+def compact_analysis_result(result):
+    """已完成图像处理（serialize_analysis_result）的结果转换为 schema 2"""
+    result = dict(result)
+    result['schema_version'] = 2
+    result['landmarks'] = compact_landmarks(result.get('landmarks'))
+    if 'ball_detection' in result:
+        result['ball_detection'] = compact_ball_detection(result['ball_detection'])
+
+    frames_data = result.pop('frames_data', None)
+    if frames_data is not None:
+        result['frames'] = compact_frames(frames_data)
+        if result.get('ball_detection_enabled'):
+            result['ball_detections'] = compact_ball_detections(frames_data)
+        else:
+            result.pop('ball_detections', None)
+
+    if result.get('trajectories'):
+        result['trajectories'] = {
+            point: compact_trajectory(trajectory, {'visibility': SCORE_DIGITS})
+            for point, trajectory in result['trajectories'].items()
+        }
+    if result.get('ball_trajectory'):
+        result['ball_trajectory'] = compact_trajectory(
+            result['ball_trajectory'], {'confidence': SCORE_DIGITS}
+        )
+    return result
+
+
+def legacy_analysis_result(result):
+    """schema 1：保持旧接口的字段格式"""
+    result = dict(result)
+    result['schema_version'] = 1
+    if result.get('landmarks') is not None:
+        result['landmarks'] = str(result['landmarks'])
+    return result
+
+
+def format_analysis_result(result, version=SCHEMA_VERSION):
+    if version == 1:
+        return legacy_analysis_result(result)
+    return compact_analysis_result(result)
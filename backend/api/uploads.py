@@ -0,0 +1,139 @@
+"""
+上传处理模块 - 请求体按块直接写入唯一的暂存文件
+
+- SpoolingRequest：替换 Flask 默认的文件流，multipart 解析时每个上传文件直接写入
+  spool_dir 下以随机名命名的文件，不再经过内存 / 系统临时文件再 file.save() 复制一遍；
+  同名文件并发上传互不覆盖
+- 写入的同时计算 SHA-256（关键点缓存等按内容寻址的地方不用再读一遍文件）、
+  累计大小，超过上限立即中止（413），不必等整个文件传完
+- 处理函数用 claim_upload() 认领暂存文件（可移动到任务目录）；请求结束时未认领的暂存文件自动删除
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional
+
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.utils import secure_filename
+
+from backend.core.landmark_store import video_digest
+
+
+@dataclass
+class Upload:
+    """已认领的上传文件"""
+    path: str        # 文件路径
+    filename: str    # 客户端文件名（secure_filename 处理后）
+    sha256: str      # 内容哈希
+    size: int        # 字节数
+
+
+class SpoolFile:
+    """边写边计算哈希和大小的暂存文件"""
+
+    def __init__(self, path: Path, max_bytes: Optional[int] = None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.claimed = False
+        self._hash = hashlib.sha256()
+        self._file = open(path, 'w+b')
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_bytes and self.size > self.max_bytes:
+            raise RequestEntityTooLarge()
+        self._hash.update(data)
+        return self._file.write(data)
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+    def __getattr__(self, name):
+        # read / seek / close 等直接交给底层文件
+        return getattr(self._file, name)
+
+
+class SpoolingRequest(Request):
+    """上传文件直接写入 spool_dir 的请求类（app.request_class = SpoolingRequest）"""
+
+    spool_dir: Optional[Path] = None
+    max_file_bytes: Optional[int] = None
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if not hasattr(self, '_spool_files'):
+            self._spool_files: List[SpoolFile] = []
+        directory = Path(self.spool_dir or tempfile.gettempdir())
+        directory.mkdir(parents=True, exist_ok=True)
+        suffix = os.path.splitext(secure_filename(filename or ''))[1].lower()
+        spool = SpoolFile(directory / f"{uuid.uuid4().hex}{suffix}", self.max_file_bytes)
+        self._spool_files.append(spool)
+        return spool
+
+    def close(self):
+        super().close()
+        # 删除没有被认领的暂存文件（校验失败、处理出错等）
+        for spool in getattr(self, '_spool_files', []):
+            if not spool.claimed:
+                spool._file.close()
+                try:
+                    os.remove(spool.path)
+                except OSError:
+                    pass
+
+
+def configure_uploads(app, spool_dir, max_file_size_mb, form_overhead_bytes=1 << 20):
+    """
+    启用暂存上传
+
+    Args:
+        spool_dir: 暂存目录（与任务上传目录放在同一文件系统时认领只需改名）
+        max_file_size_mb: 单个文件大小上限；请求体上限额外留出表单字段的余量，
+            带 Content-Length 的超大请求在读取前就被拒绝
+    """
+    max_bytes = int(max_file_size_mb * 1024 * 1024)
+    SpoolingRequest.spool_dir = Path(spool_dir)
+    SpoolingRequest.max_file_bytes = max_bytes
+    app.request_class = SpoolingRequest
+    app.config['MAX_CONTENT_LENGTH'] = max_bytes + form_overhead_bytes
+
+
+def claim_upload(file_storage, destination: Optional[str] = None) -> Upload:
+    """
+    认领上传文件
+
+    Args:
+        file_storage: request.files 中的 FileStorage
+        destination: 目标路径，None 时留在暂存目录（调用方负责删除）
+
+    Returns:
+        Upload
+    """
+    filename = secure_filename(file_storage.filename or '') or 'video'
+    spool = file_storage.stream
+    if not isinstance(spool, SpoolFile):
+        # 未启用 SpoolingRequest 时退回复制保存
+        if destination is None:
+            raise ValueError("未启用暂存上传时必须指定保存路径")
+        file_storage.save(destination)
+        return Upload(path=str(destination), filename=filename,
+                      sha256=video_digest(destination), size=os.path.getsize(destination))
+
+    spool.flush()
+    spool._file.close()
+    path = str(spool.path)
+    if destination is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(destination)), exist_ok=True)
+        try:
+            os.replace(path, destination)
+        except OSError:
+            # 跨文件系统时只能复制
+            shutil.move(path, destination)
+        path = str(destination)
+    spool.claimed = True
+    return Upload(path=path, filename=filename, sha256=spool.hexdigest(), size=spool.size)
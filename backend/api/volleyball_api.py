@@ -19,9 +19,15 @@ from config.settings import OUTPUT_DIR
 class VolleyballAPI:
     """排球动作识别API类"""
     
-    def __init__(self):
-        """初始化API"""
-        self.service = VolleyballService()
+    def __init__(self, service=None):
+        """
+        初始化API
+
+        Args:
+            service: 复用已创建的 VolleyballService（Flask 应用传入自己的服务，不再加载第二份模型）；
+                None 时新建
+        """
+        self.service = service if service is not None else VolleyballService()
     
     def analyze_uploaded_video(self, uploaded_file, analysis_mode="single"):
         """
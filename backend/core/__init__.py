@@ -1,24 +1,38 @@
-"""核心功能模块"""
-from .pose_detector import PoseDetector
-from .video_processor import VideoProcessor
-from .scorer import VolleyballScorer
-from .scorer_v2 import VolleyballScorerV2
-from .scorer_v3 import VolleyballScorerV3
-from .sequence_analyzer import SequenceAnalyzer
-from .trajectory_visualizer import TrajectoryVisualizer
-from .video_generator import VideoGenerator
-from .volleyball_detector import VolleyballDetector, VolleyballDetection
+"""
+核心功能模块
 
-__all__ = [
-    'PoseDetector', 
-    'VideoProcessor', 
-    'VolleyballScorer',
-    'VolleyballScorerV2',
-    'VolleyballScorerV3',
-    'SequenceAnalyzer',
-    'TrajectoryVisualizer',
-    'VideoGenerator',
-    'VolleyballDetector',
-    'VolleyballDetection'
-]
+导出的类按需导入（PEP 562）：只用到 cancellation、batch_tuner 等纯 Python 模块时
+不会连带加载 cv2 / torch / MediaPipe
+"""
+import importlib
 
+_EXPORTS = {
+    'PoseDetector': '.pose_detector',
+    'VideoProcessor': '.video_processor',
+    'VolleyballScorer': '.scorer',
+    'VolleyballScorerV2': '.scorer_v2',
+    'VolleyballScorerV3': '.scorer_v3',
+    'SequenceAnalyzer': '.sequence_analyzer',
+    'TrajectoryVisualizer': '.trajectory_visualizer',
+    'VideoGenerator': '.video_generator',
+    'VolleyballDetector': '.volleyball_detector',
+    'VolleyballDetection': '.volleyball_detector',
+    'DetectionSession': '.volleyball_detector',
+    'BatchSizeTuner': '.batch_tuner',
+    'LandmarkStore': '.landmark_store',
+    'PreviewGenerator': '.preview_generator',
+    'ImageStore': '.image_store',
+    'CancelToken': '.cancellation',
+    'OperationCancelled': '.cancellation',
+    'DeadlineExceeded': '.cancellation',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
@@ -0,0 +1,270 @@
+"""
+批大小调优模块 - 根据实测吞吐和内存余量为检测模型选择 batch 大小
+
+- 预热时用实际模型和推理尺寸依次测试若干候选 batch，取内存上限内吞吐最高的一档
+- 结果按 主机 + 模型 + 推理尺寸 + 设备 持久化到 JSON 文件，重启后直接复用
+- 运行时遇到内存不足时减半并写回，后续请求不再触发同样的 OOM
+"""
+import json
+import os
+import socket
+import threading
+import time
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence
+
+
+def read_memory_limit_mb() -> Optional[float]:
+    """容器内存上限（cgroup v2 / v1），读不到时退回物理内存大小"""
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value.isdigit() and int(value) < (1 << 60):
+            return int(value) / (1024 * 1024)
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def _read_proc_status_mb(field: str) -> Optional[float]:
+    """读取 /proc/self/status 中的内存字段（VmRSS 等），单位 MB"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+class PeakRSSSampler:
+    """
+    后台线程周期性采样 VmRSS，记录区间内的峰值
+
+    VmHWM 是进程生命周期内的峰值、只增不减，会被模型加载或之前的候选主导，不能按候选区分
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = float(interval)
+        self.peak_mb = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _sample(self) -> None:
+        rss = _read_proc_status_mb("VmRSS")
+        if rss is not None and rss > self.peak_mb:
+            self.peak_mb = rss
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self) -> "PeakRSSSampler":
+        self._sample()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+
+def is_out_of_memory(exc: BaseException) -> bool:
+    """判断异常是否为内存/显存不足"""
+    if isinstance(exc, MemoryError):
+        return True
+    message = str(exc).lower()
+    return isinstance(exc, RuntimeError) and (
+        "out of memory" in message or "cannot allocate memory" in message
+        or "can't allocate memory" in message
+    )
+
+
+class BatchSizeTuner:
+    """按主机和模型记忆最优 batch 大小"""
+
+    def __init__(
+        self,
+        cache_file,
+        candidates: Sequence[int] = (4, 8, 16, 32, 64),
+        memory_ceiling_mb: Optional[float] = None,
+        memory_fraction: float = 0.6,
+        default_batch: int = 64,
+        repeats: int = 2,
+        bench_frame_shape: Sequence[int] = (720, 1280, 3),
+        enabled: bool = True,
+        workers: int = 1,
+    ):
+        """
+        Args:
+            cache_file: 调优结果持久化文件（JSON）
+            candidates: 候选 batch 大小
+            memory_ceiling_mb: 推理可用内存上限；None 时按 memory_fraction 估算
+            memory_fraction: 未指定上限时，可用内存占（每个 worker 分到的）总内存的比例
+            default_batch: 未调优或调优关闭时使用的 batch 大小
+            repeats: 每个候选计时的重复次数
+            bench_frame_shape: 基准测试使用的帧尺寸 (H, W, C)
+            enabled: 关闭后始终返回 default_batch（OOM 回退仍然生效）
+            workers: 同一容器内的 worker 进程数，CPU 上按此平分容器内存
+        """
+        self.cache_file = Path(cache_file)
+        self.candidates = sorted(int(c) for c in candidates)
+        self.memory_ceiling_mb = memory_ceiling_mb
+        self.memory_fraction = float(memory_fraction)
+        self.default_batch = int(default_batch)
+        self.repeats = max(1, int(repeats))
+        self.bench_frame_shape = tuple(bench_frame_shape)
+        self.enabled = bool(enabled)
+        self.workers = max(1, int(workers))
+        self._lock = threading.Lock()
+        self._entries: Dict[str, dict] = self._load()
+
+    def make_key(self, model_id: str, input_size: int, device: str) -> str:
+        return f"{socket.gethostname()}|{model_id}|{input_size}|{device}"
+
+    def get(self, key: str) -> Optional[int]:
+        entry = self._entries.get(key)
+        return int(entry["batch_size"]) if entry else None
+
+    def describe(self, key: str) -> dict:
+        """诊断信息：当前 batch 大小及其来源"""
+        entry = self._entries.get(key)
+        if not entry:
+            return {"batch_size": self.default_batch, "source": "default"}
+        return {
+            "batch_size": int(entry["batch_size"]),
+            "source": entry.get("source", "tuned"),
+            "throughput_fps": entry.get("throughput_fps"),
+        }
+
+    def tune(self, key: str, run_batch: Callable[[int], None], device: str = "cpu") -> int:
+        """
+        依次测试候选 batch，返回内存上限内吞吐最高的一档并持久化
+
+        Args:
+            key: make_key() 生成的键
+            run_batch: run_batch(n) 用 n 帧跑一次完整推理
+            device: 'cpu' 或 'cuda:0' 等
+        """
+        if not self.enabled:
+            return self.default_batch
+
+        ceiling = self._memory_ceiling_mb(device)
+        on_gpu = device.startswith("cuda")
+        # CPU：以调优开始前（模型已加载）的 RSS 为基线，每个候选运行期间采样 RSS 峰值
+        cpu_baseline = 0.0 if on_gpu else (_read_proc_status_mb("VmRSS") or 0.0)
+        best_batch, best_fps = self.candidates[0], 0.0
+        measurements: List[dict] = []
+
+        for n in self.candidates:
+            sampler = None if on_gpu else PeakRSSSampler()
+            try:
+                with sampler or nullcontext():
+                    run_batch(n)  # 首次运行包含内核选择/内存分配，不计时
+                    baseline = self._gpu_baseline_mb() if on_gpu else cpu_baseline
+                    start = time.perf_counter()
+                    for _ in range(self.repeats):
+                        run_batch(n)
+                    elapsed = time.perf_counter() - start
+                if on_gpu:
+                    used = self._gpu_used_mb(baseline)
+                else:
+                    used = max(0.0, sampler.peak_mb - baseline)
+            except Exception as exc:
+                if is_out_of_memory(exc):
+                    print(f"[BatchSizeTuner] batch={n} 内存不足，停止继续增大")
+                    self._release_cache(device)
+                    break
+                raise
+
+            fps = n * self.repeats / max(elapsed, 1e-6)
+            measurements.append({"batch": n, "fps": round(fps, 1), "memory_mb": round(used, 1)})
+            if ceiling is not None and used > ceiling:
+                break
+            if fps > best_fps * 1.05:
+                best_batch, best_fps = n, fps
+            elif fps < best_fps * 0.9:
+                # 已经越过吞吐拐点
+                break
+
+        print(f"[BatchSizeTuner] {key} -> batch={best_batch} ({best_fps:.1f} fps)")
+        self._store(key, {
+            "batch_size": best_batch,
+            "source": "tuned",
+            "throughput_fps": round(best_fps, 1),
+            "memory_ceiling_mb": round(ceiling, 1) if ceiling is not None else None,
+            "measurements": measurements,
+            "tuned_at": int(time.time()),
+        })
+        return best_batch
+
+    def back_off(self, key: str, current: int) -> int:
+        """运行时 OOM：batch 减半并持久化"""
+        smaller = max(1, int(current) // 2)
+        entry = dict(self._entries.get(key, {}))
+        entry.update({"batch_size": smaller, "source": "backoff", "tuned_at": int(time.time())})
+        self._store(key, entry)
+        print(f"[BatchSizeTuner] 内存不足，batch {current} -> {smaller}")
+        return smaller
+
+    # ----------------- 内部工具 -----------------
+
+    def _memory_ceiling_mb(self, device: str) -> Optional[float]:
+        if self.memory_ceiling_mb:
+            return float(self.memory_ceiling_mb)
+        if device.startswith("cuda"):
+            import torch
+            total = torch.cuda.get_device_properties(torch.device(device)).total_memory
+            return total / (1024 * 1024) * self.memory_fraction
+        limit = read_memory_limit_mb()
+        if limit is None:
+            return None
+        return limit / self.workers * self.memory_fraction
+
+    @staticmethod
+    def _gpu_baseline_mb() -> float:
+        import torch
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        return torch.cuda.memory_allocated() / (1024 * 1024)
+
+    @staticmethod
+    def _gpu_used_mb(baseline: float) -> float:
+        import torch
+        torch.cuda.synchronize()
+        return torch.cuda.max_memory_allocated() / (1024 * 1024) - baseline
+
+    @staticmethod
+    def _release_cache(device: str) -> None:
+        if device.startswith("cuda"):
+            import torch
+            torch.cuda.empty_cache()
+
+    def _load(self) -> Dict[str, dict]:
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _store(self, key: str, entry: dict) -> None:
+        with self._lock:
+            # 合并其他进程写入的结果，再原子替换
+            entries = self._load()
+            entries.update(self._entries)
+            entries[key] = entry
+            self._entries = entries
+            self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.cache_file.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entries, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.cache_file)
@@ -0,0 +1,70 @@
+"""
+取消与截止时间模块 - 长时间的分析 / 渲染在批次之间检查，客户端离开或超时后尽快停下
+
+- CancelToken：可由其他线程调用 cancel()，也可带截止时间（deadline）
+- 流水线各阶段在每个批次 / 每帧之间调用 token.check()，已取消或超时时抛出 OperationCancelled
+- 视频生成捕获异常后会终止 ffmpeg 子进程并删除不完整的输出
+"""
+import threading
+import time
+from typing import Optional
+
+
+class OperationCancelled(Exception):
+    """操作被取消"""
+
+    def __init__(self, reason='已取消'):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class DeadlineExceeded(OperationCancelled):
+    """超过截止时间"""
+
+    def __init__(self, reason='处理超时'):
+        super().__init__(reason)
+
+
+class CancelToken:
+    """取消令牌（线程安全）"""
+
+    def __init__(self, timeout: Optional[float] = None):
+        """
+        Args:
+            timeout: 从现在起的最长处理时间（秒），None 时不设截止时间
+        """
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self._event = threading.Event()
+        self._reason = None
+
+    def cancel(self, reason='已取消'):
+        if not self._event.is_set():
+            self._reason = reason
+            self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    @property
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def remaining(self) -> Optional[float]:
+        """距截止时间的秒数，没有截止时间时返回 None"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def check(self):
+        """已取消或超时时抛出 OperationCancelled / DeadlineExceeded"""
+        if self._event.is_set():
+            raise OperationCancelled(self._reason)
+        if self.expired:
+            raise DeadlineExceeded()
+
+
+def check_cancelled(cancel_token: Optional[CancelToken]):
+    """cancel_token 为 None 时不做任何检查"""
+    if cancel_token is not None:
+        cancel_token.check()
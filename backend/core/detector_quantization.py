@@ -0,0 +1,386 @@
+"""
+检测器量化模块 - 为纯 CPU 部署构建 INT8 版本的 YOLOv7 排球检测器
+
+流程：
+1. 复制浮点模型，用 Model.fuse()（fuse_conv_and_bn + Conv.fuseforward）融合 Conv/BN
+2. 把连续的可量化层（卷积 + 可量化激活、池化、上采样、Concat）划为同一段 INT8 区域，
+   只在区域入口量化、出口反量化，段内张量保持 INT8；检测头保持浮点
+3. 用从用户上传视频中采集的帧做静态量化校准
+4. 在带标注的帧集合上对比浮点/INT8 的命中率，精度下降在阈值内才启用
+5. 量化权重缓存在 best.pt 旁边（best.int8.pt），下次启动直接加载
+"""
+from __future__ import annotations
+
+import copy
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+import PIL
+import torch
+import torch.nn as nn
+from torch.ao.nn.quantized import FloatFunctional
+from torch.ao.quantization import QuantStub, QuantWrapper, convert, get_default_qconfig, prepare
+
+from models.common import MP, SP, Concat, Conv
+from .my_utils import calc_iou
+
+# 量化后可以直接跟在 INT8 卷积后面执行的激活函数
+QUANTIZABLE_ACTIVATIONS = (nn.ReLU, nn.LeakyReLU, nn.Hardswish)
+
+# 输入已经是 INT8 时可以直接在 INT8 域内执行的层（不改变量化参数或自带观察器）
+QUANTIZED_PASSTHROUGH = (MP, SP, nn.MaxPool2d, nn.Upsample, Concat)
+
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png")
+
+# INT8 模型结构版本：量化区域的划分方式变化后，旧缓存的 state_dict 不再适用
+QUANTIZED_LAYOUT_VERSION = 2
+
+
+def quantized_weights_path(weights_path) -> Path:
+    """best.pt -> best.int8.pt"""
+    weights_path = Path(weights_path)
+    return weights_path.with_name(f"{weights_path.stem}.int8{weights_path.suffix}")
+
+
+def select_quantized_engine() -> Optional[str]:
+    """选择当前 CPU 可用的量化后端：x86 用 fbgemm，ARM 用 qnnpack"""
+    engines = torch.backends.quantized.supported_engines
+    for engine in ("fbgemm", "x86", "qnnpack"):
+        if engine in engines:
+            return engine
+    return None
+
+
+def _source_signature(weights_path) -> Dict:
+    stat = os.stat(weights_path)
+    return {"size": stat.st_size, "mtime": int(stat.st_mtime)}
+
+
+def _files_digest(paths) -> str:
+    digest = hashlib.sha1()
+    for path in paths:
+        stat = path.stat()
+        digest.update(f"{path.name}:{stat.st_size}:{int(stat.st_mtime)}\n".encode())
+    return digest.hexdigest()
+
+
+def _cache_signature(weights_path, calibration_dir, labeled_dir, calibration_frames: int,
+                     input_sizes: Sequence[int], max_accuracy_drop: float) -> Dict:
+    """
+    量化缓存的键：浮点权重 + 校准帧 + 带标注帧集合 + 构建参数。
+    任一变化（例如补充了标注、放宽了 max_accuracy_drop）都会重新构建，包括之前精度检查没通过的结果
+    """
+    labels_file = Path(labeled_dir) / "labels.json"
+    return {
+        **_source_signature(weights_path),
+        "layout": QUANTIZED_LAYOUT_VERSION,
+        "calibration": _files_digest(_calibration_files(calibration_dir)[:calibration_frames]),
+        "labeled": _files_digest([labels_file] if labels_file.exists() else []),
+        "input_sizes": sorted(int(s) for s in input_sizes),
+        "max_accuracy_drop": float(max_accuracy_drop),
+    }
+
+
+class _QuantConcat(nn.Module):
+    """INT8 区域内的 Concat：FloatFunctional.cat 带观察器，拼接结果使用校准得到的量化参数"""
+
+    def __init__(self, concat: Concat):
+        super().__init__()
+        self.d = concat.d
+        self.cat = FloatFunctional()
+        # Model.forward_once 按这些属性路由各层输入、保存输出
+        for attr in ("f", "i", "type", "np"):
+            setattr(self, attr, getattr(concat, attr))
+
+    def forward(self, x):
+        return self.cat.cat(x, self.d)
+
+
+def _quantize_inputs(layer, args):
+    """INT8 区域入口：来自浮点层的输入在这里量化（其余位置是 Identity）"""
+    x = args[0]
+    if isinstance(x, list):
+        return ([stub(t) for stub, t in zip(layer.input_quant, x)],)
+    return (layer.input_quant[0](x),)
+
+
+def _dequantize_inputs(layer, args):
+    """INT8 区域出口：浮点层收到的 INT8 输入在这里反量化"""
+    x = args[0]
+    if isinstance(x, list):
+        return ([t.dequantize() if t.is_quantized else t for t in x],)
+    return (x.dequantize() if x.is_quantized else x,)
+
+
+def _layer_sources(layer, index: int) -> List[int]:
+    """Model.forward_once 中该层输入来自哪些层（-1 为上一层，负数结果表示模型输入图像）"""
+    sources = layer.f if isinstance(layer.f, list) else [layer.f]
+    return [index - 1 if j == -1 else j for j in sources]
+
+
+def _is_int8_layer(layer, sources: List[int], int8: List[bool]) -> bool:
+    if type(layer) is Conv:
+        return not hasattr(layer, "bn") and isinstance(layer.act, QUANTIZABLE_ACTIVATIONS)
+    if isinstance(layer, QUANTIZED_PASSTHROUGH):
+        # 池化 / 上采样 / 拼接只在所有输入都已是 INT8 时留在 INT8 域，不为它们单独量化
+        return all(j >= 0 and int8[j] for j in sources)
+    return False
+
+
+def _prepare_quantizable(hub_model, engine: str):
+    """
+    融合 Conv/BN，按 Model.forward_once 的数据流划分 INT8 区域并插入观察器。
+    hub_model 是 autoShape 包装后的模型，会被原地修改。
+
+    YOLOv7-tiny 的 Conv 都是 LeakyReLU，整个 backbone + neck 是一段连续的 INT8 区域，
+    只有模型输入处量化一次、送入检测头之前反量化；
+    激活不可量化的 Conv（如 SiLU）和其他复合层保持浮点，其中的卷积仍单独包进 QuantWrapper
+    """
+    model = hub_model.model  # autoShape -> Model
+    model.fuse()
+
+    qconfig = get_default_qconfig(engine)
+    layers = model.model
+    int8: List[bool] = []
+    for index, layer in enumerate(layers):
+        sources = _layer_sources(layer, index)
+        is_int8 = _is_int8_layer(layer, sources, int8)
+        int8.append(is_int8)
+        from_int8 = [j >= 0 and int8[j] for j in sources]
+
+        if not is_int8:
+            if any(from_int8):
+                layer.register_forward_pre_hook(_dequantize_inputs)
+            for m in layer.modules():
+                if type(m) is not Conv or hasattr(m, "bn"):
+                    continue
+                m.conv = QuantWrapper(m.conv)
+                m.conv.qconfig = qconfig
+            continue
+
+        if isinstance(layer, Concat):
+            layer = _QuantConcat(layer)
+            layers[index] = layer
+        if not all(from_int8):
+            layer.input_quant = nn.ModuleList(nn.Identity() if q else QuantStub() for q in from_int8)
+            layer.register_forward_pre_hook(_quantize_inputs)
+        layer.qconfig = qconfig
+
+    prepare(model, inplace=True)
+    return hub_model
+
+
+def load_calibration_images(directory, limit: int) -> List[np.ndarray]:
+    """读取校准帧（BGR），按文件名排序，最多 limit 张"""
+    directory = Path(directory)
+    if not directory.exists():
+        return []
+    images = []
+    for path in _calibration_files(directory):
+        image = cv2.imread(str(path))
+        if image is not None:
+            images.append(image)
+        if len(images) >= limit:
+            break
+    return images
+
+
+def _calibration_files(directory) -> List[Path]:
+    directory = Path(directory)
+    if not directory.exists():
+        return []
+    return sorted(p for p in directory.iterdir() if p.suffix.lower() in IMAGE_SUFFIXES)
+
+
+def count_calibration_images(directory) -> int:
+    return len(_calibration_files(directory))
+
+
+def save_calibration_frame(frame: np.ndarray, directory, limit: int) -> bool:
+    """
+    把一帧用户上传视频中的原始帧保存为校准样本（达到 limit 后不再保存）
+
+    Returns:
+        bool: 是否保存成功
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    if count_calibration_images(directory) >= limit:
+        return False
+    name = f"calib_{time.time_ns()}.jpg"
+    return bool(cv2.imwrite(str(directory / name), frame, [cv2.IMWRITE_JPEG_QUALITY, 90]))
+
+
+def _predict(hub_model, frames: Sequence[np.ndarray], size: int):
+    pil_images = [PIL.Image.fromarray(cv2.cvtColor(f, cv2.COLOR_BGR2RGB)) for f in frames]
+    with torch.inference_mode():
+        return hub_model(pil_images, size=size)
+
+
+def _calibrate(hub_model, images: Sequence[np.ndarray], sizes: Sequence[int], batch_size: int = 8) -> None:
+    """在不同推理尺寸之间轮换，让观察器覆盖自适应尺寸的取值范围"""
+    for k, start in enumerate(range(0, len(images), batch_size)):
+        size = sizes[k % len(sizes)]
+        _predict(hub_model, images[start:start + batch_size], size)
+
+
+def load_labeled_set(directory, limit: int = 200) -> List[Tuple[np.ndarray, Optional[List[float]]]]:
+    """
+    读取带标注的帧集合：directory/labels.json 形如
+        {"frame_0001.jpg": [x_min, y_min, x_max, y_max], "frame_0002.jpg": null, ...}
+    null 表示该帧没有球。
+    """
+    directory = Path(directory)
+    labels_file = directory / "labels.json"
+    if not labels_file.exists():
+        return []
+    with open(labels_file, "r", encoding="utf-8") as f:
+        labels = json.load(f)
+
+    samples = []
+    for name, bbox in sorted(labels.items()):
+        image = cv2.imread(str(directory / name))
+        if image is None:
+            continue
+        samples.append((image, list(bbox) if bbox else None))
+        if len(samples) >= limit:
+            break
+    return samples
+
+
+def evaluate_accuracy(hub_model, samples, size: int, iou_threshold: float = 0.5) -> float:
+    """
+    命中率：有球的帧最佳框与标注 IoU >= iou_threshold，无球的帧没有检测结果，均记为正确
+    """
+    if not samples:
+        return 0.0
+    correct = 0
+    for start in range(0, len(samples), 8):
+        chunk = samples[start:start + 8]
+        preds = _predict(hub_model, [image for image, _ in chunk], size)
+        for i, (_, label) in enumerate(chunk):
+            arr = preds.pred[i].cpu().numpy()
+            if label is None:
+                correct += int(arr.shape[0] == 0)
+            elif arr.shape[0] > 0:
+                correct += int(calc_iou(arr[0][:4], label) >= iou_threshold)
+    return correct / len(samples)
+
+
+def build_quantized_detector(hub_model, engine: str, calibration_images, sizes: Sequence[int]):
+    """复制浮点模型并完成 融合 -> 插入观察器 -> 校准 -> 转换"""
+    torch.backends.quantized.engine = engine
+    quantized = _prepare_quantizable(copy.deepcopy(hub_model), engine)
+    _calibrate(quantized, calibration_images, sizes)
+    convert(quantized.model, inplace=True)
+    return quantized
+
+
+def _restore_quantized_detector(hub_model, engine: str, state_dict):
+    """按缓存重建 INT8 结构后加载量化权重（不需要重新校准）"""
+    torch.backends.quantized.engine = engine
+    quantized = _prepare_quantizable(copy.deepcopy(hub_model), engine)
+    convert(quantized.model, inplace=True)
+    quantized.model.load_state_dict(state_dict)
+    return quantized
+
+
+def load_or_build_quantized(
+    hub_model,
+    weights_path,
+    calibration_dir,
+    labeled_dir,
+    calibration_frames: int = 64,
+    input_sizes: Sequence[int] = (640,),
+    max_accuracy_drop: float = 0.02,
+):
+    """
+    返回用于推理的检测器：量化版本通过精度检查时返回 INT8 模型，否则返回原浮点模型。
+
+    Args:
+        hub_model: custom() 返回的 autoShape 浮点模型（CPU）
+        weights_path: 浮点权重 best.pt 路径，量化缓存写在它旁边
+        calibration_dir: 校准帧目录（从用户上传视频中采集）
+        labeled_dir: 带标注帧目录（labels.json），用于决定是否启用量化模型
+        calibration_frames: 校准所需帧数，不足时继续使用浮点模型
+        input_sizes: 校准时轮换使用的推理尺寸
+        max_accuracy_drop: 允许的命中率下降（绝对值）
+
+    Returns:
+        (model, report): report 记录是否启用及精度对比
+    """
+    engine = select_quantized_engine()
+    report = {"quantized": False, "engine": engine}
+    if engine is None:
+        report["reason"] = "当前 PyTorch 不支持量化后端"
+        return hub_model, report
+
+    cache_path = quantized_weights_path(weights_path)
+    signature = _cache_signature(weights_path, calibration_dir, labeled_dir, calibration_frames,
+                                 input_sizes, max_accuracy_drop)
+
+    if cache_path.exists():
+        cached = torch.load(cache_path, map_location="cpu")
+        if cached.get("source") == signature and cached.get("engine") == engine:
+            report.update(cached.get("report", {}))
+            if not cached.get("accepted"):
+                # 同样的权重、校准数据和阈值下精度检查没通过，不再重复构建
+                return hub_model, report
+            try:
+                model = _restore_quantized_detector(hub_model, engine, cached["state_dict"])
+                model.conf = hub_model.conf
+                report["quantized"] = True
+                return model, report
+            except Exception as exc:
+                print(f"⚠️ 加载量化缓存失败，重新构建: {exc}")
+
+    available = count_calibration_images(calibration_dir)
+    if available < calibration_frames:
+        report["reason"] = f"校准帧不足 ({available}/{calibration_frames})"
+        return hub_model, report
+
+    samples = load_labeled_set(labeled_dir)
+    if not samples:
+        report["reason"] = "缺少带标注的帧集合，无法做精度检查"
+        return hub_model, report
+
+    t0 = time.time()
+    images = load_calibration_images(calibration_dir, calibration_frames)
+    quantized = build_quantized_detector(hub_model, engine, images, list(input_sizes))
+    quantized.conf = hub_model.conf
+    build_seconds = time.time() - t0
+
+    size = max(input_sizes)
+    float_acc = evaluate_accuracy(hub_model, samples, size)
+    int8_acc = evaluate_accuracy(quantized, samples, size)
+    accepted = int8_acc >= float_acc - max_accuracy_drop
+
+    report.update({
+        "float_accuracy": round(float_acc, 4),
+        "int8_accuracy": round(int8_acc, 4),
+        "labeled_frames": len(samples),
+        "calibration_frames": len(images),
+        "build_seconds": round(build_seconds, 1),
+    })
+    torch.save({
+        "source": signature,
+        "engine": engine,
+        "accepted": accepted,
+        "report": dict(report),
+        "state_dict": quantized.model.state_dict() if accepted else None,
+    }, cache_path)
+
+    print(f"[Quantization] 浮点命中率 {float_acc:.3f}, INT8 命中率 {int8_acc:.3f}, "
+          f"{'启用' if accepted else '放弃'} INT8 检测器")
+    if not accepted:
+        report["reason"] = "INT8 精度下降超过阈值"
+        return hub_model, report
+
+    report["quantized"] = True
+    return quantized, report
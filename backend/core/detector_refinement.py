@@ -0,0 +1,207 @@
+"""
+检测精修模块 - 高精度模式下只对置信度模糊的帧追加 TTA / 多权重集成推理
+
+流程：
+1. 快速模型照常推理（NMS 阈值降到模糊区间下限，保留低置信度候选框）
+2. 按每帧最高置信度分流：高于区间上限直接采用，低于下限视为无球，落在区间内的帧才精修
+3. 精修来源：同一模型的测试时增强（Model.forward(augment=True)：左右翻转 + 多尺度）
+   以及额外的集成权重，各来源的检测框用加权框融合（WBF）合并；
+   精修只能补回快速模型漏掉的球：快速模型本身已过阈值的框不会因其他来源未检出而被丢弃
+4. 统计额外推理的帧数、次数和耗时（每个视频一份，由调用方传入），随检测器诊断信息返回
+"""
+from __future__ import annotations
+
+import time
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .my_utils import RoboYOLO, calc_iou, custom
+
+# (x_min, y_min, x_max, y_max, conf)
+Box = Tuple[float, float, float, float, float]
+
+
+def _top_boxes(pred, max_boxes: int) -> List[Box]:
+    """Detections.pred[i]（已按置信度降序）-> 前 max_boxes 个框"""
+    arr = pred.cpu().numpy() if hasattr(pred, "cpu") else np.asarray(pred)
+    return [tuple(float(v) for v in row[:5]) for row in arr[:max_boxes]]
+
+
+def weighted_box_fusion(
+    box_lists: Sequence[Sequence[Box]],
+    iou_threshold: float = 0.55,
+) -> List[Tuple[List[float], float, int]]:
+    """
+    加权框融合：把多个来源的检测框按 IoU 聚类，坐标按置信度加权平均
+
+    Args:
+        box_lists: 每个来源一个框列表 [(x_min, y_min, x_max, y_max, conf), ...]
+        iou_threshold: 与聚类融合框的 IoU 达到该值时归为同一目标
+
+    Returns:
+        [(box, conf, num_sources), ...]，按融合置信度降序；
+        只被部分来源检出的框，置信度按 检出来源数 / 来源总数 折减
+    """
+    num_sources = max(1, len(box_lists))
+    candidates = sorted(
+        ((box, source) for source, boxes in enumerate(box_lists) for box in boxes),
+        key=lambda item: -item[0][4],
+    )
+
+    clusters = []
+    for box, source in candidates:
+        match, best_iou = None, iou_threshold
+        for cluster in clusters:
+            iou = calc_iou(cluster["fused"], box)
+            if iou >= best_iou:
+                match, best_iou = cluster, iou
+        if match is None:
+            clusters.append({"members": [box], "sources": {source}, "fused": list(box[:4])})
+            continue
+        match["members"].append(box)
+        match["sources"].add(source)
+        weights = np.array([m[4] for m in match["members"]])
+        coords = np.array([m[:4] for m in match["members"]])
+        match["fused"] = list((coords * weights[:, None]).sum(0) / weights.sum())
+
+    fused = []
+    for cluster in clusters:
+        confs = [m[4] for m in cluster["members"]]
+        conf = float(np.mean(confs)) * len(cluster["sources"]) / num_sources
+        fused.append((cluster["fused"], conf, len(cluster["sources"])))
+    return sorted(fused, key=lambda item: -item[1])
+
+
+class AccuracyRefiner:
+    """对置信度模糊的帧做 TTA / 集成推理并融合结果"""
+
+    def __init__(
+        self,
+        detector: RoboYOLO,
+        score_threshold: float,
+        ambiguous_low: float = 0.15,
+        ambiguous_high: float = 0.6,
+        tta: bool = True,
+        ensemble_weights: Sequence[str] = (),
+        fusion_iou: float = 0.55,
+        max_boxes: int = 5,
+    ):
+        """
+        Args:
+            detector: 快速模型（yolov7 的 RoboYOLO 封装），TTA 也用它
+            score_threshold: 最终采用检测结果的置信度阈值
+            ambiguous_low / ambiguous_high: 最高置信度落在该区间的帧才精修
+            tta: 是否做测试时增强
+            ensemble_weights: 额外参与集成的 YOLOv7 权重路径
+            fusion_iou: WBF 聚类 IoU 阈值
+            max_boxes: 每个来源每帧参与融合的框数
+        """
+        self.detector = detector
+        self.score_threshold = float(score_threshold)
+        self.ambiguous_low = float(ambiguous_low)
+        self.ambiguous_high = float(ambiguous_high)
+        self.tta = bool(tta)
+        self.fusion_iou = float(fusion_iou)
+        self.max_boxes = int(max_boxes)
+
+        self.ensemble: List[RoboYOLO] = []
+        for weights in ensemble_weights:
+            model = custom(path_or_model=str(weights))
+            model.conf = self.ambiguous_low
+            self.ensemble.append(RoboYOLO("yolov7", model, self.ambiguous_low))
+
+    @property
+    def passes_per_frame(self) -> int:
+        return int(self.tta) + len(self.ensemble)
+
+    @staticmethod
+    def new_stats() -> dict:
+        """一个视频的精修统计，传给 refine() 累加"""
+        return {
+            "frames": 0,
+            "ambiguous_frames": 0,
+            "accepted_after_refine": 0,
+            "extra_passes": 0,
+            "extra_ms": 0.0,
+        }
+
+    def get_stats(self, stats: dict) -> dict:
+        stats = dict(stats)
+        stats["extra_ms"] = round(stats["extra_ms"], 1)
+        stats["passes_per_ambiguous_frame"] = self.passes_per_frame
+        stats["ambiguous_range"] = [self.ambiguous_low, self.ambiguous_high]
+        stats["extra_passes_per_frame"] = round(
+            stats["extra_passes"] / stats["frames"], 3) if stats["frames"] else 0.0
+        return stats
+
+    def refine(
+        self,
+        frames: Sequence[np.ndarray],
+        preds,
+        size: int,
+        stats: Optional[dict] = None,
+    ) -> List[Tuple[Tuple[int, int, int, int], float]]:
+        """
+        Args:
+            frames: 快速模型这一批的 BGR 帧
+            preds: 快速模型的 Detections（NMS 阈值为 ambiguous_low）
+            size: 推理尺寸
+            stats: new_stats() 创建的统计字典，原地累加；None 时不统计
+
+        Returns:
+            每帧一个 ((x0, y0, w, h), score)，无球时为 ((0, 0, 0, 0), 0.0)
+        """
+        fast_boxes = [_top_boxes(preds.pred[i], self.max_boxes) for i in range(len(frames))]
+        results = []
+        ambiguous = []
+        for i, boxes in enumerate(fast_boxes):
+            top = boxes[0][4] if boxes else 0.0
+            if self.ambiguous_low <= top < self.ambiguous_high and self.passes_per_frame:
+                ambiguous.append(i)
+                results.append(None)
+            elif top >= self.score_threshold:
+                results.append(self._to_xywh(boxes[0], top))
+            else:
+                results.append(((0, 0, 0, 0), 0.0))
+
+        if stats is None:
+            stats = self.new_stats()
+        stats["frames"] += len(frames)
+        if not ambiguous:
+            return results
+
+        t0 = time.perf_counter()
+        sub_frames = [frames[i] for i in ambiguous]
+        sources = [[fast_boxes[i] for i in ambiguous]]
+        if self.tta:
+            tta_preds = self.detector.predict_batch(sub_frames, size=size, augment=True,
+                                                    conf=self.ambiguous_low)
+            sources.append([_top_boxes(p, self.max_boxes) for p in tta_preds.pred])
+        for model in self.ensemble:
+            ens_preds = model.predict_batch(sub_frames, size=size)
+            sources.append([_top_boxes(p, self.max_boxes) for p in ens_preds.pred])
+
+        for k, i in enumerate(ambiguous):
+            fused = weighted_box_fusion([source[k] for source in sources], self.fusion_iou)
+            fast_top = fast_boxes[i][0] if fast_boxes[i] else None
+            # WBF 按检出来源数折减置信度，快速模型也是来源之一：TTA 漏检时 0.55 会被折成 0.275，
+            # 快速模式下本会采用的帧在高精度模式下反而丢失；融合结果更低时保留快速模型的框
+            if fast_top is not None and fast_top[4] >= self.score_threshold \
+                    and (not fused or fused[0][1] < fast_top[4]):
+                results[i] = self._to_xywh(fast_top, fast_top[4])
+            elif fused and fused[0][1] >= self.score_threshold:
+                results[i] = self._to_xywh(fused[0][0], fused[0][1])
+                stats["accepted_after_refine"] += 1
+            else:
+                results[i] = ((0, 0, 0, 0), 0.0)
+
+        stats["ambiguous_frames"] += len(ambiguous)
+        stats["extra_passes"] += len(ambiguous) * self.passes_per_frame
+        stats["extra_ms"] += (time.perf_counter() - t0) * 1000
+        return results
+
+    @staticmethod
+    def _to_xywh(box: Sequence[float], score: float) -> Tuple[Tuple[int, int, int, int], float]:
+        x_min, y_min, x_max, y_max = box[:4]
+        return (int(x_min), int(y_min), int(x_max - x_min), int(y_max - y_min)), float(score)
@@ -0,0 +1,73 @@
+"""
+结果图像存储模块 - 姿态图、轨迹图等分析结果图像编码一次写成文件，响应中只返回地址
+
+- cv2.imencode 直接编码 BGR 帧（JPEG / WebP），不再经过 RGB → PIL → base64
+- 文件名取编码后内容的哈希，同样的图像只保存一份，地址内容不变，可以长期缓存
+"""
+import hashlib
+import os
+from pathlib import Path
+from typing import Optional
+
+import cv2
+import numpy as np
+
+_FORMATS = {
+    'jpeg': ('.jpg', cv2.IMWRITE_JPEG_QUALITY),
+    'webp': ('.webp', cv2.IMWRITE_WEBP_QUALITY),
+}
+
+
+class ImageStore:
+    """按内容寻址的结果图像文件"""
+
+    def __init__(self, directory, image_format='jpeg', quality=90):
+        """
+        Args:
+            directory: 图像目录
+            image_format: jpeg / webp
+            quality: 编码质量（1-100）
+        """
+        if image_format not in _FORMATS:
+            raise ValueError(f"不支持的图像格式 {image_format}")
+        self.directory = Path(directory)
+        self.image_format = image_format
+        self.quality = int(quality)
+
+    def save(self, image) -> Optional[str]:
+        """
+        Args:
+            image: BGR np.ndarray 或 PIL Image（RGB）
+
+        Returns:
+            str: 文件名（相对 directory）；图像为空或编码失败时返回 None
+        """
+        frame = self._to_bgr(image)
+        if frame is None:
+            return None
+        suffix, quality_flag = _FORMATS[self.image_format]
+        ok, encoded = cv2.imencode(suffix, frame, [quality_flag, self.quality])
+        if not ok:
+            return None
+        data = encoded.tobytes()
+        filename = f"{hashlib.sha256(data).hexdigest()[:24]}{suffix}"
+        path = self.directory / filename
+        if not path.exists():
+            self.directory.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f"{filename}.{os.getpid()}.tmp")
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return filename
+
+    @staticmethod
+    def _to_bgr(image) -> Optional[np.ndarray]:
+        if image is None:
+            return None
+        if not isinstance(image, np.ndarray):
+            # PIL Image（如 TrajectoryVisualizer.create_trajectory_plot 的返回值）
+            image = np.asarray(image.convert('RGB'))
+            image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+        if image.size == 0:
+            return None
+        return image
@@ -0,0 +1,127 @@
+"""
+关键点序列缓存模块 - 保存可视化流程中算出的逐帧关键点，之后的骨架/轨迹渲染不再解码视频
+
+- 序列按 视频内容哈希 + 采样方式 存放（gzip JSON），同一视频同样的采样只分析一次
+- 序列 id 即 landmarks_id，前端拿到后可以直接请求只依赖关键点的视频类型
+- 超过 max_entries 时按最后访问时间淘汰
+"""
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+# landmarks_id 只允许这些字符，防止路径穿越
+_ID_PATTERN = re.compile(r'^[0-9a-f]{24}-\d+-\d+(-\d+)?$')
+
+
+def video_digest(video_path, chunk_size=1 << 20) -> str:
+    """视频文件内容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(video_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _to_builtin(value):
+    """numpy 标量等对象转成 JSON 可序列化的内置类型"""
+    if hasattr(value, 'item'):
+        return value.item()
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError(f"无法序列化 {type(value).__name__}")
+
+
+class LandmarkStore:
+    """逐帧关键点序列的磁盘缓存"""
+
+    def __init__(self, directory, max_entries=200):
+        """
+        Args:
+            directory: 缓存目录
+            max_entries: 最多保留的序列数
+        """
+        self.directory = Path(directory)
+        self.max_entries = int(max_entries)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_id(digest, frame_interval, max_frames, height=None) -> str:
+        """同一视频、同样的帧间隔 / 帧数上限 / 输出高度得到同一个 id"""
+        landmarks_id = f"{digest[:24]}-{int(frame_interval)}-{int(max_frames)}"
+        return f"{landmarks_id}-{int(height)}" if height else landmarks_id
+
+    @staticmethod
+    def has_ball_data(sequence) -> bool:
+        """序列记录时是否做了排球检测（旧版本缓存没有该字段，按未检测处理）"""
+        return bool(sequence.get('ball_detection'))
+
+    @staticmethod
+    def is_valid_id(landmarks_id) -> bool:
+        return bool(landmarks_id) and _ID_PATTERN.match(landmarks_id) is not None
+
+    def _path(self, landmarks_id) -> Path:
+        return self.directory / f"{landmarks_id}.json.gz"
+
+    def get(self, landmarks_id) -> Optional[dict]:
+        """
+        Returns:
+            dict: {id, fps, width, height, ball_detection, frames: [{landmarks, ball}], created_at}；
+            不存在时返回 None
+        """
+        if not self.is_valid_id(landmarks_id):
+            return None
+        path = self._path(landmarks_id)
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                sequence = json.load(f)
+        except (OSError, ValueError):
+            return None
+        try:
+            os.utime(path)  # 记录访问时间，淘汰时保留常用序列
+        except OSError:
+            pass
+        return sequence
+
+    def put(self, landmarks_id, fps, width, height, frames, ball_detection=False) -> str:
+        """
+        保存关键点序列
+
+        Args:
+            landmarks_id: make_id() 生成的 id
+            fps: 序列对应的输出帧率
+            width / height: 采样帧（缩放后）的尺寸，球框坐标以此为准
+            frames: [{'landmarks': dict 或 None, 'ball': [检测结果]}]
+            ball_detection: 记录时是否做了排球检测；为 False 时 ball 均为空，不能用于标出排球
+        """
+        sequence = {
+            'id': landmarks_id,
+            'fps': fps,
+            'width': int(width),
+            'height': int(height),
+            'ball_detection': bool(ball_detection),
+            'frames': frames,
+            'created_at': int(time.time()),
+        }
+        with self._lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            path = self._path(landmarks_id)
+            tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+            with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+                json.dump(sequence, f, ensure_ascii=False, default=_to_builtin)
+            os.replace(tmp_path, path)
+            self._prune()
+        return landmarks_id
+
+    def _prune(self):
+        entries = sorted(self.directory.glob('*.json.gz'), key=lambda p: p.stat().st_mtime)
+        for path in entries[:max(0, len(entries) - self.max_entries)]:
+            try:
+                path.unlink()
+            except OSError:
+                pass
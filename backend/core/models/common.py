@@ -1,4 +1,5 @@
 import math
+import time
 from copy import copy
 from pathlib import Path
 
@@ -942,18 +943,36 @@ class autoShape(nn.Module):
     conf = 0.25  # NMS confidence threshold
     iou = 0.45  # NMS IoU threshold
     classes = None  # (optional list) filter by class
+    pin_memory = False  # pinned host buffers + side CUDA stream for H2D copies (see accelerate())
+    channels_last = False  # feed NHWC-strided inputs to a channels_last model
 
     def __init__(self, model):
         super(autoShape, self).__init__()
         self.model = model.eval()
+        self._copy_stream = None
 
     def autoshape(self):
         # model already converted to model.autoshape()
         print('autoShape already enabled, skipping... ')
         return self
 
+    def accelerate(self, half=True, channels_last=True):
+        # GPU inference mode: fp16 weights, channels_last memory format, pinned inputs copied on a side stream
+        p = next(self.model.parameters())
+        if p.device.type == 'cpu':
+            print('accelerate() requires a CUDA device, skipping... ')
+            return self
+        if half:
+            self.model.half()
+        if channels_last:
+            self.model.to(memory_format=torch.channels_last)
+        self.channels_last = channels_last
+        self.pin_memory = True
+        self._copy_stream = torch.cuda.Stream(device=p.device)
+        return self
+
     @torch.no_grad()
-    def forward(self, imgs, size=640, augment=False, profile=False):
+    def forward(self, imgs, size=640, augment=False, profile=False, conf=None):
         # Inference from various sources. For height=640, width=1280, RGB images example inputs are:
         #   filename:   imgs = 'data/samples/zidane.jpg'
         #   URI:             = 'https://github.com/ultralytics/yolov5/releases/download/v1.0/zidane.jpg'
@@ -962,6 +981,7 @@ class autoShape(nn.Module):
         #   numpy:           = np.zeros((640,1280,3))  # HWC
         #   torch:           = torch.zeros(16,3,320,640)  # BCHW (scaled to size=640, 0-1 values)
         #   multiple:        = [Image.open('image1.jpg'), Image.open('image2.jpg'), ...]  # list of images
+        # conf: per-call NMS confidence threshold (None uses self.conf), so callers never mutate a shared model
 
         t = [time_synchronized()]
         p = next(self.model.parameters())  # for device and type
@@ -971,6 +991,41 @@ class autoShape(nn.Module):
                 return self.model(imgs.to(p.device).type_as(p), augment, profile)
 
         # Pre-process
+        imgs, x, shape0, shape1, files, n = self._preprocess(imgs, size)
+        x = self._to_device(x, p)
+        t.append(time_synchronized())
+
+        with amp.autocast(enabled=p.device.type != 'cpu'):
+            # Inference
+            y = self.model(x, augment, profile)[0]  # forward
+            t.append(time_synchronized())
+
+            # Post-process
+            return self._postprocess(y, imgs, shape0, shape1, files, n, t, x.shape, conf)
+
+    @torch.no_grad()
+    def forward_pipelined(self, batches, size=640, augment=False, conf=None):
+        # Pipelined inference over an iterable of image lists, yields one Detections per list.
+        # While batch k runs on the GPU, batch k+1 is letterboxed on the CPU and copied on the side stream.
+        p = next(self.model.parameters())
+        batches = iter(batches)
+        first = next(batches, None)
+        pending = self._stage(first, size, p) if first is not None else None
+        while pending is not None:
+            t0 = time.time()
+            imgs, x, shape0, shape1, files, n = pending
+            with amp.autocast(enabled=p.device.type != 'cpu'):
+                y = self.model(x, augment)[0]  # kernels are queued asynchronously
+            t1 = time.time()
+            following = next(batches, None)
+            pending = self._stage(following, size, p) if following is not None else None  # overlaps compute
+            yield self._postprocess(y, imgs, shape0, shape1, files, n, [t0, t0, t1], x.shape, conf)
+
+    def _stage(self, imgs, size, p):
+        imgs, x, shape0, shape1, files, n = self._preprocess(list(imgs), size)
+        return imgs, self._to_device(x, p), shape0, shape1, files, n
+
+    def _preprocess(self, imgs, size):
         n, imgs = (len(imgs), imgs) if isinstance(imgs, list) else (
             1, [imgs])  # number of images, list of images
         shape0, shape1, files = [], [], []  # image and inference shapes, filenames
@@ -998,23 +1053,33 @@ class autoShape(nn.Module):
              for im in imgs]  # pad
         x = np.stack(x, 0) if n > 1 else x[0][None]  # stack
         x = np.ascontiguousarray(x.transpose((0, 3, 1, 2)))  # BHWC to BCHW
-        x = torch.from_numpy(x).to(p.device).type_as(p) / \
-            255.  # uint8 to fp16/32
-        t.append(time_synchronized())
-
-        with amp.autocast(enabled=p.device.type != 'cpu'):
-            # Inference
-            y = self.model(x, augment, profile)[0]  # forward
-            t.append(time_synchronized())
+        return imgs, x, shape0, shape1, files, n
+
+    def _to_device(self, x, p):
+        x = torch.from_numpy(x)
+        if self.pin_memory and p.device.type != 'cpu':
+            # uint8 upload from pinned memory on the copy stream, compute stream waits on it
+            x = x.pin_memory()
+            with torch.cuda.stream(self._copy_stream):
+                x = x.to(p.device, non_blocking=True)
+            compute_stream = torch.cuda.current_stream(p.device)
+            compute_stream.wait_stream(self._copy_stream)
+            x.record_stream(compute_stream)
+        else:
+            x = x.to(p.device)
+        x = x.type_as(p) / 255.  # uint8 to fp16/32
+        if self.channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
+        return x
 
-            # Post-process
-            y = non_max_suppression(
-                y, conf_thres=self.conf, iou_thres=self.iou, classes=self.classes)  # NMS
-            for i in range(n):
-                scale_coords(shape1, y[i][:, :4], shape0[i])
+    def _postprocess(self, y, imgs, shape0, shape1, files, n, t, shape, conf=None):
+        y = non_max_suppression(
+            y, conf_thres=self.conf if conf is None else conf, iou_thres=self.iou, classes=self.classes)  # NMS
+        for i in range(n):
+            scale_coords(shape1, y[i][:, :4], shape0[i])
 
-            t.append(time_synchronized())
-            return Detections(imgs, y, files, t, self.names, x.shape)
+        t.append(time_synchronized())
+        return Detections(imgs, y, files, t, self.names, shape)
 
 
 class Detections:
@@ -156,6 +156,18 @@ def calc_distance(bbox1: Tuple[int, int, int, int],
     return distance
 
 
+def calc_iou(box1: Sequence[float], box2: Sequence[float]) -> float:
+    """
+    Calculate IoU of two boxes given as `x_min, y_min, x_max, y_max`
+    """
+    ix1, iy1 = max(box1[0], box2[0]), max(box1[1], box2[1])
+    ix2, iy2 = min(box1[2], box2[2]), min(box1[3], box2[3])
+    inter = max(0.0, ix2 - ix1) * max(0.0, iy2 - iy1)
+    union = (box1[2] - box1[0]) * (box1[3] - box1[1]) + \
+        (box2[2] - box2[0]) * (box2[3] - box2[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
 def calc_centroid(bbox):
     """
     Calculate the centroid of a given bounding box
@@ -215,7 +227,11 @@ class RoboYOLO:
         self.model = model
         self.conf = confidence
 
-    def predict(self, frame):
+    def predict(self, frame, size=640, conf=None):
+        """
+        size: YOLOv7 letterbox 推理尺寸（长边），roboflow 忽略该参数
+        conf: 本次调用的 NMS 置信度阈值，None 时使用模型默认值（不修改共享的模型）
+        """
         if self.name == 'roboflow':
             pred = self.model.predict(frame, confidence=self.conf)
             return pred
@@ -225,13 +241,15 @@ class RoboYOLO:
             im_pil = PIL.Image.fromarray(img)
             # 单帧也最好包一层 no_grad
             with torch.inference_mode():
-                pred = self.model(im_pil)
+                pred = self.model(im_pil, size=size, conf=conf)
             return pred
 
-    def predict_batch(self, frames: Sequence[np.ndarray]) -> Any:
+    def predict_batch(self, frames: Sequence[np.ndarray], size: int = 640, augment: bool = False,
+                      conf=None) -> Any:
         """
         批量预测：
-        - yolov7: 一次性吃多张 PIL.Image
+        - yolov7: 一次性吃多张 PIL.Image，按 size 做 letterbox；augment=True 时做测试时增强（翻转 + 多尺度）；
+          conf 为本次调用的 NMS 置信度阈值，None 时使用模型默认值
         - roboflow: 逐张 HTTP 调用
         """
         if self.name == 'roboflow':
@@ -250,10 +268,22 @@ class RoboYOLO:
 
             # ✅ 这里非常关键，加上 inference_mode，确保不建计算图
             with torch.inference_mode():
-                preds = self.model(pil_images)
+                preds = self.model(pil_images, size=size, augment=augment, conf=conf)
 
             return preds
 
+    def predict_batches(self, frame_batches, size: int = 640, conf=None):
+        """
+        流水线批量预测（仅 yolov7 GPU 加速模式）：
+        frame_batches 为 BGR 帧列表的可迭代对象，逐个 yield 每个 batch 的 Detections。
+        直接传 RGB ndarray，省去 PIL 中转。
+        """
+        rgb_batches = (
+            [cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) for frame in frames]
+            for frames in frame_batches
+        )
+        return self.model.forward_pipelined(rgb_batches, size=size, conf=conf)
+
 
 def get_circle(bbox: Tuple[int, int, int, int]):
     """
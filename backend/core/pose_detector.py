@@ -1,6 +1,8 @@
 """
 姿态识别模块 - 使用MediaPipe提取人体关键点
 """
+import time
+
 import cv2
 import mediapipe as mp
 import numpy as np
@@ -50,7 +52,24 @@ class PoseDetector:
         landmarks = self._extract_landmarks(results)
         
         return landmarks, annotated_image
-    
+
+    def warmup(self, frame_shape=(720, 1280, 3), iterations=2):
+        """
+        用空白帧跑几次推理，提前完成 MediaPipe 计算图初始化
+
+        Args:
+            frame_shape: 空白帧尺寸 (H, W, 3)
+            iterations: 推理次数（第一次初始化计算图，之后的用于确认稳定耗时）
+
+        Returns:
+            float: 总耗时（秒）
+        """
+        frame = np.zeros(tuple(frame_shape), dtype=np.uint8)
+        t0 = time.perf_counter()
+        for _ in range(max(1, int(iterations))):
+            self.pose.process(frame)
+        return time.perf_counter() - t0
+
     def _extract_landmarks(self, results):
         """提取关键点坐标"""
         if not results.pose_landmarks:
@@ -0,0 +1,135 @@
+"""
+预览生成模块 - 用分析流程保留下来的标注帧生成轻量预览
+
+- 动画 WebP（PIL 不支持 WebP 时退回 GIF）：N 帧均匀抽取、缩小，体积控制在几百 KB
+- 雪碧图（JPEG）：同样的 N 帧按网格拼成一张图，附带切片信息供前端逐格显示
+- 分析结束即可返回，移动端不必等完整的 H.264 视频
+"""
+import io
+import os
+import uuid
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+import cv2
+import numpy as np
+from PIL import Image, features
+
+
+class PreviewGenerator:
+    """动画 WebP / 雪碧图预览"""
+
+    def __init__(self, output_dir, num_frames=12, width=320, fps=6, quality=60,
+                 max_bytes=400 * 1024, sprite_columns=4):
+        """
+        Args:
+            output_dir: 预览文件目录
+            num_frames: 均匀抽取的帧数
+            width: 预览宽度（高度按比例）
+            fps: 动画播放帧率
+            quality: 初始编码质量，超出 max_bytes 时逐步降低
+            max_bytes: 动画预览的目标体积上限
+            sprite_columns: 雪碧图每行的格数
+        """
+        self.output_dir = Path(output_dir)
+        self.num_frames = max(1, int(num_frames))
+        self.width = int(width)
+        self.fps = max(1, int(fps))
+        self.quality = int(quality)
+        self.max_bytes = int(max_bytes)
+        self.sprite_columns = max(1, int(sprite_columns))
+        self.animation_format = 'WEBP' if features.check('webp_anim') else 'GIF'
+
+    def select_frames(self, frames: Sequence[np.ndarray]) -> List[np.ndarray]:
+        """均匀抽取 num_frames 帧并缩小到预览宽度（BGR）"""
+        frames = [f for f in frames if isinstance(f, np.ndarray) and f.size > 0]
+        if not frames:
+            return []
+        count = min(self.num_frames, len(frames))
+        indices = np.linspace(0, len(frames) - 1, count).round().astype(int)
+        selected = []
+        for i in indices:
+            frame = frames[i]
+            height, width = frame.shape[:2]
+            if width > self.width:
+                size = (self.width, max(1, int(height * self.width / width)))
+                frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+            selected.append(frame)
+        return selected
+
+    def generate(self, frames: Sequence[np.ndarray], name: Optional[str] = None) -> Optional[dict]:
+        """
+        Args:
+            frames: 标注后的 BGR 帧（分析流程保留的帧）
+            name: 文件名前缀，None 时随机生成
+
+        Returns:
+            dict: {animation, animation_format, animation_bytes, sprite, sprite_meta}，
+                文件名相对 output_dir；没有可用帧时返回 None
+        """
+        selected = self.select_frames(frames)
+        if not selected:
+            return None
+        name = name or uuid.uuid4().hex
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+
+        animation_name, animation_bytes = self._write_animation(selected, name)
+        sprite_name, sprite_meta = self._write_sprite(selected, name)
+        return {
+            'animation': animation_name,
+            'animation_format': self.animation_format.lower(),
+            'animation_bytes': animation_bytes,
+            'sprite': sprite_name,
+            'sprite_meta': sprite_meta,
+        }
+
+    def _write_animation(self, frames, name):
+        images = [Image.fromarray(cv2.cvtColor(f, cv2.COLOR_BGR2RGB)) for f in frames]
+        duration = int(1000 / self.fps)
+        suffix = '.webp' if self.animation_format == 'WEBP' else '.gif'
+
+        data = b''
+        # 体积超出上限时逐步降低质量（GIF 没有质量参数，只编码一次）
+        for quality in range(self.quality, 0, -15):
+            buffer = io.BytesIO()
+            images[0].save(buffer, format=self.animation_format, save_all=True,
+                           append_images=images[1:], duration=duration, loop=0,
+                           quality=quality, method=4)
+            data = buffer.getvalue()
+            if len(data) <= self.max_bytes or self.animation_format != 'WEBP':
+                break
+
+        filename = f"{name}{suffix}"
+        self._write_atomic(self.output_dir / filename, data)
+        return filename, len(data)
+
+    def _write_sprite(self, frames, name):
+        tile_h, tile_w = frames[0].shape[:2]
+        columns = min(self.sprite_columns, len(frames))
+        rows = -(-len(frames) // columns)
+        sheet = np.zeros((rows * tile_h, columns * tile_w, 3), dtype=np.uint8)
+        for i, frame in enumerate(frames):
+            r, c = divmod(i, columns)
+            tile = frame if frame.shape[:2] == (tile_h, tile_w) else cv2.resize(frame, (tile_w, tile_h))
+            sheet[r * tile_h:(r + 1) * tile_h, c * tile_w:(c + 1) * tile_w] = tile
+
+        ok, encoded = cv2.imencode('.jpg', sheet, [cv2.IMWRITE_JPEG_QUALITY, max(30, self.quality)])
+        if not ok:
+            raise RuntimeError("雪碧图编码失败")
+        filename = f"{name}_sprite.jpg"
+        self._write_atomic(self.output_dir / filename, encoded.tobytes())
+        return filename, {
+            'tile_width': tile_w,
+            'tile_height': tile_h,
+            'columns': columns,
+            'rows': rows,
+            'count': len(frames),
+            'fps': self.fps,
+        }
+
+    @staticmethod
+    def _write_atomic(path: Path, data: bytes):
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
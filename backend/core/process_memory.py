@@ -0,0 +1,71 @@
+"""
+进程内存统计模块 - 区分 worker 独占的内存和与其他进程共享的页面
+
+gunicorn preload 模式下模型权重在 master 中加载，fork 后以写时复制方式共享；
+RSS 会把共享页面重复计入每个 worker，判断还能多开几个 worker 时应看：
+- uss：进程独占的内存（Private_Clean + Private_Dirty），即每多一个 worker 增加的内存
+- pss：共享页面按共享进程数均摊后的内存，所有进程的 pss 之和约等于实际占用
+
+另提供进程存活判断：任务队列和准入控制用 "主机名:进程号" 标记执行者，
+执行进程被杀后据此清理它遗留的任务 / 票据
+"""
+import os
+import socket
+from typing import Optional
+
+_MB = 1024.0
+
+
+def process_memory(pid=None) -> Optional[dict]:
+    """
+    读取 /proc/<pid>/smaps_rollup（Linux 4.14+）
+
+    Args:
+        pid: 进程号，默认当前进程
+
+    Returns:
+        dict: {rss_mb, pss_mb, uss_mb, shared_mb, swap_mb}；非 Linux 或无法读取时返回 None
+    """
+    path = f"/proc/{pid or os.getpid()}/smaps_rollup"
+    fields = {}
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(':') and parts[1].isdigit():
+                    fields[parts[0][:-1]] = int(parts[1])   # kB
+    except OSError:
+        return None
+    if 'Rss' not in fields:
+        return None
+
+    private = fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)
+    shared = fields.get('Shared_Clean', 0) + fields.get('Shared_Dirty', 0)
+    return {
+        'rss_mb': round(fields['Rss'] / _MB, 1),
+        'pss_mb': round(fields.get('Pss', fields['Rss']) / _MB, 1),
+        'uss_mb': round(private / _MB, 1),
+        'shared_mb': round(shared / _MB, 1),
+        'swap_mb': round(fields.get('Swap', 0) / _MB, 1),
+    }
+
+
+def pid_alive(pid) -> bool:
+    """本机进程是否存在（无权限发信号时视为存在）"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def worker_exited(worker) -> bool:
+    """
+    "主机名:进程号" 标识的进程是否已在本机退出
+
+    其他主机上的进程无法判断，返回 False
+    """
+    worker_host, _, pid = (worker or '').rpartition(':')
+    return worker_host == socket.gethostname() and pid.isdigit() and not pid_alive(int(pid))
@@ -0,0 +1,76 @@
+"""
+渲染图层模块 - 可视化视频的静态元素缓存与增量轨迹层
+
+- OverlayLayer：与帧同尺寸的 BGR 图层 + 掩码。图例、标题等静态元素建层时画一次，
+  轨迹每帧只追加最新一段，合成时用掩码一次拷贝到帧上，每帧开销与历史长度无关
+- CanvasCache：按尺寸和颜色缓存纯色底图，逐帧只做一次内存拷贝
+"""
+from typing import Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+Point = Tuple[int, int]
+
+
+class OverlayLayer:
+    """静态元素 + 增量轨迹的叠加层"""
+
+    def __init__(self, width: int, height: int):
+        self.width = int(width)
+        self.height = int(height)
+        self.image = np.zeros((self.height, self.width, 3), dtype=np.uint8)
+        self.mask = np.zeros((self.height, self.width), dtype=np.uint8)
+        self._last_points: Dict[str, Point] = {}
+
+    # ----------------- 静态元素（建层时调用一次） -----------------
+
+    def rectangle(self, pt1: Point, pt2: Point, color, thickness: int = -1) -> None:
+        cv2.rectangle(self.image, pt1, pt2, color, thickness)
+        cv2.rectangle(self.mask, pt1, pt2, 255, thickness)
+
+    def text(self, text: str, org: Point, scale: float, color, thickness: int = 1) -> None:
+        cv2.putText(self.image, text, org, cv2.FONT_HERSHEY_SIMPLEX, scale, color, thickness)
+        cv2.putText(self.mask, text, org, cv2.FONT_HERSHEY_SIMPLEX, scale, 255, thickness)
+
+    # ----------------- 增量轨迹 -----------------
+
+    def extend(self, name: str, point: Optional[Point], color, thickness: int = 2) -> None:
+        """
+        轨迹 name 追加一个点：只画上一个可见点到该点的线段。
+        point 为 None（关键点不可见）时跳过，下一个可见点直接与上一个可见点相连。
+        """
+        if point is None:
+            return
+        last = self._last_points.get(name)
+        if last is not None and last != point:
+            cv2.line(self.image, last, point, color, thickness)
+            cv2.line(self.mask, last, point, 255, thickness)
+        self._last_points[name] = point
+
+    def last_point(self, name: str) -> Optional[Point]:
+        return self._last_points.get(name)
+
+    # ----------------- 合成 -----------------
+
+    def composite(self, frame: np.ndarray) -> np.ndarray:
+        """按掩码把图层一次性拷贝到帧上（原地修改）"""
+        cv2.copyTo(self.image, self.mask, frame)
+        return frame
+
+
+class CanvasCache:
+    """纯色底图缓存"""
+
+    def __init__(self):
+        self._canvases: Dict[tuple, np.ndarray] = {}
+
+    def get(self, width: int, height: int, color=(255, 255, 255)) -> np.ndarray:
+        """返回底图的可写副本"""
+        key = (int(width), int(height), tuple(int(c) for c in color))
+        canvas = self._canvases.get(key)
+        if canvas is None:
+            canvas = np.empty((key[1], key[0], 3), dtype=np.uint8)
+            canvas[:] = key[2]
+            self._canvases[key] = canvas
+        return canvas.copy()
@@ -15,7 +15,8 @@ class VolleyballScorerV2:
     def __init__(self, template_path='template.json'):
         """初始化评分器"""
         self.template = self._load_template(template_path)
-        self.detector = PoseDetector()
+        # 只用到静态方法 calculate_angle，不创建 MediaPipe 计算图（gunicorn master 中也会构造评分器）
+        self.detector = PoseDetector
         
         # 优化后的标准值（更宽松、更科学）
         self.standards = {
@@ -15,7 +15,8 @@ class VolleyballScorerV3:
     def __init__(self, template_path='template.json'):
         """初始化智能评分器"""
         self.template = self._load_template(template_path)
-        self.detector = PoseDetector()
+        # 只用到静态方法 calculate_angle，不创建 MediaPipe 计算图（gunicorn master 中也会构造评分器）
+        self.detector = PoseDetector
         
         # 优化后的标准值（基于专业垫球动作）
         self.standards = {
@@ -575,12 +576,14 @@ class VolleyballScorerV3:
     
     # ==================== 序列评分 ====================
     
-    def score_sequence_with_ball(self, frames_data):
+    def score_sequence_with_ball(self, frames_data, frame_results=None):
         """
         带球体检测的序列评分
         
         Args:
             frames_data: 帧数据列表，每个元素包含 {'landmarks': ..., 'ball': ...}
+            frame_results: 已算好的逐帧 score_pose_with_ball 结果（无姿态的帧为 None），
+                分析过程中已逐帧评分时传入，避免重复计算
             
         Returns:
             dict: 序列评分结果
@@ -597,12 +600,15 @@ class VolleyballScorerV3:
         frame_scores = []
         has_ball_count = 0
         
-        for frame_data in frames_data:
+        for i, frame_data in enumerate(frames_data):
             landmarks = frame_data.get('landmarks')
             ball = frame_data.get('ball')
             
             if landmarks is not None:
-                score_result = self.score_pose_with_ball(landmarks, ball)
+                if frame_results is not None and frame_results[i] is not None:
+                    score_result = frame_results[i]
+                else:
+                    score_result = self.score_pose_with_ball(landmarks, ball)
                 frame_scores.append(score_result['total_score'])
                 
                 if score_result.get('has_ball', False):
@@ -616,10 +622,13 @@ class VolleyballScorerV3:
         
         # 获取最佳帧的详细评分
         best_frame_data = frames_data[best_frame_idx]
-        best_result = self.score_pose_with_ball(
-            best_frame_data.get('landmarks'),
-            best_frame_data.get('ball')
-        )
+        if frame_results is not None and frame_results[best_frame_idx] is not None:
+            best_result = frame_results[best_frame_idx]
+        else:
+            best_result = self.score_pose_with_ball(
+                best_frame_data.get('landmarks'),
+                best_frame_data.get('ball')
+            )
         
         return {
             'total_score': int(best_frame_score),
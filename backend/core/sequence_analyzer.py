@@ -3,25 +3,43 @@
 """
 import numpy as np
 import cv2
-from typing import List, Optional
+from itertools import islice
+from typing import Iterable, List, Optional
 from .pose_detector import PoseDetector
-from .volleyball_detector import VolleyballDetector, VolleyballDetection
+from .volleyball_detector import VolleyballDetector, VolleyballDetection, DetectionSession
+from .cancellation import OperationCancelled, check_cancelled
+
+# 流式分析每块最多的帧数：首帧送到编码器之前只攒这么多帧，不随检测器（自动调优后）的 batch 变大
+DEFAULT_STREAM_CHUNK = 16
 
 
 class SequenceAnalyzer:
     """分析视频序列中的动作连贯性和轨迹"""
     
-    def __init__(self, enable_ball_detection: bool = False, volleyball_detector: Optional[VolleyballDetector] = None):
-        self.pose_detector = PoseDetector()
+    def __init__(self, enable_ball_detection: bool = False, volleyball_detector: Optional[VolleyballDetector] = None,
+                 create_pose_detector: bool = True):
+        """
+        Args:
+            create_pose_detector: 为 False 时不创建 MediaPipe 计算图，由调用方之后设置 pose_detector
+                （gunicorn preload：计算图带有线程，需在 fork 之后的 worker 中创建）
+        """
+        self.pose_detector = PoseDetector() if create_pose_detector else None
         self.enable_ball_detection = enable_ball_detection
         self.volleyball_detector = volleyball_detector
     
-    def analyze_sequence(self, video_path_or_frames, detect_ball: Optional[bool] = None, draw_ball: bool = False):
+    def analyze_sequence(self, video_path_or_frames, detect_ball: Optional[bool] = None, draw_ball: bool = False,
+                         progress_callback=None, frame_scorer=None, cancel_token=None,
+                         high_accuracy: Optional[bool] = None):
         """
         分析连续帧序列
         
         Args:
             video_path_or_frames: 视频文件路径(str) 或 视频帧列表(list)
+            progress_callback: progress_callback(已处理帧数, 总帧数, 统计)，每帧调用一次；
+                统计为 {frames_decoded, frames_processed, ball_detection_rate, best_score, best_frame_idx}
+            frame_scorer: frame_scorer(landmarks) -> 分数，传入时逐帧评分并在统计中报告当前最佳帧得分
+            cancel_token: CancelToken，解码和每个检测批次之间检查，已取消 / 超时时抛出 OperationCancelled
+            high_accuracy: 球检测高精度模式，None 时使用检测器的默认值
             
         Returns:
             dict: 包含所有帧的分析结果
@@ -29,7 +47,7 @@ class SequenceAnalyzer:
         # 判断输入类型
         if isinstance(video_path_or_frames, str):
             # 如果是字符串，认为是视频路径
-            frames = self._extract_frames_from_video(video_path_or_frames)
+            frames = self._extract_frames_from_video(video_path_or_frames, cancel_token)
             if frames is None or len(frames) == 0:
                 return {
                     "success": False,
@@ -39,9 +57,8 @@ class SequenceAnalyzer:
             # 否则认为是帧列表
             frames = video_path_or_frames
 
-        use_ball_detection = self.enable_ball_detection if detect_ball is None else detect_ball
-        ball_detector_ready = use_ball_detection and self._ensure_ball_detector()
-        use_ball_detection = use_ball_detection and ball_detector_ready
+        ball_session = self._prepare_ball_detection(detect_ball, high_accuracy)
+        use_ball_detection = ball_session is not None
         draw_ball = draw_ball and use_ball_detection
 
         ball_detections: List[List[VolleyballDetection]] = []
@@ -55,55 +72,39 @@ class SequenceAnalyzer:
             'ball_detections': [],
             'ball_trajectory': None,
             'ball_detection_enabled': use_ball_detection,
+            'diagnostics': {},
         }
         
-        # ========= 改成按 batch 处理的部分 =========
         all_landmarks: List = []
         annotated_frames: List[np.ndarray] = []
+        stats = {
+            'frames_decoded': len(frames),
+            'frames_processed': 0,
+            'ball_detection_rate': None,
+            'best_score': None,
+            'best_frame_idx': None,
+        }
+        ball_frames = 0
 
-        BATCH_SIZE = 300
-        num_frames = len(frames)
-
-        for start in range(0, num_frames, BATCH_SIZE):
-            end = min(start + BATCH_SIZE, num_frames)
-            frame_chunk = frames[start:end]
+        for frame_data, _, annotated, frame_ball_dets in self._iter_frames(
+                frames, ball_session, draw_ball, cancel_token):
+            results['frames_data'].append(frame_data)
+            if progress_callback is not None:
+                stats['frames_processed'] = len(results['frames_data'])
+                if use_ball_detection:
+                    ball_frames += bool(frame_ball_dets)
+                    stats['ball_detection_rate'] = ball_frames / stats['frames_processed']
+                if frame_scorer is not None and frame_data['landmarks'] is not None:
+                    score = frame_scorer(frame_data['landmarks'])
+                    if stats['best_score'] is None or score > stats['best_score']:
+                        stats['best_score'] = score
+                        stats['best_frame_idx'] = frame_data['frame_idx']
+                progress_callback(stats['frames_processed'], len(frames), dict(stats))
+            all_landmarks.append(frame_data['landmarks'])
+            annotated_frames.append(annotated)
 
-            # 1️⃣ 当前 batch 的球检测（只在启用时调用）
             if use_ball_detection:
-                # detect_batch: List[np.ndarray] -> List[List[VolleyballDetection]]
-                chunk_ball_detections: List[List[VolleyballDetection]] = \
-                    self.volleyball_detector.detect_batch(frame_chunk)
-            else:
-                # 为了下面 zip 一致性，构造空列表
-                chunk_ball_detections = [[] for _ in frame_chunk]
-
-            # 2️⃣ 对当前 batch 内每一帧，做姿态 + 画框 + 存结果
-            for offset, (frame, frame_ball_dets) in enumerate(zip(frame_chunk, chunk_ball_detections)):
-                idx = start + offset  # 全局帧索引
-
-                # 姿态检测还是逐帧
-                landmarks, annotated = self.pose_detector.detect_pose(frame)
-
-                # 叠加排球标注
-                if use_ball_detection and frame is not None:
-                    if draw_ball and frame_ball_dets:
-                        annotated = self.volleyball_detector.annotate(annotated, frame_ball_dets)
-
-                results['frames_data'].append({
-                    'frame_idx': idx,
-                    'landmarks': landmarks,
-                    'has_pose': landmarks is not None,
-                    'ball_detections': (
-                        self._serialize_detections(frame_ball_dets) if use_ball_detection else []
-                    )
-                })
-
-                all_landmarks.append(landmarks)
-                annotated_frames.append(annotated)
-
-                if use_ball_detection:
-                    ball_detections.append(frame_ball_dets)
-        # ========= batch 处理部分结束 =========
+                ball_detections.append(frame_ball_dets)
         
         # 计算轨迹
         results['trajectories'] = self._calculate_trajectories(all_landmarks)
@@ -127,12 +128,106 @@ class SequenceAnalyzer:
             results['ball_detections'] = []
             results['ball_trajectory'] = None
         results['ball_detection_enabled'] = use_ball_detection
+        if use_ball_detection:
+            results['diagnostics']['ball_detector'] = self.volleyball_detector.get_diagnostics(ball_session)
         
         results['annotated_frames'] = annotated_frames
         results['success'] = True  # 添加成功标志
         
         return results
 
+    def analyze_stream(self, frames: Iterable[np.ndarray], detect_ball: Optional[bool] = None,
+                       cancel_token=None, chunk_size: int = DEFAULT_STREAM_CHUNK):
+        """
+        流式分析：frames 可以是边解码边产出的帧迭代器，每帧结果就绪即返回，
+        不保留整段视频的帧和标注图
+
+        Args:
+            chunk_size: 每块球检测的最多帧数（不超过检测器的 batch 大小），
+                内存中同时只保留这么多解码帧
+
+        Yields:
+            (frame_data, frame, ball_detection_enabled)：frame_data 与 analyze_sequence
+            结果中 frames_data 的元素格式相同
+        """
+        ball_session = self._prepare_ball_detection(detect_ball)
+        for frame_data, frame, _, _ in self._iter_frames(frames, ball_session, draw_ball=False,
+                                                         cancel_token=cancel_token, max_chunk=chunk_size):
+            yield frame_data, frame, ball_session is not None
+
+    def _prepare_ball_detection(self, detect_ball: Optional[bool],
+                                high_accuracy: Optional[bool] = None) -> Optional[DetectionSession]:
+        """
+        确定本次是否做球检测
+
+        Returns:
+            启用时返回本视频的检测状态（重新探测排球尺度、选择推理尺寸），否则为 None
+        """
+        use_ball_detection = self.enable_ball_detection if detect_ball is None else detect_ball
+        if not (use_ball_detection and self._ensure_ball_detector()):
+            return None
+        return self.volleyball_detector.new_session(high_accuracy)
+
+    def _iter_frames(self, frames: Iterable[np.ndarray], ball_session: Optional[DetectionSession],
+                     draw_ball: bool, cancel_token=None, max_chunk: Optional[int] = None):
+        """
+        按块做球检测、逐帧做姿态检测，逐帧产出 (frame_data, frame, annotated, ball_detections)；
+        每块之前检查 cancel_token
+
+        Args:
+            ball_session: 本视频的球检测状态，为 None 时不做球检测
+            max_chunk: 每块最多的帧数，None 时与检测器的 batch 大小一致
+        """
+        use_ball_detection = ball_session is not None
+        frame_iter = iter(frames)
+        start = 0
+
+        while True:
+            check_cancelled(cancel_token)
+            # 开启球检测时，分块大小与检测器（当前推理尺寸、自动调优后）的 batch 大小对齐，
+            # 流式分析再限制在 max_chunk 以内；否则逐帧处理
+            chunk_size = 1
+            if use_ball_detection:
+                chunk_size = self.volleyball_detector.get_batch_size(ball_session.input_size)
+                if max_chunk:
+                    chunk_size = min(chunk_size, int(max_chunk))
+            frame_chunk = list(islice(frame_iter, chunk_size))
+            if not frame_chunk:
+                break
+
+            # 1️⃣ 当前 batch 的球检测（只在启用时调用）
+            if use_ball_detection:
+                # detect_batch: List[np.ndarray] -> List[List[VolleyballDetection]]
+                chunk_ball_detections: List[List[VolleyballDetection]] = \
+                    self.volleyball_detector.detect_batch(frame_chunk, cancel_token=cancel_token,
+                                                          session=ball_session)
+            else:
+                # 为了下面 zip 一致性，构造空列表
+                chunk_ball_detections = [[] for _ in frame_chunk]
+
+            # 2️⃣ 对当前 batch 内每一帧，做姿态 + 画框
+            for offset, (frame, frame_ball_dets) in enumerate(zip(frame_chunk, chunk_ball_detections)):
+                idx = start + offset  # 全局帧索引
+
+                # 姿态检测还是逐帧
+                landmarks, annotated = self.pose_detector.detect_pose(frame)
+
+                # 叠加排球标注
+                if draw_ball and frame is not None and frame_ball_dets:
+                    annotated = self.volleyball_detector.annotate(annotated, frame_ball_dets,
+                                                                  session=ball_session)
+
+                frame_data = {
+                    'frame_idx': idx,
+                    'landmarks': landmarks,
+                    'has_pose': landmarks is not None,
+                    'ball_detections': (
+                        self._serialize_detections(frame_ball_dets) if use_ball_detection else []
+                    )
+                }
+                yield frame_data, frame, annotated, frame_ball_dets
+
+            start += len(frame_chunk)
 
     def _serialize_detections(self, detections: List[VolleyballDetection]):
         serialized = []
@@ -418,12 +513,13 @@ class SequenceAnalyzer:
             'valid_frames': valid_frames
         }
     
-    def _extract_frames_from_video(self, video_path):
+    def _extract_frames_from_video(self, video_path, cancel_token=None):
         """
         从视频文件中提取帧
         
         Args:
             video_path: 视频文件路径
+            cancel_token: CancelToken，逐帧检查
             
         Returns:
             list: 提取的帧列表
@@ -442,6 +538,7 @@ class SequenceAnalyzer:
             frame_count = 0
             
             while cap.isOpened():
+                check_cancelled(cancel_token)
                 ret, frame = cap.read()
                 if not ret:
                     break
@@ -456,6 +553,9 @@ class SequenceAnalyzer:
             cap.release()
             return frames
             
+        except OperationCancelled:
+            cap.release()
+            raise
         except Exception as e:
             print(f"提取视频帧失败: {str(e)}")
             return None
@@ -0,0 +1,140 @@
+"""
+线程预算模块 - 按容器 CPU 配额给每个 worker 分配 torch / OpenCV / ffmpeg 线程数
+
+torch、OpenCV 默认按宿主机核数开线程池，libx264 也按核数开编码线程；
+多个 gunicorn worker 跑在 2 核配额的容器里时线程数远超 CPU，负载一高吞吐反而下降。
+- available_cpus()：cgroup v2 cpu.max / cgroup v1 cfs 配额、CPU 亲和性、os.cpu_count() 中取最小值
+- plan_thread_budget()：可用 CPU 按 worker 数平分，得到各库的线程数
+- apply_thread_budget()：在 worker 进程中设置 torch / OpenCV 线程数并记录生效值；
+  ffmpeg 编码参数通过 ffmpeg_threads() / worker_cpus() 读取
+MediaPipe 的 Python 接口没有线程数设置，只在诊断信息中标注为不受控
+"""
+import math
+import os
+from typing import Optional, Tuple
+
+_CGROUP_V2_CPU_MAX = "/sys/fs/cgroup/cpu.max"
+_CGROUP_V1_DIRS = ("/sys/fs/cgroup/cpu", "/sys/fs/cgroup/cpu,cpuacct")
+
+# 当前进程生效的线程预算（apply_thread_budget 之后）
+_budget: Optional[dict] = None
+
+
+def _read(path) -> Optional[str]:
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _cgroup_quota() -> Optional[float]:
+    """cgroup CPU 配额（核数），没有限制时返回 None"""
+    cpu_max = _read(_CGROUP_V2_CPU_MAX)
+    if cpu_max:
+        quota, _, period = cpu_max.partition(' ')
+        if quota != 'max' and quota.isdigit() and period.isdigit() and int(period) > 0:
+            return int(quota) / int(period)
+        return None
+    for directory in _CGROUP_V1_DIRS:
+        quota = _read(os.path.join(directory, "cpu.cfs_quota_us"))
+        period = _read(os.path.join(directory, "cpu.cfs_period_us"))
+        if quota and period and quota.lstrip('-').isdigit() and period.isdigit():
+            if int(quota) > 0 and int(period) > 0:
+                return int(quota) / int(period)
+            return None
+    return None
+
+
+def available_cpus() -> Tuple[float, str]:
+    """
+    Returns:
+        (CPU 数, 来源)：来源为 cgroup / affinity / cpu_count
+    """
+    # 数值相同时优先报告更具体的来源
+    candidates = []
+    quota = _cgroup_quota()
+    if quota is not None:
+        candidates.append((quota, 'cgroup'))
+    if hasattr(os, 'sched_getaffinity'):
+        candidates.append((float(len(os.sched_getaffinity(0))), 'affinity'))
+    candidates.append((float(os.cpu_count() or 1), 'cpu_count'))
+    return min(candidates, key=lambda item: item[0])
+
+
+def plan_thread_budget(workers=1, cpus=None, torch_threads=None, opencv_threads=None,
+                       ffmpeg_threads=None) -> dict:
+    """
+    Args:
+        workers: 共享这些 CPU 的 worker 进程数
+        cpus: 可用 CPU 数，None 时调用 available_cpus()
+        torch_threads / opencv_threads / ffmpeg_threads: 单独指定某个库的线程数，
+            None 时取每个 worker 分到的 CPU 数（至少 1）
+
+    Returns:
+        dict: {cpus, cpu_source, workers, per_worker, torch, opencv, ffmpeg}
+    """
+    if cpus is None:
+        cpus, source = available_cpus()
+    else:
+        cpus, source = float(cpus), 'config'
+    workers = max(1, int(workers))
+    per_worker = max(1, int(math.floor(cpus / workers)))
+    return {
+        'cpus': round(cpus, 2),
+        'cpu_source': source,
+        'workers': workers,
+        'per_worker': per_worker,
+        'torch': int(torch_threads or per_worker),
+        'opencv': int(opencv_threads or per_worker),
+        'ffmpeg': int(ffmpeg_threads or per_worker),
+    }
+
+
+def apply_thread_budget(budget: dict) -> dict:
+    """
+    在当前进程中设置 torch / OpenCV 线程数（fork 之后的 worker 中调用）
+
+    Returns:
+        dict: budget 加上实际生效的 effective 字段
+    """
+    global _budget
+    effective = {}
+    try:
+        import torch
+        torch.set_num_threads(budget['torch'])
+        try:
+            # 进程中已经执行过并行算子时不能再修改
+            torch.set_num_interop_threads(budget['torch'])
+        except RuntimeError:
+            pass
+        effective['torch'] = torch.get_num_threads()
+        effective['torch_interop'] = torch.get_num_interop_threads()
+    except ImportError:
+        effective['torch'] = None
+    import cv2
+    cv2.setNumThreads(budget['opencv'])
+    effective['opencv'] = cv2.getNumThreads()
+    effective['ffmpeg'] = budget['ffmpeg']
+    effective['mediapipe'] = 'unmanaged'
+    _budget = dict(budget, effective=effective)
+    print(f"🧵 线程预算: {budget['cpus']} CPU ({budget['cpu_source']}) / {budget['workers']} worker → "
+          f"torch {effective['torch']}, OpenCV {effective['opencv']}, ffmpeg {budget['ffmpeg']}")
+    return _budget
+
+
+def get_thread_budget() -> Optional[dict]:
+    """当前进程生效的线程预算，未设置时返回 None"""
+    return _budget
+
+
+def worker_cpus() -> int:
+    """本 worker 分到的 CPU 数；未设置线程预算时为 os.cpu_count()"""
+    if _budget is not None:
+        return _budget['per_worker']
+    return os.cpu_count() or 1
+
+
+def ffmpeg_threads() -> Optional[int]:
+    """ffmpeg 编码线程数；未设置线程预算时返回 None（ffmpeg 自动）"""
+    return _budget['ffmpeg'] if _budget is not None else None
@@ -5,14 +5,41 @@ import cv2
 import numpy as np
 import tempfile
 import os
-from .pose_detector import PoseDetector
+from collections import deque
+from .video_writer import open_video_writer, ffmpeg_available, selected_codec_args
+from .render_layers import OverlayLayer, CanvasCache
+from .landmark_store import LandmarkStore, video_digest
+from .cancellation import check_cancelled
+
+# 排球轨迹保留的历史帧数
+BALL_TRACE_LEN = 8
+
+# 轨迹视频追踪的关键点及颜色 (B, G, R)
+TRAJECTORY_POINTS = (
+    ('left_wrist', 'Left Wrist', (255, 0, 0)),
+    ('right_wrist', 'Right Wrist', (0, 0, 255)),
+)
 
 
 class VideoGenerator:
     """生成骨架视频的类"""
+
+    VIDEO_TYPES = ("overlay", "skeleton", "comparison", "trajectory")
+    # 只依赖关键点、可以不解码原视频渲染的类型（轨迹画在深色底图上）
+    LANDMARK_VIDEO_TYPES = ("skeleton", "trajectory")
     
-    def __init__(self):
-        self.detector = PoseDetector()
+    def __init__(self, ball_detector=None, chunked_encoding=None, landmark_store=None, hls_options=None):
+        """
+        Args:
+            ball_detector: 复用的 VolleyballDetector（为 None 时分析器按需自行创建）
+            chunked_encoding: 长视频分段并行编码配置（见 open_video_writer），None 时单进程编码
+            landmark_store: LandmarkStore，保存/复用逐帧关键点序列；None 时不缓存
+            hls_options: HLS 输出配置（segment_seconds），输出路径为 .m3u8 时使用
+        """
+        self.ball_detector = ball_detector
+        self.chunked_encoding = chunked_encoding
+        self.landmark_store = landmark_store
+        self.hls_options = hls_options
         # MediaPipe 骨架连接定义
         self.connections = [
             # 躯干
@@ -53,30 +80,75 @@ class VideoGenerator:
             'left_ankle': 27,
             'right_ankle': 28,
         }
+
+        # 向量化绘制用的索引数组
+        self._connection_array = np.array(self.connections, dtype=np.int32)
+        self._num_slots = max(self.landmark_map.values()) + 1
+        self._canvas_cache = CanvasCache()
     
     def generate_video(self, video_path, output_path, video_type="overlay", max_frames=600,
-                       detect_ball=False, highlight_ball=False):
+                       detect_ball=False, highlight_ball=False, encode_profile=None,
+                       max_height=None, output_fps=None, progress_callback=None, cancel_token=None):
         """
-        统一的视频生成接口
+        统一的视频生成接口（流式：解码 → 分析 → 渲染 → 编码逐帧进行，不在内存中保留整段视频）
         
         Args:
             video_path: 输入视频路径
-            output_path: 输出视频路径
+            output_path: 输出视频路径（.m3u8 时输出 fMP4 HLS 分片和播放列表）
             video_type: 视频类型
                 - "overlay": 骨架叠加
                 - "skeleton": 纯骨架
                 - "comparison": 左右对比
                 - "trajectory": 轨迹追踪
             max_frames: 最大处理帧数（默认300帧，约10-30秒视频）
+            encode_profile: 编码档位 dict（preset / crf / tune / threads / faststart / max_height），
+                None 时使用默认编码参数
+            max_height: 输出最大高度（只缩小不放大），None 时保持原分辨率；
+                与编码档位的 max_height 取较小值
+            output_fps: 输出帧率上限（按整数帧间隔抽帧），None 时保持原帧率
+            progress_callback: progress_callback(已渲染帧数, 预计总帧数)，每帧调用一次
+            cancel_token: CancelToken，每帧检查；取消 / 超时时终止 ffmpeg、删除不完整的输出
+                并抛出 OperationCancelled
         
         Returns:
             str: 输出视频路径
         """
+        results = self.generate_videos(
+            video_path, {video_type: output_path}, max_frames=max_frames,
+            detect_ball=detect_ball, highlight_ball=highlight_ball, encode_profile=encode_profile,
+            max_height=max_height, output_fps=output_fps, progress_callback=progress_callback,
+            cancel_token=cancel_token
+        )
+        return results[video_type]
+
+    def generate_videos(self, video_path, outputs, max_frames=600,
+                        detect_ball=False, highlight_ball=False, encode_profile=None,
+                        max_height=None, output_fps=None, return_info=False, progress_callback=None,
+                        cancel_token=None, content_digest=None):
+        """
+        一次分析生成多种可视化视频：每帧的姿态/排球结果只计算一次，
+        分发给每种视频类型各自的渲染和编码器（多个 ffmpeg 进程并行编码）
+
+        Args:
+            video_path: 输入视频路径
+            outputs: {视频类型: 输出路径}，视频类型见 VIDEO_TYPES
+            max_frames / detect_ball / highlight_ball / encode_profile / max_height / output_fps /
+            progress_callback / cancel_token: 同 generate_video
+            return_info: 为 True 时额外返回 {landmarks_id, from_cache}
+            content_digest: 视频文件的 SHA-256（上传时已计算则传入，不再重读文件）
+
+        Returns:
+            dict: {视频类型: 输出路径}；return_info 时为 (dict, info)
+        """
         from .sequence_analyzer import SequenceAnalyzer
-        import subprocess
-        import tempfile
+
+        if not outputs:
+            raise ValueError("没有指定要生成的视频类型")
+        for video_type in outputs:
+            if video_type not in self.VIDEO_TYPES:
+                raise ValueError(f"未知的视频类型 {video_type}")
         
-        print(f"🎬 开始生成视频: {video_type}")
+        print(f"🎬 开始生成视频: {', '.join(outputs)}")
         
         # 读取视频
         cap = cv2.VideoCapture(video_path)
@@ -86,12 +158,9 @@ class VideoGenerator:
         # 获取视频信息
         total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
         fps = cap.get(cv2.CAP_PROP_FPS) or 10
+        source_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
         
-        print(f"📹 视频信息: {total_frames} 帧, {fps:.1f} FPS")
-        
-        # 提取帧（限制数量以提高速度）
-        frames = []
-        frame_count = 0
+        print(f"📹 视频信息: {total_frames} 帧, {fps:.1f} FPS, 高 {source_height}px")
         
         # 如果帧数太多，进行采样
         if total_frames > max_frames:
@@ -100,140 +169,336 @@ class VideoGenerator:
         else:
             frame_interval = 1
         
+        # 输出帧率上限：按整数帧间隔抽帧
+        if output_fps and fps > output_fps:
+            fps_interval = max(1, int(round(fps / output_fps)))
+            if fps_interval > frame_interval:
+                frame_interval = fps_interval
+                print(f"⚡ 输出帧率上限 {output_fps} FPS，每 {frame_interval} 帧取一帧")
+        
+        # 输出高度上限：请求参数和编码档位取较小值，解码后立即缩放一次，
+        # 分析和所有视频类型的绘制都在缩小后的帧上进行
+        height_limits = [h for h in (max_height, (encode_profile or {}).get('max_height')) if h]
+        target_height = min(height_limits) if height_limits else None
+        if target_height and source_height > target_height:
+            scale = target_height / source_height
+            print(f"📐 输出缩放到 {target_height}px 高")
+        else:
+            scale = None
+        expected_frames = min(max_frames, -(-total_frames // frame_interval)) if total_frames > 0 else max_frames
+        # 采样后按实际帧间隔输出，保持原始播放速度
+        output_fps = fps / frame_interval
+
+        # 只依赖关键点的视频类型：已有缓存序列时不解码视频
+        landmarks_id = None
+        if self.landmark_store is not None:
+            landmarks_id = self.landmark_store.make_id(
+                content_digest or video_digest(video_path), frame_interval, max_frames,
+                target_height if scale is not None else None
+            )
+            if all(video_type in self.LANDMARK_VIDEO_TYPES for video_type in outputs):
+                sequence = self.landmark_store.get(landmarks_id)
+                # 没做排球检测的序列不能用来标出排球：视为未命中，重新分析后覆盖
+                if sequence is not None and highlight_ball and not self.landmark_store.has_ball_data(sequence):
+                    sequence = None
+                if sequence is not None:
+                    cap.release()
+                    print(f"⚡ 使用缓存的关键点序列 {landmarks_id}，跳过视频解码")
+                    results = self.render_from_landmarks(
+                        sequence, outputs, highlight_ball=highlight_ball, encode_profile=encode_profile,
+                        progress_callback=progress_callback, cancel_token=cancel_token
+                    )
+                    info = {'landmarks_id': landmarks_id, 'from_cache': True}
+                    return (results, info) if return_info else results
+
+        ball_detection_requested = detect_ball or highlight_ball
+        analyzer = SequenceAnalyzer(
+            enable_ball_detection=ball_detection_requested,
+            volleyball_detector=self.ball_detector
+        )
+        frames = self._iter_sampled_frames(cap, frame_interval, max_frames, scale=scale)
+        recorded = [] if landmarks_id is not None else None
+        frame_size = {}
+        ball_recorded = {'enabled': False}
+
+        def analyzed_frames():
+            nonlocal highlight_ball
+            for frame_data, frame, ball_enabled in analyzer.analyze_stream(
+                    frames, detect_ball=ball_detection_requested, cancel_token=cancel_token):
+                idx = frame_data['frame_idx']
+                if idx == 0:
+                    frame_size['height'], frame_size['width'] = frame.shape[:2]
+                    ball_recorded['enabled'] = bool(ball_enabled)
+                    if highlight_ball and not ball_enabled:
+                        print("⚠️ Volleyball detection unavailable, skipping ball overlay.")
+                        highlight_ball = False
+                if recorded is not None:
+                    recorded.append({'landmarks': frame_data['landmarks'],
+                                     'ball': frame_data['ball_detections']})
+                frame_ball = frame_data['ball_detections'] if highlight_ball else []
+                yield idx, frame, frame_data['landmarks'], frame_ball, highlight_ball
+
+        print("🔍 开始姿态分析并流式生成视频...")
+        try:
+            results = self._render_and_encode(
+                analyzed_frames(), outputs, output_fps, expected_frames, encode_profile, progress_callback,
+                cancel_token
+            )
+        finally:
+            cap.release()
+
+        if recorded:
+            self.landmark_store.put(
+                landmarks_id, output_fps, frame_size['width'], frame_size['height'], recorded,
+                ball_detection=ball_recorded['enabled']
+            )
+        info = {'landmarks_id': landmarks_id if recorded else None, 'from_cache': False}
+        return (results, info) if return_info else results
+
+    def render_from_landmarks(self, sequence, outputs, highlight_ball=False, encode_profile=None,
+                              progress_callback=None, cancel_token=None):
+        """
+        直接从关键点序列渲染骨架 / 轨迹视频，不解码原视频
+
+        Args:
+            sequence: LandmarkStore.get() 返回的序列
+            outputs: {视频类型: 输出路径}，只支持 LANDMARK_VIDEO_TYPES
+            highlight_ball: 轨迹视频中是否标出缓存的排球位置
+            encode_profile / progress_callback / cancel_token: 同 generate_video
+
+        Returns:
+            dict: {视频类型: 输出路径}
+        """
+        for video_type in outputs:
+            if video_type not in self.LANDMARK_VIDEO_TYPES:
+                raise ValueError(f"视频类型 {video_type} 需要原视频画面，不能只用关键点渲染")
+        frames_data = sequence['frames']
+        total = len(frames_data)
+        width, height = sequence['width'], sequence['height']
+        if highlight_ball and not LandmarkStore.has_ball_data(sequence):
+            print("⚠️ 关键点序列记录时未做排球检测，轨迹视频不标出排球")
+
+        def landmark_frames():
+            for idx, frame_data in enumerate(frames_data):
+                # 轨迹视频画在深色底图上（标题和图例是白色/彩色）
+                canvas = self._canvas_cache.get(width, height, (0, 0, 0))
+                frame_ball = (frame_data.get('ball') or []) if highlight_ball else []
+                yield idx, canvas, frame_data['landmarks'], frame_ball, highlight_ball
+
+        return self._render_and_encode(
+            landmark_frames(), outputs, sequence['fps'], total, encode_profile, progress_callback,
+            cancel_token
+        )
+
+    def _render_and_encode(self, frame_iter, outputs, output_fps, expected_frames, encode_profile,
+                           progress_callback=None, cancel_token=None):
+        """
+        逐帧渲染所有输出类型并送入各自的编码器
+
+        Args:
+            frame_iter: 产出 (idx, frame, landmarks, frame_ball, highlight_ball)
+            outputs: {视频类型: 输出路径}
+        """
+        # 每个输出独立的渲染状态（排球轨迹队列、轨迹图层）
+        render_states = {video_type: self._new_render_state() for video_type in outputs}
+        writers = {}
+        try:
+            for idx, frame, landmarks, frame_ball, highlight_ball in frame_iter:
+                # 取消时由下面的异常处理终止 ffmpeg 子进程
+                check_cancelled(cancel_token)
+                for video_type, output_path in outputs.items():
+                    rendered = self._render_frame(
+                        video_type, frame, landmarks, idx, expected_frames,
+                        frame_ball, highlight_ball, render_states[video_type]
+                    )
+
+                    # 第一帧渲染完成后才知道输出尺寸
+                    if video_type not in writers:
+                        height, width = rendered.shape[:2]
+                        writers[video_type] = open_video_writer(
+                            output_path, width, height, output_fps, profile=encode_profile,
+                            expected_frames=expected_frames, chunked=self.chunked_encoding,
+                            parallel_outputs=len(outputs), hls=self.hls_options
+                        )
+                    writers[video_type].write(rendered)
+                if progress_callback is not None:
+                    progress_callback(idx + 1, max(expected_frames, idx + 1))
+        except BaseException:
+            for writer in writers.values():
+                writer.abort()
+            raise
+
+        if not writers:
+            raise ValueError("视频中没有有效帧")
+
+        results = {}
+        try:
+            for video_type, writer in writers.items():
+                check_cancelled(cancel_token)
+                results[video_type] = writer.close()
+                print(f"✅ {video_type}: 共写入 {writer.frames_written} 帧")
+        except BaseException:
+            for video_type, writer in writers.items():
+                if video_type not in results:
+                    writer.abort()
+            raise
+
+        print(f"🎉 视频生成完成: {', '.join(results.values())}")
+        return results
+
+    def _iter_sampled_frames(self, cap, frame_interval, max_frames, scale=None):
+        """按帧间隔逐帧解码，最多产出 max_frames 帧；scale 不为 None 时按比例缩小（宽高保持偶数）"""
+        frame_count = 0
+        kept = 0
+        size = None
         while True:
+            # 跳过的帧只 grab 不解码成图像
+            if frame_count % frame_interval != 0:
+                if not cap.grab():
+                    break
+                frame_count += 1
+                continue
+
             ret, frame = cap.read()
             if not ret:
                 break
-            
-            if frame_count % frame_interval == 0:
-                frames.append(frame)
-                if len(frames) >= max_frames:
-                    print(f"⏸️ 已达到最大帧数限制: {max_frames}")
-                    break
-            
+
+            if scale is not None:
+                if size is None:
+                    height, width = frame.shape[:2]
+                    size = (max(2, int(width * scale) // 2 * 2), max(2, int(height * scale) // 2 * 2))
+                frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+            yield frame
+            kept += 1
+            if kept >= max_frames:
+                print(f"⏸️ 已达到最大帧数限制: {max_frames}")
+                break
+
             frame_count += 1
-        
-        cap.release()
-        
-        if len(frames) == 0:
-            raise ValueError("视频中没有有效帧")
-        
-        print(f"✅ 提取了 {len(frames)} 帧")
-        
-        # 分析序列（这是最耗时的部分）
-        print("🔍 开始姿态分析...")
-        ball_detection_requested = detect_ball or highlight_ball
-        analyzer = SequenceAnalyzer(enable_ball_detection=ball_detection_requested)
-        sequence_result = analyzer.analyze_sequence(
-            frames,
-            detect_ball=ball_detection_requested,
-            draw_ball=ball_detection_requested
-        )
-        
-        if not sequence_result.get("success", False):
-            raise RuntimeError("序列分析失败")
-        
-        print("✅ 姿态分析完成")
-        
-        ball_detections = sequence_result.get("ball_detections", []) if ball_detection_requested else []
-        if highlight_ball and not sequence_result.get("ball_detection_enabled", False):
-            print("⚠️ Volleyball detection unavailable, skipping ball overlay.")
-            highlight_ball = False
-        ball_overlay_data = ball_detections if highlight_ball else None
-        
-        # 生成处理后的帧
-        print(f"🎨 开始生成{video_type} 视频...")
-        
+
+    @staticmethod
+    def _new_render_state():
+        """单个输出视频的渲染状态：排球轨迹队列 + 轨迹图层（首帧按尺寸创建）"""
+        return {
+            'ball_trace': deque([None] * BALL_TRACE_LEN, maxlen=BALL_TRACE_LEN),
+            'trajectory_layer': None,
+        }
+
+    def _render_frame(self, video_type, frame, landmarks, idx, total, frame_ball=None,
+                      highlight_ball=False, state=None):
+        """按视频类型渲染单帧"""
+        if state is None:
+            state = self._new_render_state()
+        trace_queue = state['ball_trace']
         if video_type == "overlay":
-            processed_frames = self._generate_overlay_frames(frames, sequence_result, ball_overlay_data, highlight_ball)
-            # processed_frames = sequence_result['annotated_frames']
+            return self._render_overlay_frame(frame, landmarks, idx, total, frame_ball, highlight_ball, trace_queue)
         elif video_type == "skeleton":
-            processed_frames = self._generate_skeleton_frames(sequence_result)
+            return self._render_skeleton_frame(landmarks)
         elif video_type == "comparison":
-            processed_frames = self._generate_comparison_frames(frames, sequence_result, ball_overlay_data, highlight_ball)
+            return self._render_comparison_frame(frame, landmarks, frame_ball, highlight_ball, trace_queue)
         elif video_type == "trajectory":
-            processed_frames = self._generate_trajectory_frames(frames, sequence_result, ball_overlay_data, highlight_ball)
+            return self._render_trajectory_frame(frame, landmarks, idx, total, frame_ball, highlight_ball, state)
+        raise ValueError(f"未知的视频类型 {video_type}")
+    
+    def _render_overlay_frame(self, frame, landmarks, idx, total, frame_ball=None,
+                              highlight_ball=False, trace_queue=None):
+        """骨架叠加帧"""
+        overlay_frame = frame.copy()
+        
+        if landmarks:
+            overlay_frame = self._draw_skeleton(overlay_frame, landmarks)
+            cv2.putText(overlay_frame, f"Frame {idx + 1}/{total}", 
+                       (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
         else:
-            raise ValueError(f"未知的视频类型 {video_type}")
-
-        # 直接用FFmpeg或OpenCV写入浏览器兼容格式
-        final_result = self._write_web_compatible_video(processed_frames, output_path, fps)
+            cv2.putText(overlay_frame, f"Frame {idx + 1}/{total} - No Pose", 
+                       (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
         
-        print(f"🎉 视频生成完成: {final_result}")
-        return final_result
+        if highlight_ball:
+            overlay_frame = self._draw_ball_markers(overlay_frame, frame_ball, trace_queue=trace_queue)
+        return overlay_frame
     
-    def _generate_overlay_frames(self, frames, sequence_result, ball_detections=None, highlight_ball=False):
-        """生成骨架叠加帧"""
-        processed_frames = []
-        for idx, frame in enumerate(frames):
-            frame_data = sequence_result['frames_data'][idx]
-            landmarks = frame_data['landmarks']
-            overlay_frame = frame.copy()
-            frame_ball = self._get_ball_detections(ball_detections, idx) if highlight_ball else []
-            
-            if landmarks:
-                overlay_frame = self._draw_skeleton(overlay_frame, landmarks)
-                cv2.putText(overlay_frame, f"Frame {idx + 1}/{len(frames)}", 
-                           (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
-            else:
-                cv2.putText(overlay_frame, f"Frame {idx + 1}/{len(frames)} - No Pose", 
-                           (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
-            
-            if highlight_ball and frame_ball:
-                overlay_frame = self._draw_ball_markers(overlay_frame, frame_ball)
-            
-            processed_frames.append(overlay_frame)
-        return processed_frames
+    def _render_skeleton_frame(self, landmarks, width=640, height=480):
+        """纯骨架帧"""
+        skeleton_frame = self._canvas_cache.get(width, height)
+        
+        if landmarks:
+            skeleton_frame = self._draw_skeleton(
+                skeleton_frame, landmarks,
+                point_color=(0, 0, 255), line_color=(0, 0, 0),
+                point_radius=8, line_thickness=3
+            )
+        return skeleton_frame
     
-    def _generate_skeleton_frames(self, sequence_result, width=640, height=480):
-        """生成纯骨架帧"""
-        processed_frames = []
-        frames_data = sequence_result['frames_data']
+    def _render_comparison_frame(self, frame, landmarks, frame_ball=None, highlight_ball=False,
+                                 trace_queue=None):
+        """左右对比帧"""
+        height, width = frame.shape[:2]
         
-        for idx, frame_data in enumerate(frames_data):
-            skeleton_frame = np.ones((height, width, 3), dtype=np.uint8) * 255
-            landmarks = frame_data['landmarks']
-            
-            if landmarks:
-                skeleton_frame = self._draw_skeleton(
-                    skeleton_frame, landmarks,
-                    point_color=(0, 0, 255), line_color=(0, 0, 0),
-                    point_radius=8, line_thickness=3
-                )
-            
-            processed_frames.append(skeleton_frame)
-        return processed_frames
-    
-    def _generate_comparison_frames(self, frames, sequence_result, ball_detections=None, highlight_ball=False):
-        """生成左右对比帧"""
-        processed_frames = []
-        height, width = frames[0].shape[:2]
+        # 左侧：原视频
+        left = frame.copy()
+        if highlight_ball:
+            left = self._draw_ball_markers(left, frame_ball, trace_queue=trace_queue)
         
-        for idx, frame in enumerate(frames):
-            # 左侧：原视频
-            left = frame.copy()
-            frame_ball = self._get_ball_detections(ball_detections, idx) if highlight_ball else []
-            if highlight_ball and frame_ball:
-                left = self._draw_ball_markers(left, frame_ball)
-            
-            # 右侧：纯骨架
-            right = np.ones((height, width, 3), dtype=np.uint8) * 255
-            frame_data = sequence_result['frames_data'][idx]
-            landmarks = frame_data['landmarks']
-            
-            if landmarks:
-                right = self._draw_skeleton(right, landmarks,
-                    point_color=(0, 0, 255), line_color=(0, 0, 0),
-                    point_radius=6, line_thickness=2)
-            
-            # 拼接
-            comparison = np.hstack([left, right])
-            processed_frames.append(comparison)
-        return processed_frames
-    
-    def _generate_trajectory_frames(self, frames, sequence_result, ball_detections=None, highlight_ball=False):
-        """生成轨迹追踪帧"""
-        return self._generate_overlay_frames(frames, sequence_result, ball_detections, highlight_ball)  # 简化版
+        # 右侧：纯骨架
+        right = self._canvas_cache.get(width, height)
+        if landmarks:
+            right = self._draw_skeleton(right, landmarks,
+                point_color=(0, 0, 255), line_color=(0, 0, 0),
+                point_radius=6, line_thickness=2)
+        
+        # 拼接
+        return np.hstack([left, right])
+
+    def _render_trajectory_frame(self, frame, landmarks, idx, total, frame_ball=None,
+                                 highlight_ball=False, state=None):
+        """
+        轨迹追踪帧：手腕轨迹画在增量图层上，每帧只追加一段，
+        图例和标题在建层时画一次，合成只需一次掩码拷贝
+        """
+        height, width = frame.shape[:2]
+        layer = state['trajectory_layer']
+        if layer is None or (layer.width, layer.height) != (width, height):
+            layer = self._build_trajectory_layer(width, height)
+            state['trajectory_layer'] = layer
+
+        for name, _, color in TRAJECTORY_POINTS:
+            layer.extend(name, self._landmark_point(landmarks, name, width, height), color)
+
+        trajectory_frame = layer.composite(frame.copy())
+
+        # 当前点加粗显示（关键点暂时不可见时停在最后一个可见位置）
+        for name, _, color in TRAJECTORY_POINTS:
+            point = layer.last_point(name)
+            if point is not None:
+                cv2.circle(trajectory_frame, point, 8, color, -1)
+
+        if landmarks:
+            trajectory_frame = self._draw_skeleton(trajectory_frame, landmarks)
+        cv2.putText(trajectory_frame, f"Frame {idx + 1}/{total}",
+                   (10, height - 20), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+
+        if highlight_ball:
+            trajectory_frame = self._draw_ball_markers(
+                trajectory_frame, frame_ball, trace_queue=state['ball_trace'])
+        return trajectory_frame
+
+    @staticmethod
+    def _build_trajectory_layer(width, height):
+        """轨迹图层：标题和图例作为静态元素预先画好"""
+        layer = OverlayLayer(width, height)
+        layer.text("Motion Trajectory", (10, 30), 0.8, (255, 255, 255), 2)
+        layer.rectangle((width - 150, 10), (width - 10, 80), (0, 0, 0), -1)
+        for i, (_, label, color) in enumerate(TRAJECTORY_POINTS):
+            layer.text(label, (width - 140, 35 + 25 * i), 0.5, color, 1)
+        return layer
+
+    @staticmethod
+    def _landmark_point(landmarks, name, width, height):
+        """关键点像素坐标，不存在或可见度低时返回 None"""
+        lm = landmarks.get(name) if landmarks else None
+        if lm is None or lm.get('x') is None or lm.get('visibility', 1.0) <= 0.5:
+            return None
+        return int(lm['x'] * width), int(lm['y'] * height)
     
     # def _write_web_compatible_video(self, frames, output_path, fps):
     #     """写入浏览器兼容的视频"""
@@ -345,115 +610,6 @@ class VideoGenerator:
     #     else:
     #         raise RuntimeError("视频生成失败")
     
-    def _write_web_compatible_video(self, frames, output_path, fps):
-        """写入浏览器兼容的视频（优化版：使用 FFmpeg rawvideo 管道）"""
-        import subprocess
-        import os
-        import cv2
-        import numpy as np
-
-        if len(frames) == 0:
-            raise ValueError("没有帧可以写入")
-
-        # 统一尺寸（假设所有帧尺寸已经一致，不一致就 resize）
-        height, width = frames[0].shape[:2]
-
-        # 先简单检查 ffmpeg 是否可用（可选）
-        try:
-            check = subprocess.run(
-                ['ffmpeg', '-version'],
-                capture_output=True,
-                text=True,
-                timeout=5
-            )
-            if check.returncode != 0:
-                raise RuntimeError("FFmpeg 不可用")
-        except Exception as e:
-            print(f"ℹ️ FFmpeg 检测失败，回退到 OpenCV: {e}")
-            return self._write_video_opencv_fallback(frames, output_path, fps)
-
-        print("🔄 使用 FFmpeg (rawvideo 管道) 生成浏览器兼容视频...")
-
-        # FFmpeg 命令：从 stdin 读 raw BGR24 视频流
-        cmd = [
-            'ffmpeg',
-            '-y',
-            '-f', 'rawvideo',
-            '-vcodec', 'rawvideo',
-            '-pix_fmt', 'bgr24',
-            '-s', f'{width}x{height}',
-            '-r', str(fps),
-            '-i', '-',              # 从 stdin 读
-            '-an',                  # 无音频
-            '-vcodec', 'libx264',   # 或 'h264'，取决于你的 ffmpeg 构建
-            '-pix_fmt', 'yuv420p',  # 浏览器最兼容的像素格式
-            '-preset', 'fast',      # 编码预设：ultrafast, superfast, veryfast, faster, fast, medium(默认)
-            '-crf', '23',           # 质量（18~28，越小越清晰）
-            output_path
-        ]
-
-        proc = subprocess.Popen(
-            cmd,
-            stdin=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-
-        try:
-            for i, frame in enumerate(frames):
-                if frame is None:
-                    continue
-
-                # 如果有尺寸不一致的帧，这里统一 resize 一下
-                if frame.shape[0] != height or frame.shape[1] != width:
-                    frame = cv2.resize(frame, (width, height))
-
-                # BGR np.ndarray → raw bytes
-                proc.stdin.write(frame.tobytes())
-        finally:
-            proc.stdin.close()
-            stderr = proc.stderr.read().decode('utf-8', errors='ignore')
-            ret = proc.wait()
-
-        if ret != 0 or not os.path.exists(output_path):
-            print(f"⚠️ FFmpeg 生成失败，代码 {ret}，部分 stderr:\n{stderr[:300]}")
-            print("⚠️ 回退到 OpenCV 方案...")
-            return self._write_video_opencv_fallback(frames, output_path, fps)
-
-        print("✅ FFmpeg 生成成功（H.264 + yuv420p，浏览器兼容）")
-        return output_path
-
-
-    def _write_video_opencv_fallback(self, frames, output_path, fps):
-        """原来的 OpenCV 降级方案单独抽出来"""
-        import os
-        import cv2
-
-        if len(frames) == 0:
-            raise ValueError("没有帧可以写入")
-
-        height, width = frames[0].shape[:2]
-        print("⚠️ 回退到OpenCV，视频可能无法在浏览器播放")
-
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
-
-        if not out.isOpened():
-            raise RuntimeError("无法创建视频写入器")
-
-        for frame in frames:
-            if frame is None:
-                continue
-            out.write(frame)
-
-        out.release()
-
-        if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
-            print("⚠️ 使用OpenCV生成，浏览器可能无法播放，请下载查看")
-            return output_path
-        else:
-            raise RuntimeError("视频生成失败")
-
-    
     def _convert_to_web_compatible(self, input_path, output_path):
         """
         将视频转换为浏览器兼容的H.264格式
@@ -466,59 +622,21 @@ class VideoGenerator:
             str: 输出视频路径
         """
         try:
-            # 尝试使用FFmpeg（如果可用）
+            # 使用启动时探测选出的编码配置，只做一次转码
             import subprocess
             
-            # 检查FFmpeg是否可用
-            try:
-                subprocess.run(['ffmpeg', '-version'], capture_output=True, check=True)
-                has_ffmpeg = True
-            except:
-                has_ffmpeg = False
-            
-            if has_ffmpeg:
-                # 尝试多种FFmpeg命令（兼容不同版本）
+            if ffmpeg_available():
+                cmd = ['ffmpeg', '-y', '-loglevel', 'error', '-i', input_path] + \
+                    selected_codec_args() + ['-movflags', '+faststart', output_path]
+                result = subprocess.run(cmd, capture_output=True, text=True)
                 
-                # 命令1: 完整参数（适用于完整版FFmpeg）
-                cmd1 = [
-                    'ffmpeg', '-y', '-i', input_path,
-                    '-c:v', 'libx264',
-                    '-preset', 'medium',
-                    '-crf', '23',
-                    '-pix_fmt', 'yuv420p',
-                    '-movflags', '+faststart',
-                    output_path
-                ]
-                
-                # 命令2: 基础参数（适用于精简版FFmpeg）
-                cmd2 = [
-                    'ffmpeg', '-y', '-i', input_path,
-                    '-c:v', 'libx264',
-                    '-pix_fmt', 'yuv420p',
-                    '-movflags', '+faststart',
-                    output_path
-                ]
-                
-                # 命令3: 最简参数（最大兼容性）
-                cmd3 = [
-                    'ffmpeg', '-y', '-i', input_path,
-                    '-vcodec', 'libx264',
-                    '-pix_fmt', 'yuv420p',
-                    output_path
-                ]
-                
-                # 依次尝试
-                for i, cmd in enumerate([cmd1, cmd2, cmd3], 1):
-                    result = subprocess.run(cmd, capture_output=True, text=True)
-                    
-                    if result.returncode == 0 and os.path.exists(output_path):
-                        print(f"✅ FFmpeg转换成功（方案{i}）")
-                        # 删除临时文件
-                        if os.path.exists(input_path):
-                            os.remove(input_path)
-                        return output_path
-                    elif i == 3:  # 最后一次尝试失败
-                        print(f"⚠️ FFmpeg所有方案都失败")
+                if result.returncode == 0 and os.path.exists(output_path):
+                    print("✅ FFmpeg转换成功")
+                    # 删除临时文件
+                    if os.path.exists(input_path):
+                        os.remove(input_path)
+                    return output_path
+                print(f"⚠️ FFmpeg转换失败: {result.stderr[:300]}")
             
             # 如果FFmpeg不可用，使用OpenCV重新编码
             print("ℹ️ 使用OpenCV重新编码...")
@@ -660,12 +778,14 @@ class VideoGenerator:
         color=(0, 165, 255),
         marker="circle",
         trace=True,
-        trace_len=8,
+        trace_len=BALL_TRACE_LEN,
+        trace_queue=None,
     ):
         """
         在帧上绘制排球标记（支持圆/方 + 轨迹）
 
         detections: [{ "bbox": (x1,y1,x2,y2), "label": str, "score": float }]
+        trace_queue: 本次渲染的轨迹队列；为 None 时使用实例级队列
         """
 
         if frame is None:
@@ -677,9 +797,10 @@ class VideoGenerator:
         # -------------------------
         # 初始化轨迹队列
         # -------------------------
-        if not hasattr(self, "_trace_queue"):
-            from collections import deque
-            self._trace_queue = deque([None] * trace_len, maxlen=trace_len)
+        if trace_queue is None:
+            if not hasattr(self, "_trace_queue"):
+                self._trace_queue = deque([None] * trace_len, maxlen=trace_len)
+            trace_queue = self._trace_queue
 
         # -------------------------
         # 当前 bbox 进入队列
@@ -697,16 +818,16 @@ class VideoGenerator:
                 y2 = max(0, min(h - 1, int(y2)))
 
                 cur_box = (x1, y1, x2, y2)
-                self._trace_queue.appendleft(cur_box)
+                trace_queue.appendleft(cur_box)
             else:
-                self._trace_queue.appendleft(None)
+                trace_queue.appendleft(None)
         else:
-            self._trace_queue.appendleft(None)
+            trace_queue.appendleft(None)
 
         # -------------------------
         # 开始绘制轨迹
         # -------------------------
-        for i, box in enumerate(self._trace_queue):
+        for i, box in enumerate(trace_queue):
             if box is None:
                 continue
 
@@ -800,8 +921,8 @@ class VideoGenerator:
         # 处理每一帧
         for idx, frame_data in enumerate(frames_data):
             try:
-                # 创建白色背景
-                skeleton_frame = np.ones((height, width, 3), dtype=np.uint8) * np.array(bg_color, dtype=np.uint8)
+                # 背景底图（缓存，逐帧只做一次拷贝）
+                skeleton_frame = self._canvas_cache.get(width, height, bg_color)
                 
                 landmarks = frame_data['landmarks']
                 
@@ -946,31 +1067,25 @@ class VideoGenerator:
         """
         height, width = frame.shape[:2]
         
-        # 创建关键点位置数组（用于连线）
-        points = {}
+        # 关键点坐标数组（按 MediaPipe 索引存放），只保留可见度高的点
+        coords = np.zeros((self._num_slots, 2), dtype=np.int32)
+        visible = np.zeros(self._num_slots, dtype=bool)
         for name, idx in self.landmark_map.items():
-            if name in landmarks:
-                lm = landmarks[name]
-                x = int(lm['x'] * width)
-                y = int(lm['y'] * height)
-                visibility = lm.get('visibility', 1.0)
-                
-                # 只绘制可见度高的点
-                if visibility > 0.5:
-                    points[idx] = (x, y)
-        
-        # 绘制连接线
-        for connection in self.connections:
-            start_idx, end_idx = connection
-            if start_idx in points and end_idx in points:
-                cv2.line(frame, points[start_idx], points[end_idx], 
-                        line_color, line_thickness)
-        
-        # 绘制关键点
-        for idx, point in points.items():
-            cv2.circle(frame, point, point_radius, point_color, -1)
-            # 添加点的标注（可选）
-            # cv2.putText(frame, str(idx), point, cv2.FONT_HERSHEY_SIMPLEX, 0.3, (255, 255, 255), 1)
+            lm = landmarks.get(name)
+            if lm is not None and lm.get('visibility', 1.0) > 0.5:
+                coords[idx] = (int(lm['x'] * width), int(lm['y'] * height))
+                visible[idx] = True
+        
+        # 两端都可见的连接线，一次 polylines 画完
+        conn = self._connection_array
+        drawable = visible[conn[:, 0]] & visible[conn[:, 1]]
+        if drawable.any():
+            cv2.polylines(frame, list(coords[conn[drawable]]), False, line_color, line_thickness)
+        
+        # 关键点：单点闭合折线在线宽 > 1 时画成圆头，即直径为线宽的实心圆
+        if visible.any():
+            cv2.polylines(frame, list(coords[visible].reshape(-1, 1, 2)), True,
+                          point_color, max(2, point_radius * 2))
         
         return frame
     
@@ -1013,65 +1128,16 @@ class VideoGenerator:
         if not out or not out.isOpened():
             raise RuntimeError("无法创建视频写入器")
         
-        # 收集轨迹点
-        trajectories = sequence_result['trajectories']
+        # 轨迹图层逐帧追加，不再每帧从第 0 帧重画整条轨迹
+        frames_data = sequence_result['frames_data']
+        state = self._new_render_state()
         
         # 处理每一帧
         for idx, frame in enumerate(frames):
-            trajectory_frame = frame.copy()
-            
-            # 绘制当前帧之前的轨迹
-            for point_name in ['left_wrist', 'right_wrist']:
-                if point_name not in trajectories:
-                    continue
-                
-                traj = trajectories[point_name]
-                color = (255, 0, 0) if 'left' in point_name else (0, 0, 255)
-                
-                # 绘制轨迹线
-                points_to_draw = []
-                for i in range(min(idx + 1, len(traj['x']))):
-                    x = traj['x'][i]
-                    y = traj['y'][i]
-                    vis = traj['visibility'][i]
-                    
-                    if x is not None and y is not None and vis > 0.5:
-                        px = int(x * width)
-                        py = int(y * height)
-                        points_to_draw.append((px, py))
-                
-                # 绘制轨迹点和连线
-                for i in range(1, len(points_to_draw)):
-                    # 线条透明度渐变
-                    alpha = 0.3 + 0.7 * (i / max(1, len(points_to_draw) - 1))
-                    cv2.line(trajectory_frame, points_to_draw[i-1], points_to_draw[i], 
-                            color, 2)
-                
-                # 当前点加粗显示
-                if len(points_to_draw) > 0:
-                    cv2.circle(trajectory_frame, points_to_draw[-1], 8, color, -1)
-            
-            # 绘制当前骨架
-            landmarks = sequence_result['frames_data'][idx]['landmarks']
-            if landmarks:
-                trajectory_frame = self._draw_skeleton(trajectory_frame, landmarks, 
-                                                      point_color=(0, 255, 0),
-                                                      line_color=(0, 255, 0),
-                                                      point_radius=5,
-                                                      line_thickness=2)
-            
-            # 添加标题和说明
-            cv2.putText(trajectory_frame, "Motion Trajectory", 
-                       (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
-            cv2.putText(trajectory_frame, f"Frame {idx + 1}/{len(frames)}", 
-                       (10, height - 20), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
-            
-            # 图例
-            cv2.rectangle(trajectory_frame, (width - 150, 10), (width - 10, 80), (0, 0, 0), -1)
-            cv2.putText(trajectory_frame, "Left Wrist", (width - 140, 35), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 1)
-            cv2.putText(trajectory_frame, "Right Wrist", (width - 140, 60), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 1)
+            landmarks = frames_data[idx]['landmarks']
+            trajectory_frame = self._render_trajectory_frame(
+                frame, landmarks, idx, len(frames), state=state
+            )
             
             # 写入帧（不检查返回值）
             out.write(trajectory_frame)
@@ -0,0 +1,663 @@
+"""
+视频写入模块 - 边渲染边编码
+
+- probe_ffmpeg(): 启动时探测一次 ffmpeg 能力（编码器、预设、像素格式），
+  用极短的测试编码验证候选 H.264 编码器，选出最快的可用配置并持久化
+- FFmpegPipeWriter: BGR 帧经 rawvideo 管道送入 ffmpeg，后台线程负责写 stdin，
+  有界队列满时 write() 阻塞（背压），内存中最多只保留 queue_size 帧
+- ChunkedFFmpegWriter: 长视频按 GOP 对齐切段，多个 ffmpeg 进程并行编码，
+  最后用 concat demuxer 无损拼接（-c copy）
+- HLSPipeWriter: 输出 fMP4 分片 + m3u8 播放列表，分片编码完成即发布，前端边生成边播放
+- OpenCVVideoWriter: 没有 ffmpeg 时的降级方案（mp4v，浏览器可能无法播放）
+- open_video_writer(): 按探测结果和视频长度选择写入器
+"""
+import glob
+import json
+import os
+import queue
+import re
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+import cv2
+
+from .thread_budget import ffmpeg_threads, worker_cpus
+
+DEFAULT_QUEUE_SIZE = 8
+
+# 候选 H.264 编码器（按速度优先排列）及其编码参数；硬件编码器需要测试编码通过才会使用
+H264_ENCODERS = [
+    ('h264_nvenc', ['-preset', 'p2', '-cq', '23']),
+    ('h264_qsv', ['-preset', 'veryfast', '-global_quality', '23']),
+    ('h264_videotoolbox', ['-q:v', '60']),
+    ('libx264', ['-preset', 'fast', '-crf', '23']),
+    ('libopenh264', ['-b:v', '4M']),
+]
+
+# libx264 的预设是字符串参数，-h 输出里没有枚举值
+X264_PRESETS = [
+    'ultrafast', 'superfast', 'veryfast', 'faster', 'fast',
+    'medium', 'slow', 'slower', 'veryslow',
+]
+
+# 编码档位里的 preset 使用 x264 名称，硬件编码器按速度档位映射
+NVENC_PRESETS = {
+    'ultrafast': 'p1', 'superfast': 'p1', 'veryfast': 'p2', 'faster': 'p3', 'fast': 'p4',
+    'medium': 'p5', 'slow': 'p6', 'slower': 'p7', 'veryslow': 'p7',
+}
+
+# 硬件编码器（并行会话数受驱动限制）
+HARDWARE_ENCODERS = ('h264_nvenc', 'h264_qsv', 'h264_videotoolbox')
+
+# 测试编码使用的帧尺寸（部分硬件编码器对最小尺寸有要求）
+PROBE_FRAME_SIZE = (256, 144)
+
+_SENTINEL = object()
+_capabilities = None
+_probe_lock = threading.Lock()
+
+
+# 硬件编码器依赖的设备节点（NVIDIA / VAAPI / QSV）
+_ENCODER_DEVICE_GLOBS = ('/dev/nvidia*', '/dev/dri/*')
+
+
+def _ffmpeg_signature(path):
+    """
+    探测结果的缓存键：ffmpeg 二进制 + 主机名 + 硬件编码设备节点
+
+    缓存文件可能放在多台主机共享的数据卷上，硬件编码器是否可用取决于本机设备，
+    不同主机（或设备变化后）重新探测
+    """
+    stat = os.stat(path)
+    devices = sorted(device for pattern in _ENCODER_DEVICE_GLOBS for device in glob.glob(pattern))
+    return {'path': path, 'size': stat.st_size, 'mtime': int(stat.st_mtime),
+            'host': socket.gethostname(), 'devices': devices}
+
+
+def _run(cmd, timeout=10, input=None):
+    return subprocess.run(cmd, capture_output=True, timeout=timeout, input=input)
+
+
+def _list_encoders(ffmpeg):
+    """解析 ffmpeg -encoders，返回视频编码器名称集合"""
+    out = _run([ffmpeg, '-hide_banner', '-encoders']).stdout.decode('utf-8', errors='ignore')
+    names = set()
+    for line in out.splitlines():
+        parts = line.split()
+        if len(parts) >= 2 and len(parts[0]) == 6 and parts[0].startswith('V'):
+            names.add(parts[1])
+    return names
+
+
+def _describe_encoder(ffmpeg, name):
+    """解析 ffmpeg -h encoder=<name>：支持的像素格式和 preset 取值"""
+    out = _run([ffmpeg, '-hide_banner', '-h', f'encoder={name}']).stdout.decode('utf-8', errors='ignore')
+    pix_fmts = []
+    presets = []
+    in_preset = False
+    for line in out.splitlines():
+        if 'Supported pixel formats:' in line:
+            pix_fmts = line.split(':', 1)[1].split()
+            continue
+        option = re.match(r'^\s+-(\S+)\s', line)
+        if option:
+            in_preset = option.group(1) == 'preset'
+            continue
+        if in_preset:
+            value = re.match(r'^\s{4,}(\w+)\s', line)
+            if value:
+                presets.append(value.group(1))
+    if name == 'libx264' and not presets:
+        presets = list(X264_PRESETS)
+    return {'pix_fmts': pix_fmts, 'presets': presets}
+
+
+def _test_encode(ffmpeg, name, args):
+    """用几帧黑色画面走一遍 rawvideo 管道，验证编码器在本机确实可用"""
+    width, height = PROBE_FRAME_SIZE
+    cmd = [
+        ffmpeg, '-hide_banner', '-loglevel', 'error',
+        '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{width}x{height}', '-r', '10',
+        '-i', '-', '-an', '-vcodec', name, '-pix_fmt', 'yuv420p',
+    ] + list(args) + ['-f', 'mp4', '-y', os.devnull]
+    try:
+        result = _run(cmd, timeout=20, input=bytes(width * height * 3 * 3))
+    except subprocess.TimeoutExpired:
+        return '测试编码超时'
+    if result.returncode != 0:
+        return result.stderr.decode('utf-8', errors='ignore').strip()[-200:] or f'退出码 {result.returncode}'
+    return None
+
+
+def _probe(ffmpeg):
+    t0 = time.time()
+    version = _run([ffmpeg, '-version']).stdout.decode('utf-8', errors='ignore').splitlines()
+    available = _list_encoders(ffmpeg)
+
+    encoders = {}
+    rejected = {}
+    selected = None
+    for name, args in H264_ENCODERS:
+        if name not in available:
+            continue
+        encoders[name] = _describe_encoder(ffmpeg, name)
+        if selected is not None:
+            continue
+        if 'yuv420p' not in encoders[name]['pix_fmts'] and 'nv12' not in encoders[name]['pix_fmts']:
+            rejected[name] = '不支持 yuv420p'
+            continue
+        error = _test_encode(ffmpeg, name, args)
+        if error:
+            rejected[name] = error
+        else:
+            selected = {'encoder': name, 'args': list(args)}
+
+    return {
+        'available': True,
+        'version': version[0] if version else '',
+        'encoders': encoders,
+        'selected': selected,
+        'rejected': rejected,
+        'probe_ms': round((time.time() - t0) * 1000, 1),
+        'probed_at': int(time.time()),
+    }
+
+
+def probe_ffmpeg(cache_file=None, refresh=False):
+    """
+    探测 ffmpeg 能力并选出编码配置（进程内只做一次）
+
+    Args:
+        cache_file: 持久化文件；同一主机上 ffmpeg 可执行文件和硬件编码设备未变化时直接复用，多个 worker 共享
+        refresh: 忽略已有结果重新探测
+
+    Returns:
+        dict: available / version / encoders / selected / rejected ...
+    """
+    global _capabilities
+    with _probe_lock:
+        if _capabilities is not None and not refresh:
+            return _capabilities
+
+        ffmpeg = shutil.which('ffmpeg')
+        if ffmpeg is None:
+            _capabilities = {'available': False, 'selected': None, 'encoders': {}, 'rejected': {}}
+            print("ℹ️ 未找到 FFmpeg，视频将使用 OpenCV 写入")
+            return _capabilities
+
+        signature = _ffmpeg_signature(ffmpeg)
+        if cache_file is not None and not refresh:
+            try:
+                with open(cache_file, 'r', encoding='utf-8') as f:
+                    cached = json.load(f)
+                if cached.get('signature') == signature:
+                    _capabilities = cached['capabilities']
+                    return _capabilities
+            except (OSError, ValueError, KeyError):
+                pass
+
+        try:
+            _capabilities = _probe(ffmpeg)
+        except Exception as exc:
+            print(f"⚠️ FFmpeg 能力探测失败: {exc}")
+            _capabilities = {'available': False, 'selected': None, 'encoders': {}, 'rejected': {},
+                             'error': str(exc)}
+            return _capabilities
+
+        selected = _capabilities['selected']
+        print(f"✅ FFmpeg 编码器: {selected['encoder'] if selected else '无可用 H.264 编码器'} "
+              f"(探测 {_capabilities['probe_ms']} ms)")
+
+        if cache_file is not None:
+            cache_file = Path(cache_file)
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = cache_file.with_suffix(f'.{os.getpid()}.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'signature': signature, 'capabilities': _capabilities}, f,
+                          ensure_ascii=False, indent=2)
+            os.replace(tmp_path, cache_file)
+        return _capabilities
+
+
+def get_ffmpeg_capabilities():
+    """已探测的 ffmpeg 能力（尚未探测时立即探测一次，不持久化）"""
+    return _capabilities if _capabilities is not None else probe_ffmpeg()
+
+
+def warmup_encoder():
+    """
+    用选出的编码配置跑一次测试编码（加载 ffmpeg 及编码器库），探测结果来自缓存时尤其有用
+
+    Returns:
+        float: 耗时（秒）；没有可用编码配置时返回 None
+    """
+    capabilities = get_ffmpeg_capabilities()
+    selected = capabilities.get('selected')
+    ffmpeg = shutil.which('ffmpeg')
+    if selected is None or ffmpeg is None:
+        return None
+    t0 = time.perf_counter()
+    error = _test_encode(ffmpeg, selected['encoder'], selected['args'])
+    if error:
+        print(f"⚠️ FFmpeg 预热编码失败: {error}")
+    return time.perf_counter() - t0
+
+
+def ffmpeg_available() -> bool:
+    """是否有可用的浏览器兼容 H.264 编码配置"""
+    return get_ffmpeg_capabilities().get('selected') is not None
+
+
+def selected_codec_args():
+    """探测选出的编码参数（-vcodec ... -pix_fmt yuv420p ...），按线程预算限制编码线程数"""
+    selected = get_ffmpeg_capabilities()['selected']
+    args = ['-vcodec', selected['encoder'], '-pix_fmt', 'yuv420p'] + list(selected['args'])
+    if ffmpeg_threads():
+        args += ['-threads', str(ffmpeg_threads())]
+    return args
+
+
+def _set_threads(args, threads):
+    """设置（或替换已有的）-threads 参数"""
+    args = [a for i, a in enumerate(args) if a != '-threads' and (i == 0 or args[i - 1] != '-threads')]
+    return args + ['-threads', str(int(threads))]
+
+
+def profile_codec_args(profile=None):
+    """
+    按编码档位生成当前编码器的参数
+
+    Args:
+        profile: 编码档位 dict（preset / crf / tune / threads / faststart / max_height），
+            preset 使用 x264 名称，crf 映射为各编码器的质量参数；为 None 时使用探测选出的默认参数
+
+    Returns:
+        list: ffmpeg 输出参数
+    """
+    if not profile:
+        return selected_codec_args()
+
+    capabilities = get_ffmpeg_capabilities()
+    encoder = capabilities['selected']['encoder']
+    supported_presets = capabilities.get('encoders', {}).get(encoder, {}).get('presets') or []
+    preset = profile.get('preset')
+    crf = int(profile.get('crf', 23))
+
+    if encoder == 'libx264':
+        quality = ['-preset', preset, '-crf', str(crf)]
+        if profile.get('tune'):
+            quality += ['-tune', profile['tune']]
+    elif encoder == 'h264_nvenc':
+        quality = ['-preset', NVENC_PRESETS.get(preset, 'p4'), '-cq', str(crf)]
+    elif encoder == 'h264_qsv':
+        quality = ['-preset', preset, '-global_quality', str(crf)]
+    elif encoder == 'h264_videotoolbox':
+        quality = ['-q:v', str(max(1, min(100, 100 - 2 * crf)))]
+    else:
+        quality = list(capabilities['selected']['args'])
+
+    # 编码器不支持该 preset 时去掉，交给编码器默认值
+    if '-preset' in quality and supported_presets and quality[quality.index('-preset') + 1] not in supported_presets:
+        i = quality.index('-preset')
+        del quality[i:i + 2]
+
+    # max_height 由 VideoGenerator 在渲染前缩放帧实现，这里不再加 scale 滤镜
+    args = ['-vcodec', encoder, '-pix_fmt', 'yuv420p'] + quality
+    # 档位未指定线程数（0 = 自动）时使用线程预算
+    threads = profile.get('threads') or ffmpeg_threads()
+    if threads:
+        args += ['-threads', str(int(threads))]
+    if profile.get('faststart'):
+        # moov 放到文件头，浏览器边下边播
+        args += ['-movflags', '+faststart']
+    return args
+
+
+class FFmpegPipeWriter:
+    """通过 rawvideo 管道把帧流式写入 ffmpeg"""
+
+    def __init__(self, output_path, width, height, fps, codec_args=None, queue_size=DEFAULT_QUEUE_SIZE):
+        self.output_path = output_path
+        self.width = int(width)
+        self.height = int(height)
+        self.fps = fps
+        self.codec_args = list(codec_args or selected_codec_args())
+        self.frames_written = 0
+        self._queue = queue.Queue(maxsize=max(1, int(queue_size)))
+        self._error = None
+        self._proc = None
+        self._thread = None
+        self._input_finished = False
+
+    def open(self):
+        cmd = [
+            'ffmpeg', '-y',
+            '-loglevel', 'error', '-nostats',
+            '-f', 'rawvideo',
+            '-vcodec', 'rawvideo',
+            '-pix_fmt', 'bgr24',
+            '-s', f'{self.width}x{self.height}',
+            '-r', str(self.fps),
+            '-i', '-',              # 从 stdin 读
+            '-an',                  # 无音频
+        ] + self.codec_args + [self.output_path]
+
+        self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        self._thread = threading.Thread(target=self._pump, name='ffmpeg-writer', daemon=True)
+        self._thread.start()
+        return self
+
+    def _pump(self):
+        """后台线程：从队列取帧写入 ffmpeg stdin"""
+        try:
+            while True:
+                frame = self._queue.get()
+                if frame is _SENTINEL:
+                    break
+                self._proc.stdin.write(frame.tobytes())
+        except Exception as exc:
+            self._error = exc
+            # 继续取空队列，避免生产者永远阻塞
+            while self._queue.get() is not _SENTINEL:
+                pass
+
+    def write(self, frame):
+        """写入一帧；队列满时阻塞，直到 ffmpeg 消化掉前面的帧"""
+        if frame is None:
+            return
+        if self._error is not None:
+            raise RuntimeError(f"FFmpeg 写入失败: {self._error}")
+        if frame.shape[0] != self.height or frame.shape[1] != self.width:
+            frame = cv2.resize(frame, (self.width, self.height))
+        self._queue.put(frame)
+        self.frames_written += 1
+
+    def finish_input(self):
+        """结束输入（不等待），ffmpeg 在后台继续编码队列中剩余的帧"""
+        if not self._input_finished:
+            self._input_finished = True
+            self._queue.put(_SENTINEL)
+
+    def close(self):
+        """结束输入并等待编码完成，返回输出路径"""
+        self.finish_input()
+        self._thread.join()
+        try:
+            self._proc.stdin.close()
+        except OSError:
+            pass
+        stderr = self._proc.stderr.read().decode('utf-8', errors='ignore')
+        ret = self._proc.wait()
+
+        if self._error is not None or ret != 0 or not os.path.exists(self.output_path):
+            raise RuntimeError(f"FFmpeg 编码失败，代码 {ret}: {stderr[:300] or self._error}")
+        return self.output_path
+
+    def abort(self):
+        """出错时终止 ffmpeg 并删除不完整的输出"""
+        if self._proc is not None and self._proc.poll() is None:
+            self._proc.kill()
+            self._proc.wait()
+        if self._thread is not None and self._thread.is_alive():
+            self.finish_input()
+            self._thread.join(timeout=5)
+        if os.path.exists(self.output_path):
+            os.remove(self.output_path)
+
+
+def _strip_faststart(args):
+    """分段编码时去掉 -movflags +faststart，只在拼接后的最终文件上做"""
+    args = list(args)
+    while '-movflags' in args:
+        i = args.index('-movflags')
+        del args[i:i + 2]
+    return args
+
+
+def gop_args(encoder, gop_frames):
+    """固定 GOP 长度；x264 关闭场景切换插入的关键帧，保证各段关键帧间隔一致"""
+    args = ['-g', str(int(gop_frames))]
+    if encoder == 'libx264':
+        args += ['-keyint_min', str(int(gop_frames)), '-sc_threshold', '0']
+    return args
+
+
+class ChunkedFFmpegWriter:
+    """
+    分段并行编码：时间线按 GOP 对齐切成若干段，每段一个 ffmpeg 进程，
+    最多 max_workers 段同时编码，全部完成后用 concat demuxer 直接拼接码流（不重新编码）
+
+    每段的队列与单进程写入器一样是有界的（queue_size），当前段的队列满时 write() 阻塞；
+    同时在编码的段数达到 max_workers 时，开始新段前等最早的一段编码完成（背压），
+    内存中最多约 max_workers * queue_size 帧
+    """
+
+    def __init__(self, output_path, width, height, fps, codec_args, segment_frames,
+                 gop_frames, max_workers=2, queue_size=DEFAULT_QUEUE_SIZE):
+        self.output_path = output_path
+        self.width = int(width)
+        self.height = int(height)
+        self.fps = fps
+        self.segment_frames = max(1, int(segment_frames))
+        self.max_workers = max(1, int(max_workers))
+        self.queue_size = max(1, int(queue_size))
+        self.frames_written = 0
+
+        codec_args = list(codec_args)
+        self._faststart = '-movflags' in codec_args
+        encoder = codec_args[codec_args.index('-vcodec') + 1] if '-vcodec' in codec_args else None
+        self._segment_args = _strip_faststart(codec_args) + gop_args(encoder, gop_frames)
+        self._tmp_dir = None
+        self._segments = []         # 按时间顺序的分段文件
+        self._current = None        # 正在接收帧的分段写入器
+        self._pending = deque()     # 已结束输入、等待编码完成的分段写入器
+
+    def open(self):
+        output_dir = os.path.dirname(os.path.abspath(self.output_path))
+        self._tmp_dir = tempfile.mkdtemp(prefix='segments_', dir=output_dir)
+        return self
+
+    def _start_segment(self):
+        # 同时编码的段数达到上限时，等最早的一段完成
+        while len(self._pending) + 1 > self.max_workers:
+            self._pending.popleft().close()
+        path = os.path.join(self._tmp_dir, f'seg_{len(self._segments):05d}.mp4')
+        self._segments.append(path)
+        self._current = FFmpegPipeWriter(path, self.width, self.height, self.fps,
+                                         codec_args=self._segment_args,
+                                         queue_size=self.queue_size).open()
+
+    def _finish_segment(self):
+        """结束当前段的输入，交给后台继续编码"""
+        self._current.finish_input()
+        self._pending.append(self._current)
+        self._current = None
+
+    def write(self, frame):
+        if frame is None:
+            return
+        if self._current is None:
+            self._start_segment()
+        self._current.write(frame)
+        self.frames_written += 1
+        if self._current.frames_written >= self.segment_frames:
+            self._finish_segment()
+
+    def close(self):
+        """等待所有分段编码完成并拼接，返回输出路径"""
+        try:
+            if self._current is not None:
+                self._finish_segment()
+            while self._pending:
+                self._pending.popleft().close()
+            if not self._segments:
+                raise RuntimeError("视频生成失败: 没有写入任何帧")
+            self._concat()
+        except BaseException:
+            self.abort()
+            raise
+        shutil.rmtree(self._tmp_dir, ignore_errors=True)
+        return self.output_path
+
+    def _concat(self):
+        list_file = os.path.join(self._tmp_dir, 'segments.txt')
+        with open(list_file, 'w', encoding='utf-8') as f:
+            for path in self._segments:
+                f.write(f"file '{path}'\n")
+        cmd = ['ffmpeg', '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0',
+               '-i', list_file, '-c', 'copy']
+        if self._faststart:
+            cmd += ['-movflags', '+faststart']
+        result = subprocess.run(cmd + [self.output_path], capture_output=True, text=True)
+        if result.returncode != 0 or not os.path.exists(self.output_path):
+            raise RuntimeError(f"FFmpeg 分段拼接失败，代码 {result.returncode}: {result.stderr[:300]}")
+
+    def abort(self):
+        """终止所有编码进程并删除临时分段和不完整的输出"""
+        writers = list(self._pending) + ([self._current] if self._current is not None else [])
+        self._pending.clear()
+        self._current = None
+        for writer in writers:
+            writer.abort()
+        if self._tmp_dir is not None:
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+        if os.path.exists(self.output_path):
+            os.remove(self.output_path)
+
+
+def hls_args(segment_seconds, playlist_path):
+    """fMP4 HLS 输出参数：按分片时长强制关键帧，播放列表为 event 类型（生成过程中可播放）"""
+    output_dir = os.path.dirname(playlist_path)
+    return [
+        '-force_key_frames', f'expr:gte(t,n_forced*{segment_seconds})',
+        '-f', 'hls',
+        '-hls_time', str(segment_seconds),
+        '-hls_playlist_type', 'event',
+        '-hls_segment_type', 'fmp4',
+        '-hls_fmp4_init_filename', 'init.mp4',
+        '-hls_segment_filename', os.path.join(output_dir, 'seg_%05d.m4s'),
+        # 分片和播放列表先写临时文件再改名，客户端不会读到写了一半的文件
+        '-hls_flags', 'independent_segments+temp_file',
+    ]
+
+
+class HLSPipeWriter(FFmpegPipeWriter):
+    """fMP4 HLS 写入器：output_path 为播放列表（.m3u8），分片写在同一目录"""
+
+    def __init__(self, output_path, width, height, fps, codec_args=None, queue_size=DEFAULT_QUEUE_SIZE,
+                 segment_seconds=2):
+        codec_args = _strip_faststart(codec_args or selected_codec_args())
+        super().__init__(output_path, width, height, fps,
+                         codec_args=codec_args + hls_args(segment_seconds, output_path),
+                         queue_size=queue_size)
+
+    def open(self):
+        os.makedirs(os.path.dirname(self.output_path), exist_ok=True)
+        return super().open()
+
+    def abort(self):
+        """出错时终止 ffmpeg 并删除已发布的分片"""
+        super().abort()
+        shutil.rmtree(os.path.dirname(self.output_path), ignore_errors=True)
+
+
+class OpenCVVideoWriter:
+    """OpenCV 降级写入器，接口与 FFmpegPipeWriter 一致"""
+
+    def __init__(self, output_path, width, height, fps):
+        self.output_path = output_path
+        self.width = int(width)
+        self.height = int(height)
+        self.fps = fps
+        self.frames_written = 0
+        self._out = None
+
+    def open(self):
+        print("⚠️ 回退到OpenCV，视频可能无法在浏览器播放")
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        self._out = cv2.VideoWriter(self.output_path, fourcc, self.fps, (self.width, self.height))
+        if not self._out.isOpened():
+            raise RuntimeError("无法创建视频写入器")
+        return self
+
+    def write(self, frame):
+        if frame is None:
+            return
+        if frame.shape[0] != self.height or frame.shape[1] != self.width:
+            frame = cv2.resize(frame, (self.width, self.height))
+        self._out.write(frame)
+        self.frames_written += 1
+
+    def close(self):
+        self._out.release()
+        if os.path.exists(self.output_path) and os.path.getsize(self.output_path) > 0:
+            print("⚠️ 使用OpenCV生成，浏览器可能无法播放，请下载查看")
+            return self.output_path
+        raise RuntimeError("视频生成失败")
+
+    def abort(self):
+        if self._out is not None:
+            self._out.release()
+        if os.path.exists(self.output_path):
+            os.remove(self.output_path)
+
+
+def chunked_workers(options, encoder, parallel_outputs=1):
+    """分段编码的并行进程数：本 worker 分到的 CPU 数（或配置值）按同时生成的视频数平分，硬件编码器另有上限"""
+    workers = options.get('max_workers') or worker_cpus()
+    if encoder in HARDWARE_ENCODERS:
+        workers = min(workers, options.get('hardware_workers', 2))
+    return max(1, int(workers) // max(1, int(parallel_outputs)))
+
+
+def open_video_writer(output_path, width, height, fps, profile=None, queue_size=DEFAULT_QUEUE_SIZE,
+                      expected_frames=None, chunked=None, parallel_outputs=1, hls=None):
+    """
+    有可用的 H.264 编码配置时使用 ffmpeg 管道写入器，否则回退到 OpenCV；
+    output_path 为 .m3u8 时输出 fMP4 HLS（需要 ffmpeg）
+
+    Args:
+        profile: 编码档位（见 profile_codec_args），OpenCV 降级时忽略
+        expected_frames: 预计帧数，用于判断是否值得分段并行编码
+        chunked: 分段编码配置（enabled / segment_seconds / gop_seconds / min_segments /
+            max_workers / hardware_workers），None 时总是单进程编码
+        parallel_outputs: 同时在生成的视频数，分段编码的进程数按此平分
+        hls: HLS 输出配置（segment_seconds），None 时使用默认分片时长
+    """
+    if str(output_path).endswith('.m3u8'):
+        if not ffmpeg_available():
+            raise RuntimeError("HLS 输出需要可用的 FFmpeg H.264 编码器")
+        segment_seconds = (hls or {}).get('segment_seconds', 2)
+        print(f"🔄 使用 FFmpeg ({get_ffmpeg_capabilities()['selected']['encoder']}) 输出 HLS 分片 "
+              f"({segment_seconds}s/片)...")
+        return HLSPipeWriter(output_path, width, height, fps, codec_args=profile_codec_args(profile),
+                             queue_size=queue_size, segment_seconds=segment_seconds).open()
+
+    if ffmpeg_available():
+        encoder = get_ffmpeg_capabilities()['selected']['encoder']
+        codec_args = profile_codec_args(profile)
+        if chunked and chunked.get('enabled') and expected_frames:
+            gop_frames = max(1, int(round(fps * chunked.get('gop_seconds', 2))))
+            # 段长取 GOP 的整数倍，保证每段都从关键帧开始
+            segment_frames = gop_frames * max(1, int(round(chunked.get('segment_seconds', 4) * fps / gop_frames)))
+            workers = chunked_workers(chunked, encoder, parallel_outputs)
+            if workers > 1 and expected_frames >= segment_frames * chunked.get('min_segments', 3):
+                print(f"🔄 使用 FFmpeg ({encoder}) 分段并行编码: 每段 {segment_frames} 帧, {workers} 个进程")
+                if not (profile and profile.get('threads')):
+                    # 每个进程分到的线程数，避免并行进程互相抢占
+                    codec_args = _set_threads(codec_args, max(1, worker_cpus() // workers))
+                return ChunkedFFmpegWriter(output_path, width, height, fps, codec_args,
+                                           segment_frames=segment_frames, gop_frames=gop_frames,
+                                           max_workers=workers, queue_size=queue_size).open()
+        # 短视频单进程编码
+        print(f"🔄 使用 FFmpeg ({encoder}) 流式生成浏览器兼容视频...")
+        return FFmpegPipeWriter(output_path, width, height, fps, codec_args=codec_args,
+                                queue_size=queue_size).open()
+    print("ℹ️ FFmpeg 不可用，回退到 OpenCV")
+    return OpenCVVideoWriter(output_path, width, height, fps).open()
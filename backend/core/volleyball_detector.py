@@ -4,7 +4,8 @@
 from __future__ import annotations
 
 
-from dataclasses import dataclass
+from collections import deque
+from dataclasses import dataclass, field
 from pathlib import Path
 from typing import List, Optional, Sequence, Tuple
 
@@ -13,11 +14,15 @@ CURRENT_DIR = Path(__file__).resolve().parent
 sys.path.append(str(CURRENT_DIR))
 
 import os
+import threading
+import time
 import cv2
 import numpy as np
 
 from roboflow import Roboflow
 from .my_utils import RoboYOLO, x_y_w_h, custom  # 来自第一个文件使用的工具
+from .batch_tuner import BatchSizeTuner, is_out_of_memory
+from .cancellation import check_cancelled
 
 # 默认使用哪种模型：'roboflow' 或 'yolov7'
 DEFAULT_BACKEND = "yolov7"
@@ -28,6 +33,17 @@ DEFAULT_YOLOV7_WEIGHTS = Path(CURRENT_DIR / "yV7-tiny/weights/best.pt")
 # Roboflow 项目信息（和第一个文件保持一致）
 ROBOFLOW_PROJECT = "volleyball-tracking"
 ROBOFLOW_VERSION = 18
+
+# 自适应推理尺寸：候选尺寸需为 stride(32) 的倍数
+DEFAULT_INPUT_SIZES = (320, 416, 512, 640)
+DEFAULT_MAX_INPUT_SIZE = 640
+# 探测阶段使用的帧数，以及推理尺度下排球的最小边长（像素）
+DEFAULT_PROBE_FRAMES = 8
+DEFAULT_MIN_BALL_PIXELS = 24
+
+# 未启用自动调优时的 YOLO batch 大小
+DEFAULT_MAX_YOLO_BATCH = 64
+
 # Roboflow API Key 可以放到环境变量中：ROBOFLOW_API_KEY
 # 或者你也可以在 _init_detector 里写死
 
@@ -47,6 +63,27 @@ class VolleyballDetection:
         return (x_min + x_max) / 2.0, (y_min + y_max) / 2.0
 
 
+@dataclass
+class DetectionSession:
+    """
+    单个视频的检测状态（自适应推理尺寸的探测结果、标注轨迹）
+
+    由 VolleyballDetector.new_session() 为每个视频创建，传给 detect / detect_batch / annotate；
+    高精度模式、NMS 阈值也随 session 按次传入，不修改共享的模型；
+    检测器本身只持有只读的模型，同一进程内同时处理的多个视频互不干扰
+    """
+
+    input_size: int
+    input_size_locked: bool
+    probe_box_sizes: List[float] = field(default_factory=list)
+    probe_seen: int = 0
+    probe_source_size: int = 0
+    trace: Optional[deque] = None
+    # 高精度模式：本视频是否精修，以及精修的额外推理统计（AccuracyRefiner.new_stats()）
+    high_accuracy: bool = False
+    refinement: Optional[dict] = None
+
+
 class VolleyballDetector:
     """
     使用 Roboflow / YOLOv7 (通过 RoboYOLO 封装) 检测排球
@@ -58,6 +95,16 @@ class VolleyballDetector:
         score_threshold: float = 0.45,
         max_results: int = 3,
         target_labels: Optional[Sequence[str]] = None,
+        input_sizes: Optional[Sequence[int]] = None,
+        max_input_size: Optional[int] = None,
+        adaptive_input_size: bool = True,
+        probe_frames: Optional[int] = None,
+        min_ball_pixels: Optional[int] = None,
+        quantize: bool = False,
+        quantization_options: Optional[dict] = None,
+        accelerated="auto",
+        batch_tuner: Optional[BatchSizeTuner] = None,
+        high_accuracy_options: Optional[dict] = None,
     ):
         """
         Args:
@@ -67,6 +114,19 @@ class VolleyballDetector:
             score_threshold: 置信度阈值（对应第一个文件中的 confidence）
             max_results: 每帧最多返回的检测数量（目前逻辑只返回最主要的一个球，但接口保留）
             target_labels: 允许运动类别列表，默认 ["volleyball", "sports ball", "ball"]
+            input_sizes: 自适应推理尺寸的候选列表，默认 (320, 416, 512, 640)
+            max_input_size: 推理尺寸上限（letterbox 长边），默认 640
+            adaptive_input_size: 是否根据前几帧的排球尺寸为每个视频选择推理尺寸
+            probe_frames: 探测阶段使用的帧数
+            min_ball_pixels: 推理尺度下排球的最小边长，小于该值时不再缩小尺寸
+            quantize: 是否在 CPU 上尝试使用 INT8 量化检测器（需通过精度检查才会启用）
+            quantization_options: 量化参数（calibration_dir / labeled_dir / calibration_frames /
+                max_accuracy_drop / collect_from_uploads / collect_every_n_frames）
+            accelerated: GPU 加速模式（fp16 + channels_last + 锁页内存 + 独立拷贝流），
+                "auto" 表示有 GPU 时自动启用，False 关闭
+            batch_tuner: batch 大小自动调优器；为 None 时使用固定的 DEFAULT_MAX_YOLO_BATCH
+            high_accuracy_options: 高精度模式参数（enabled / ambiguous_low / ambiguous_high /
+                tta / ensemble_weights / fusion_iou / max_boxes），enabled 为 new_session() 的默认值
         """
         # ✅ 保持原有属性和参数名
         self.model_path = Path(model_path) if model_path else DEFAULT_YOLOV7_WEIGHTS
@@ -80,10 +140,42 @@ class VolleyballDetector:
         # 如果你想强制使用 yolov7，可以改成 "yolov7"
         self.backend = DEFAULT_BACKEND
 
+        # 自适应推理尺寸（仅 YOLOv7 后端有效，Roboflow 由服务端决定尺寸）
+        self.input_sizes = tuple(int(s) for s in (input_sizes or DEFAULT_INPUT_SIZES))
+        self.max_input_size = int(max_input_size or DEFAULT_MAX_INPUT_SIZE)
+        self.adaptive_input_size = bool(adaptive_input_size) and self.backend == "yolov7"
+        self.probe_frames = int(probe_frames or DEFAULT_PROBE_FRAMES)
+        self.min_ball_pixels = int(min_ball_pixels or DEFAULT_MIN_BALL_PIXELS)
+
+        # INT8 量化（仅 CPU + YOLOv7）
+        self.quantize = bool(quantize) and self.backend == "yolov7"
+        self.quantization_options = dict(quantization_options or {})
+        self.quantization_report: Optional[dict] = None
+        self._calibration_seen = 0
+        self._calibration_full = False
+
+        # GPU 加速模式：_init_detector 里确认设备后才真正启用
+        self._accelerated_requested = accelerated
+        self.accelerated = False
+
+        # batch 大小：按 模型 + 推理尺寸 + 设备 自动调优，OOM 时自动减半
+        self.batch_tuner = batch_tuner
+        self._fallback_batch = DEFAULT_MAX_YOLO_BATCH
+        self._model_id = self.model_path.name
+        self._device_name = "cpu"
+
+        # 高精度模式：只对置信度模糊的帧追加 TTA / 集成推理
+        self.high_accuracy_options = dict(high_accuracy_options or {})
+        self._refiner = None
+        self._refiner_lock = threading.Lock()
+
         # 内部实际使用的检测模型（RoboYOLO 封装）
         self._detector: Optional[RoboYOLO] = None
 
         self._init_detector()
+        if self.high_accuracy_options.get("enabled"):
+            # 默认开启时随模型一起加载集成权重（preload 模式下由各 worker 共享）
+            self._ensure_refiner()
 
     def _init_detector(self) -> None:
         """
@@ -118,6 +210,18 @@ class VolleyballDetector:
             # 第一个文件中用 model.conf 控制置信度
             model.conf = float(self.score_threshold)
 
+            if self.quantize:
+                model = self._maybe_quantize(model, weights_path)
+
+            on_gpu = next(model.parameters()).device.type == "cuda"
+            if self._accelerated_requested and on_gpu:
+                # fp16 + channels_last，输入走锁页内存和独立 CUDA 流
+                model.accelerate(half=True, channels_last=True)
+                self.accelerated = True
+                print("[VolleyballDetector] GPU 加速模式: fp16 + channels_last")
+
+            self._set_batch_identity(model, weights_path)
+
         else:
             raise ValueError(f"未知后端类型: {self.backend}, 支持 'roboflow' 或 'yolov7'")
 
@@ -126,24 +230,221 @@ class VolleyballDetector:
         self._detector = RoboYOLO(self.backend, model, float(self.score_threshold))
         print("[TEST][VolleyballDetector] 模型加载完成。")
 
+    def _set_batch_identity(self, model, weights_path: str) -> None:
+        """记录调优键所需的模型/设备标识（权重变化、精度模式、线程数变化都会重新调优）"""
+        import torch as _torch
+
+        stat = os.stat(weights_path)
+        quantized = bool(self.quantization_report and self.quantization_report.get("quantized"))
+        precision = "int8" if quantized else ("fp16" if self.accelerated else "fp32")
+        self._model_id = f"{self.model_path.name}:{stat.st_size}:{int(stat.st_mtime)}:{precision}"
+
+        device = next(model.parameters()).device
+        if device.type == "cuda":
+            self._device_name = f"cuda:{_torch.cuda.get_device_name(device)}"
+        else:
+            self._device_name = f"cpu:{_torch.get_num_threads()}t"
+
+    def _maybe_quantize(self, model, weights_path: str):
+        """
+        CPU 上尝试加载/构建 INT8 检测器；校准帧不足或精度检查不通过时保持浮点模型
+        """
+        if next(model.parameters()).device.type != "cpu":
+            print("[VolleyballDetector] 检测到 GPU，跳过 INT8 量化")
+            self.quantize = False
+            return model
+
+        from .detector_quantization import load_or_build_quantized
+
+        opts = self.quantization_options
+        weights_dir = Path(weights_path).parent
+        model, self.quantization_report = load_or_build_quantized(
+            model,
+            weights_path,
+            calibration_dir=opts.get("calibration_dir", weights_dir / "calibration"),
+            labeled_dir=opts.get("labeled_dir", weights_dir / "labeled"),
+            calibration_frames=int(opts.get("calibration_frames", 64)),
+            input_sizes=self.input_sizes,
+            max_accuracy_drop=float(opts.get("max_accuracy_drop", 0.02)),
+        )
+        model.conf = float(self.score_threshold)
+        status = "INT8" if self.quantization_report.get("quantized") else "FP32"
+        reason = self.quantization_report.get("reason", "")
+        print(f"[VolleyballDetector] 检测器精度模式: {status} {reason}")
+        return model
+
+    def _collect_calibration_frames(self, frames: Sequence[np.ndarray]) -> None:
+        """
+        量化模型尚未就绪时，从用户上传的视频里间隔采集原始帧作为校准样本
+        """
+        if not self.quantize or self._calibration_full:
+            return
+        if self.quantization_report and self.quantization_report.get("quantized"):
+            return
+        opts = self.quantization_options
+        if not opts.get("collect_from_uploads", True):
+            return
+
+        from .detector_quantization import save_calibration_frame
+
+        every_n = max(1, int(opts.get("collect_every_n_frames", 15)))
+        limit = int(opts.get("calibration_frames", 64))
+        calibration_dir = opts.get("calibration_dir", self.model_path.parent / "calibration")
+        for frame in frames:
+            self._calibration_seen += 1
+            if frame is None or self._calibration_seen % every_n:
+                continue
+            if not save_calibration_frame(frame, calibration_dir, limit):
+                self._calibration_full = True
+                return
+
+    # ----------------- 高精度模式 -----------------
+
+    def _ensure_refiner(self):
+        """
+        创建高精度精修器（仅 YOLOv7）：模糊区间内的帧再做 TTA / 多权重集成并用 WBF 融合；
+        只创建一次，之后各请求共享（精修器本身不保存单个视频的状态）
+        """
+        with self._refiner_lock:
+            if self._refiner is None:
+                from .detector_refinement import AccuracyRefiner
+
+                opts = self.high_accuracy_options
+                self._refiner = AccuracyRefiner(
+                    self._detector,
+                    self.score_threshold,
+                    ambiguous_low=float(opts.get("ambiguous_low", 0.15)),
+                    ambiguous_high=float(opts.get("ambiguous_high", 0.6)),
+                    tta=bool(opts.get("tta", True)),
+                    ensemble_weights=opts.get("ensemble_weights", ()),
+                    fusion_iou=float(opts.get("fusion_iou", 0.55)),
+                    max_boxes=int(opts.get("max_boxes", 5)),
+                )
+        return self._refiner
+
+    def _nms_conf(self, session: DetectionSession) -> float:
+        """
+        本视频快速模型的 NMS 阈值：高精度模式降到模糊区间下限以保留候选框，否则为 score_threshold
+        """
+        if session.high_accuracy:
+            return self._refiner.ambiguous_low
+        return float(self.score_threshold)
+
+    def _detections_from_preds(
+        self,
+        preds,
+        frames: Sequence[np.ndarray],
+        sizes: Sequence[Tuple[int, int]],
+        session: DetectionSession,
+    ) -> List[List[VolleyballDetection]]:
+        """
+        把一个 batch 的底层预测结果转换为每帧的 VolleyballDetection 列表
+        """
+        if session.high_accuracy:
+            refined = self._refiner.refine(frames, preds, session.input_size, session.refinement)
+            return [
+                self._bbox_to_detections(bbox, h, w, score=score)
+                for (bbox, score), (h, w) in zip(refined, sizes)
+            ]
+
+        detections: List[List[VolleyballDetection]] = []
+        for j, (h, w) in enumerate(sizes):
+            if self.backend == "yolov7":
+                # ⚠️ 注意：这里的 idx 是小 batch 内部的 j
+                bbox = x_y_w_h(preds, self.backend, idx=j)
+            elif self.backend == "roboflow":
+                bbox = x_y_w_h(preds[j], self.backend)
+            else:
+                bbox = (0, 0, 0, 0)
+            detections.append(self._bbox_to_detections(bbox, h, w))
+        return detections
+
+    # ----------------- batch 大小 -----------------
+
+    def _batch_key(self, input_size: int) -> Optional[str]:
+        if self.batch_tuner is None or self.backend != "yolov7":
+            return None
+        device_name = self._device_name
+        if device_name.startswith("cpu"):
+            import torch as _torch
+
+            # 线程数可能在模型加载之后才按线程预算调整（preload 模式下在 fork 之后）
+            device_name = f"cpu:{_torch.get_num_threads()}t"
+        return self.batch_tuner.make_key(self._model_id, input_size, device_name)
+
+    def get_batch_size(self, input_size: Optional[int] = None, tune: bool = False) -> int:
+        """
+        指定推理尺寸（默认 max_input_size）下的 YOLO batch 大小
+
+        没有调优结果时返回调优器的默认值（保守值，OOM 时仍会减半回退）；
+        只有 tune=True（预热阶段）才在实际模型上做基准测试，避免请求线程里同步调优
+        """
+        input_size = int(input_size or self.max_input_size)
+        key = self._batch_key(input_size)
+        if key is None:
+            return self._fallback_batch
+        batch_size = self.batch_tuner.get(key)
+        if batch_size is None:
+            if not tune:
+                return self.batch_tuner.default_batch
+            batch_size = self.batch_tuner.tune(
+                key, lambda n: self._run_benchmark_batch(n, input_size), self._device_name
+            )
+        return batch_size
+
+    def _run_benchmark_batch(self, n: int, input_size: int) -> None:
+        frame = np.zeros(self.batch_tuner.bench_frame_shape, dtype=np.uint8)
+        self._detector.predict_batch([frame] * n, size=input_size)
+
+    def _back_off_batch_size(self, current: int, input_size: int) -> int:
+        """运行时内存不足：batch 减半（启用调优器时持久化）"""
+        import torch as _torch
+
+        if _torch.cuda.is_available():
+            _torch.cuda.empty_cache()
+        key = self._batch_key(input_size)
+        if key is None:
+            self._fallback_batch = max(1, int(current) // 2)
+            return self._fallback_batch
+        return self.batch_tuner.back_off(key, current)
+
     # ----------------- 对外接口：保持不变 -----------------
 
-    def detect(self, frame: np.ndarray) -> List[VolleyballDetection]:
+    def detect(self, frame: np.ndarray, session: Optional[DetectionSession] = None) -> List[VolleyballDetection]:
         """
         检测单帧中的排球
+
+        Args:
+            session: 所属视频的检测状态（new_session()）；为 None 时按单张图片处理（最大推理尺寸）
         """
         if frame is None or self._detector is None:
             return []
+        if session is None:
+            session = self.new_session()
 
         height, width = frame.shape[:2]
+        self._collect_calibration_frames([frame])
 
         # === 调用第一个文件的 YOLO 预测方式 ===
-        pred = self._detector.predict(frame)
+        pred = self._detector.predict(frame, size=session.input_size, conf=self._nms_conf(session))
+
+        if session.high_accuracy:
+            detections = self._detections_from_preds(pred, [frame], [(height, width)], session)[0]
+        else:
+            # x_y_w_h 返回 (x0, y0, w, h)
+            bbox = x_y_w_h(pred, self.backend)
+            # print("[TEST][VolleyballDetector][DETECT] bbox(x0,y0,w,h):", bbox)
 
-        # x_y_w_h 返回 (x0, y0, w, h)
-        bbox = x_y_w_h(pred, self.backend)
-        # print("[TEST][VolleyballDetector][DETECT] bbox(x0,y0,w,h):", bbox)
+            detections = self._bbox_to_detections(bbox, height, width)
+        self._observe_probe(session, [detections], [(height, width)])
+        return detections
 
+    def _bbox_to_detections(
+        self, bbox, height: int, width: int, score: float = 1.0
+    ) -> List[VolleyballDetection]:
+        """
+        把 (x0, y0, w, h) 转换为 VolleyballDetection 列表（无结果时返回空列表）
+        """
         # === 无结果 ===
         if not bbox or bbox == (0, 0, 0, 0):
             return []
@@ -172,9 +473,8 @@ class VolleyballDetector:
         nx_max = x_max / float(width)
         ny_max = y_max / float(height)
 
-        # === YOLO 返回的 pred 里包含 score，你如果需要也可以从 pred 中提取 ===
+        # === YOLO 返回的 pred 里包含 score；高精度模式下传入融合后的置信度 ===
         label = self.target_labels[0]
-        score = 1.0  # 你可以换成 pred 的置信度
 
         detection = VolleyballDetection(
             label=label,
@@ -185,6 +485,161 @@ class VolleyballDetector:
 
         return [detection]
 
+    # ----------------- 自适应推理尺寸 -----------------
+
+    def new_session(self, high_accuracy: Optional[bool] = None) -> DetectionSession:
+        """
+        开始处理新视频前调用：从最大推理尺寸开始，重新探测排球尺度
+
+        Args:
+            high_accuracy: 本视频是否启用高精度模式（仅 YOLOv7），None 时使用 high_accuracy_options["enabled"]
+        """
+        if high_accuracy is None:
+            high_accuracy = self.high_accuracy_options.get("enabled", False)
+        high_accuracy = bool(high_accuracy) and self.backend == "yolov7"
+        refinement = self._ensure_refiner().new_stats() if high_accuracy else None
+        return DetectionSession(
+            input_size=self.max_input_size,
+            input_size_locked=not self.adaptive_input_size,
+            high_accuracy=high_accuracy,
+            refinement=refinement,
+        )
+
+    def _observe_probe(
+        self,
+        session: DetectionSession,
+        detections_per_frame: Sequence[List[VolleyballDetection]],
+        sizes: Sequence[Tuple[int, int]],
+    ) -> None:
+        """
+        探测阶段：记录前几帧检测框的大小，帧数够了就确定本视频的推理尺寸
+        """
+        if session.input_size_locked:
+            return
+
+        for detections, (h, w) in zip(detections_per_frame, sizes):
+            session.probe_seen += 1
+            session.probe_source_size = max(session.probe_source_size, h, w)
+            for det in detections:
+                x_min, y_min, x_max, y_max = det.bbox
+                session.probe_box_sizes.append(float(max(x_max - x_min, y_max - y_min)))
+
+        if session.probe_seen >= self.probe_frames:
+            session.input_size = self._choose_input_size(session)
+            session.input_size_locked = True
+            print(f"[VolleyballDetector] 自适应推理尺寸: {session.input_size} "
+                  f"(探测 {session.probe_seen} 帧, {len(session.probe_box_sizes)} 个检测框)")
+
+    def _choose_input_size(self, session: DetectionSession) -> int:
+        """
+        根据源分辨率和探测到的排球像素尺寸选择推理尺寸：
+        - 源视频长边小于候选尺寸时，放大推理没有收益
+        - 排球在推理尺度下不小于 min_ball_pixels 的前提下，选最小的尺寸
+        """
+        candidates = sorted(s for s in self.input_sizes if s <= self.max_input_size)
+        if not candidates:
+            return self.max_input_size
+
+        source = session.probe_source_size
+        ceiling = candidates[-1]
+        if source:
+            fitting = [s for s in candidates if s >= source]
+            if fitting:
+                ceiling = fitting[0]
+
+        # 探测期内没有检测到球：保持上限，避免漏检小球
+        if not session.probe_box_sizes or not source:
+            return ceiling
+
+        # 取偏小的分位数，照顾远处的小球
+        ball_pixels = float(np.percentile(session.probe_box_sizes, 25))
+        for size in candidates:
+            if size > ceiling:
+                break
+            if ball_pixels * size / source >= self.min_ball_pixels:
+                return size
+        return ceiling
+
+    def get_input_size_diagnostics(self, session: DetectionSession) -> dict:
+        """
+        返回该视频的推理尺寸选择情况（用于诊断输出）
+        """
+        ball_pixels = None
+        if session.probe_box_sizes:
+            ball_pixels = round(float(np.percentile(session.probe_box_sizes, 25)), 1)
+        return {
+            'input_size': int(session.input_size),
+            'max_input_size': int(self.max_input_size),
+            'adaptive': bool(self.adaptive_input_size),
+            'probe_frames': int(session.probe_seen),
+            'probe_detections': len(session.probe_box_sizes),
+            'ball_pixels': ball_pixels,
+            'source_long_side': int(session.probe_source_size),
+        }
+
+    def get_diagnostics(self, session: Optional[DetectionSession] = None) -> dict:
+        """
+        汇总检测器的运行参数（该视频的推理尺寸、精度模式等），随分析结果一起返回
+        """
+        if session is None:
+            session = self.new_session()
+        diagnostics = self.get_input_size_diagnostics(session)
+        quantized = bool(self.quantization_report and self.quantization_report.get('quantized'))
+        if quantized:
+            diagnostics['precision'] = 'int8'
+        else:
+            diagnostics['precision'] = 'fp16' if self.accelerated else 'fp32'
+        diagnostics['accelerated'] = bool(self.accelerated)
+        key = self._batch_key(session.input_size)
+        if key is not None:
+            diagnostics['batch'] = self.batch_tuner.describe(key)
+        else:
+            diagnostics['batch'] = {'batch_size': self._fallback_batch, 'source': 'default'}
+        if self.quantization_report is not None:
+            diagnostics['quantization'] = dict(self.quantization_report)
+        diagnostics['high_accuracy'] = bool(session.high_accuracy)
+        if session.high_accuracy:
+            diagnostics['refinement'] = self._refiner.get_stats(session.refinement)
+        return diagnostics
+
+    def warmup(
+        self,
+        input_sizes: Optional[Sequence[int]] = None,
+        frame_shape: Sequence[int] = (720, 1280, 3),
+        tune_batch: bool = True,
+        on_step=None,
+    ) -> dict:
+        """
+        启动预热：用空白帧在每个推理尺寸上跑一次推理（CUDA / cuDNN 内核选择、内存分配），
+        可选地提前完成 batch 大小调优，第一个真实请求不再承担这些开销
+
+        Args:
+            input_sizes: 预热的推理尺寸，默认为全部候选尺寸（不超过 max_input_size）
+            frame_shape: 空白帧尺寸 (H, W, 3)
+            tune_batch: 是否同时调优各尺寸的 batch 大小（已有调优结果时直接复用）
+            on_step: 每个尺寸完成后调用 on_step()（例如 gunicorn worker 心跳）
+
+        Returns:
+            dict: {推理尺寸: 耗时（秒）}
+        """
+        # Roboflow 是远程推理，本地没有需要预热的内容
+        if self._detector is None or self.backend != "yolov7":
+            return {}
+        sizes = sorted({int(s) for s in (input_sizes or self.input_sizes) if int(s) <= self.max_input_size})
+        frame = np.zeros(tuple(frame_shape), dtype=np.uint8)
+
+        timings = {}
+        for size in sizes:
+            t0 = time.perf_counter()
+            # 直接调用底层预测：不收集量化校准帧、不参与推理尺寸探测
+            self._detector.predict_batch([frame], size=size)
+            if tune_batch:
+                self.get_batch_size(size, tune=True)
+            timings[size] = time.perf_counter() - t0
+            if on_step is not None:
+                on_step()
+        return timings
+
     # def detect_batch(
     #     self,
     #     frames: Sequence[np.ndarray],
@@ -265,13 +720,20 @@ class VolleyballDetector:
     def detect_batch(
         self,
         frames: Sequence[np.ndarray],
-        max_yolo_batch: int = 64,   # ✅ YOLO 实际 batch 大小
+        max_yolo_batch: Optional[int] = None,   # ✅ YOLO 实际 batch 大小，None 时使用 get_batch_size()
+        cancel_token=None,
+        session: Optional[DetectionSession] = None,
     ) -> List[List[VolleyballDetection]]:
         """
         批量检测：对一组帧做并行预测（内部再切小 batch）
 
         Args:
             frames: [B, H, W, 3] 的 np.ndarray 列表
+            max_yolo_batch: 单次送入 YOLO 的帧数；None 时使用 get_batch_size()，
+                遇到内存不足会自动减半重试
+            cancel_token: CancelToken，每个小 batch 之前检查，已取消时抛出 OperationCancelled
+            session: 所属视频的检测状态（new_session()），同一视频的各块传入同一个对象；
+                为 None 时把 frames 当作一个独立的视频
 
         Returns:
             detections_per_frame: 长度为 B 的列表，
@@ -279,80 +741,104 @@ class VolleyballDetector:
         """
         if not frames or self._detector is None:
             return [[] for _ in frames]
+        if session is None:
+            session = self.new_session()
 
         # 先保存每一帧的尺寸
         sizes = [f.shape[:2] for f in frames]  # [(h, w), ...]
         all_detections: List[List[VolleyballDetection]] = []
+        self._collect_calibration_frames(frames)
 
         # ⚠️ 保证输出顺序和输入一一对应
         num_frames = len(frames)
 
-        import math
         import torch as _torch
 
-        for start in range(0, num_frames, max_yolo_batch):
-            print("[TEST][DETECT_BATCH]: processing batch: ", max_yolo_batch)
-            end = min(start + max_yolo_batch, num_frames)
+        start = 0
+        # 加速模式下，探测阶段结束后剩余帧改走流水线推理
+        while start < num_frames and not (self.accelerated and session.input_size_locked):
+            check_cancelled(cancel_token)
+            # 探测阶段只送入剩余的探测帧，确定尺寸后其余帧用新尺寸推理
+            if not session.input_size_locked:
+                batch_size = min(max_yolo_batch or DEFAULT_MAX_YOLO_BATCH,
+                                 max(1, self.probe_frames - session.probe_seen))
+            else:
+                batch_size = max_yolo_batch or self.get_batch_size(session.input_size)
+
+            end = min(start + batch_size, num_frames)
             sub_frames = frames[start:end]
             sub_sizes = sizes[start:end]
 
             # 底层 batch 预测
-            preds = self._detector.predict_batch(sub_frames)
+            try:
+                preds = self._detector.predict_batch(sub_frames, size=session.input_size,
+                                                     conf=self._nms_conf(session))
+            except Exception as exc:
+                if not is_out_of_memory(exc) or end - start <= 1:
+                    raise
+                # 内存不足：batch 减半后重试当前位置
+                max_yolo_batch = self._back_off_batch_size(end - start, session.input_size)
+                continue
 
             # 对这个小 batch 里的每一帧做后处理
-            for j, ((h, w), frame) in enumerate(zip(sub_sizes, sub_frames)):
-                if self.backend == "yolov7":
-                    # ⚠️ 注意：这里的 idx 现在是小 batch 内部的 j
-                    bbox = x_y_w_h(preds, self.backend, idx=j)
-                elif self.backend == "roboflow":
-                    bbox = x_y_w_h(preds[j], self.backend)
-                else:
-                    bbox = (0, 0, 0, 0)
-
-                if not bbox or bbox == (0, 0, 0, 0):
-                    all_detections.append([])
-                    continue
-
-                x0, y0, bw, bh = bbox
-
-                x_min = int(x0)
-                y_min = int(y0)
-                x_max = int(x0 + bw)
-                y_max = int(y0 + bh)
-
-                # 边界裁剪
-                x_min = max(0, x_min)
-                y_min = max(0, y_min)
-                x_max = min(w - 1, x_max)
-                y_max = min(h - 1, y_max)
-
-                if x_min >= x_max or y_min >= y_max:
-                    all_detections.append([])
-                    continue
-
-                # 归一化
-                nx_min = x_min / float(w)
-                ny_min = y_min / float(h)
-                nx_max = x_max / float(w)
-                ny_max = y_max / float(h)
-
-                label = self.target_labels[0]
-                score = 1.0  # TODO: 需要的话可以从 preds 里拿真实置信度
-
-                det = VolleyballDetection(
-                    label=label,
-                    score=score,
-                    bbox=(x_min, y_min, x_max, y_max),
-                    bbox_normalized=(nx_min, ny_min, nx_max, ny_max),
-                )
-                all_detections.append([det])
+            chunk_detections = self._detections_from_preds(preds, sub_frames, sub_sizes, session)
+
+            self._observe_probe(session, chunk_detections, sub_sizes)
+            all_detections.extend(chunk_detections)
 
             # ✅ 小 batch 结束后，主动释放下 GPU cache（可选，但对长视频挺有用）
-            if _torch.cuda.is_available():
+            # 加速模式保留缓存，避免下一个 batch 重新分配显存
+            if _torch.cuda.is_available() and not self.accelerated:
                 del preds
                 _torch.cuda.empty_cache()
 
+            start = end
+
+        if start < num_frames:
+            all_detections.extend(
+                self._detect_pipelined(frames[start:], sizes[start:],
+                                       max_yolo_batch or self.get_batch_size(session.input_size),
+                                       session, cancel_token)
+            )
+
         return all_detections
+
+    def _detect_pipelined(
+        self,
+        frames: Sequence[np.ndarray],
+        sizes: Sequence[Tuple[int, int]],
+        max_yolo_batch: int,
+        session: DetectionSession,
+        cancel_token=None,
+    ) -> List[List[VolleyballDetection]]:
+        """
+        GPU 加速模式：当前 batch 在 GPU 上推理时，下一个 batch 的预处理和 H2D 拷贝同时进行
+        """
+        bounds = [
+            (start, min(start + max_yolo_batch, len(frames)))
+            for start in range(0, len(frames), max_yolo_batch)
+        ]
+        batches = (frames[start:end] for start, end in bounds)
+
+        detections: List[List[VolleyballDetection]] = []
+        preds_iter = self._detector.predict_batches(batches, size=session.input_size,
+                                                    conf=self._nms_conf(session))
+        try:
+            for (start, end), preds in zip(bounds, preds_iter):
+                check_cancelled(cancel_token)
+                detections.extend(
+                    self._detections_from_preds(preds, frames[start:end], sizes[start:end], session)
+                )
+        except Exception as exc:
+            if not is_out_of_memory(exc) or max_yolo_batch <= 1:
+                raise
+            # 内存不足：剩余帧用减半后的 batch 重新走流水线
+            smaller = self._back_off_batch_size(max_yolo_batch, session.input_size)
+            done = len(detections)
+            detections.extend(
+                self._detect_pipelined(frames[done:], sizes[done:], smaller, session, cancel_token)
+            )
+        return detections
             
     def annotate(
         self,
@@ -362,6 +848,7 @@ class VolleyballDetector:
         color=(0, 165, 255),
         trace: bool = True,
         trace_len: int = 8,
+        session: Optional[DetectionSession] = None,
     ) -> np.ndarray:
         """
         在图像上绘制检测结果（支持圆形或矩形标记 + 轨迹绘制）
@@ -373,6 +860,7 @@ class VolleyballDetector:
             color: 绘制颜色 (B, G, R)
             trace: 是否绘制轨迹
             trace_len: 轨迹长度（历史帧的数量）
+            session: 所属视频的检测状态，轨迹历史保存在其中；为 None 时使用实例级队列
         """
 
         if frame is None:
@@ -382,11 +870,16 @@ class VolleyballDetector:
         img = frame.copy()
 
         # ----------------------
-        # 初始化轨迹队列（只初始化一次）
+        # 初始化轨迹队列（每个视频只初始化一次）
         # ----------------------
-        if not hasattr(self, "_queue"):
-            from collections import deque
-            self._queue = deque([None] * trace_len, maxlen=trace_len)
+        if session is None:
+            if not hasattr(self, "_queue"):
+                self._queue = deque([None] * trace_len, maxlen=trace_len)
+            queue = self._queue
+        else:
+            if session.trace is None:
+                session.trace = deque([None] * trace_len, maxlen=trace_len)
+            queue = session.trace
 
         # ----------------------
         # 1. 读取当前检测框 (若有)
@@ -400,14 +893,14 @@ class VolleyballDetector:
                 int(x_max * w),
                 int(y_max * h),
             )
-            self._queue.appendleft(cur_box)
+            queue.appendleft(cur_box)
         else:
-            self._queue.appendleft(None)
+            queue.appendleft(None)
 
         # ----------------------
         # 2. 绘制轨迹（历史帧）
         # ----------------------
-        for i, box in enumerate(self._queue):
+        for i, box in enumerate(queue):
             if box is None:
                 continue
 
@@ -434,10 +927,12 @@ class VolleyballDetector:
         return img
 
 
-    def detect_and_annotate(self, frame: np.ndarray) -> Tuple[List[VolleyballDetection], np.ndarray]:
+    def detect_and_annotate(
+        self, frame: np.ndarray, session: Optional[DetectionSession] = None
+    ) -> Tuple[List[VolleyballDetection], np.ndarray]:
         """
         便捷方法：同时返回检测结果和绘制后的图像
         """
-        detections = self.detect(frame)
-        annotated = self.annotate(frame, detections) if detections else frame
+        detections = self.detect(frame, session)
+        annotated = self.annotate(frame, detections, session=session) if detections else frame
         return detections, annotated
@@ -1,5 +1,29 @@
-"""业务逻辑服务层"""
-from .volleyball_service import VolleyballService
+"""
+业务逻辑服务层
 
-__all__ = ['VolleyballService']
+导出的类按需导入：job_queue / admission 不依赖模型，单独使用时不加载 VolleyballService
+"""
+import importlib
 
+_EXPORTS = {
+    'VolleyballService': '.volleyball_service',
+    'ModelsBusy': '.volleyball_service',
+    'JobQueue': '.job_queue',
+    'MemoryJobStore': '.job_queue',
+    'SQLiteJobStore': '.job_queue',
+    'QueueFullError': '.job_queue',
+    'AdmissionController': '.admission',
+    'MemoryAdmissionStore': '.admission',
+    'SQLiteAdmissionStore': '.admission',
+    'AdmissionRejected': '.admission',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
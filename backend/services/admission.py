@@ -0,0 +1,231 @@
+"""
+准入控制 - 限制同时处理的重型请求的总成本，过载时排队等待或以 429 拒绝
+
+- 成本按 帧数 × 分辨率（百万像素）× 模式系数 估算（estimate_cost），
+  单位为“百万像素·帧”，上传后读取视频元数据即可算出，不必解码
+- 在处理中的总成本加上新请求的成本超过 capacity 时，请求最多等待 max_wait 秒，
+  仍然放不下就抛出 AdmissionRejected，接口返回 429 + Retry-After
+- 系统空闲时总是放行（单个成本超过 capacity 的请求不会永远饿死）
+- 轻量接口（战术问答、单帧分析等）不经过准入控制
+- MemoryAdmissionStore：进程内计数，单进程部署使用
+- SQLiteAdmissionStore：多个 gunicorn worker 共享同一份在途成本，进程退出后遗留的票据自动清理
+"""
+import math
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict
+
+from backend.core.cancellation import check_cancelled
+from backend.core.process_memory import worker_exited
+
+
+class AdmissionRejected(RuntimeError):
+    """在途成本已满，等待超时"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = int(retry_after)
+
+
+def video_cost_basis(video_path):
+    """
+    读取视频元数据（不解码）
+
+    Returns:
+        (帧数, 宽, 高)；无法读取时返回 (0, 0, 0)
+    """
+    import cv2
+    cap = cv2.VideoCapture(str(video_path))
+    try:
+        if not cap.isOpened():
+            return 0, 0, 0
+        return (max(0, int(cap.get(cv2.CAP_PROP_FRAME_COUNT))),
+                int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    finally:
+        cap.release()
+
+
+def estimate_cost(frames, width, height, factor=1.0, min_cost=1.0):
+    """帧数 × 百万像素 × 模式系数（元数据缺失时取 min_cost）"""
+    return max(float(min_cost), frames * width * height / 1e6 * float(factor))
+
+
+class MemoryAdmissionStore:
+    """进程内在途成本"""
+
+    def __init__(self):
+        self._tickets: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def try_acquire(self, ticket_id, cost, capacity, worker):
+        with self._lock:
+            in_flight = sum(self._tickets.values())
+            if self._tickets and in_flight + cost > capacity:
+                return False, in_flight
+            self._tickets[ticket_id] = cost
+            return True, in_flight + cost
+
+    def release(self, ticket_id):
+        with self._lock:
+            self._tickets.pop(ticket_id, None)
+
+    def usage(self):
+        with self._lock:
+            return len(self._tickets), sum(self._tickets.values())
+
+
+class SQLiteAdmissionStore:
+    """SQLite 在途成本（多进程共享）"""
+
+    def __init__(self, db_path, max_ticket_seconds=3600):
+        """
+        Args:
+            max_ticket_seconds: 票据最长保留时间，超过后视为遗留票据清理（兜底）
+        """
+        self.db_path = str(db_path)
+        self.max_ticket_seconds = float(max_ticket_seconds)
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self._local = threading.local()
+        self._connect().execute('''
+            CREATE TABLE IF NOT EXISTS admission (
+                id TEXT PRIMARY KEY,
+                cost REAL NOT NULL,
+                worker TEXT,
+                created_at REAL
+            )
+        ''')
+
+    def _connect(self):
+        # 每个线程一个连接；fork 出的子进程不能沿用父进程的连接
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _purge_stale(self, conn):
+        """删除已退出进程遗留的票据（worker 被杀时来不及释放）"""
+        conn.execute('DELETE FROM admission WHERE created_at < ?',
+                     (time.time() - self.max_ticket_seconds,))
+        for ticket_id, worker in conn.execute('SELECT id, worker FROM admission').fetchall():
+            if worker_exited(worker):
+                conn.execute('DELETE FROM admission WHERE id = ?', (ticket_id,))
+
+    def try_acquire(self, ticket_id, cost, capacity, worker):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._purge_stale(conn)
+            count, in_flight = conn.execute('SELECT COUNT(*), COALESCE(SUM(cost), 0) FROM admission').fetchone()
+            if count and in_flight + cost > capacity:
+                conn.execute('COMMIT')
+                return False, in_flight
+            conn.execute('INSERT INTO admission (id, cost, worker, created_at) VALUES (?, ?, ?, ?)',
+                         (ticket_id, cost, worker, time.time()))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return True, in_flight + cost
+
+    def release(self, ticket_id):
+        self._connect().execute('DELETE FROM admission WHERE id = ?', (ticket_id,))
+
+    def usage(self):
+        count, in_flight = self._connect().execute(
+            'SELECT COUNT(*), COALESCE(SUM(cost), 0) FROM admission'
+        ).fetchone()
+        return count, in_flight
+
+
+class AdmissionController:
+    """按成本限制在途的重型请求"""
+
+    def __init__(self, store, capacity, max_wait=10.0, poll_interval=0.2,
+                 min_retry_after=1, max_retry_after=120):
+        """
+        Args:
+            store: MemoryAdmissionStore / SQLiteAdmissionStore
+            capacity: 在途总成本上限（百万像素·帧）
+            max_wait: 同步请求放不下时的最长等待时间（秒），0 表示立即拒绝
+            poll_interval: 等待期间重试的间隔（秒）
+            min_retry_after / max_retry_after: Retry-After 的范围（秒）
+        """
+        self.store = store
+        self.capacity = float(capacity)
+        self.max_wait = float(max_wait)
+        self.poll_interval = float(poll_interval)
+        self.min_retry_after = int(min_retry_after)
+        self.max_retry_after = int(max_retry_after)
+        # 本进程观测到的处理速度（成本 / 秒，指数滑动平均），用于估算 Retry-After
+        self._throughput = None
+        self._lock = threading.Lock()
+
+    def acquire(self, cost, wait=None, cancel_token=None) -> str:
+        """
+        申请准入
+
+        Args:
+            cost: 估算成本
+            wait: 最长等待时间（秒），None 时使用 max_wait；传入 cancel_token 时还受其截止时间限制
+            cancel_token: 等待期间检查，已取消 / 超时时抛出 OperationCancelled
+
+        Returns:
+            str: 票据 id，处理结束后 release()
+
+        Raises:
+            AdmissionRejected: 等待超时仍然放不下
+        """
+        ticket_id = uuid.uuid4().hex
+        worker = f"{socket.gethostname()}:{os.getpid()}"
+        deadline = time.monotonic() + (self.max_wait if wait is None else float(wait))
+        while True:
+            check_cancelled(cancel_token)
+            admitted, in_flight = self.store.try_acquire(ticket_id, float(cost), self.capacity, worker)
+            if admitted:
+                return ticket_id
+            if time.monotonic() + self.poll_interval > deadline:
+                raise AdmissionRejected('服务器繁忙，请稍后重试',
+                                        self.retry_after(in_flight + float(cost) - self.capacity))
+            time.sleep(self.poll_interval)
+
+    def release(self, ticket_id, cost=None, seconds=None):
+        """释放票据；传入成本和耗时时更新处理速度估计"""
+        self.store.release(ticket_id)
+        if cost and seconds and seconds > 0:
+            with self._lock:
+                rate = cost / seconds
+                self._throughput = rate if self._throughput is None else 0.8 * self._throughput + 0.2 * rate
+
+    @contextmanager
+    def admit(self, cost, wait=None, cancel_token=None):
+        """with admission.admit(cost): ... 处理结束（含异常）后自动释放"""
+        ticket_id = self.acquire(cost, wait=wait, cancel_token=cancel_token)
+        t0 = time.monotonic()
+        try:
+            yield ticket_id
+        finally:
+            self.release(ticket_id, cost, time.monotonic() - t0)
+
+    def retry_after(self, excess_cost) -> int:
+        """按超出的成本和观测到的处理速度估算客户端应等待的秒数"""
+        if not self._throughput:
+            return self.min_retry_after
+        seconds = math.ceil(max(0.0, excess_cost) / self._throughput)
+        return max(self.min_retry_after, min(self.max_retry_after, seconds))
+
+    def status(self) -> dict:
+        count, in_flight = self.store.usage()
+        return {
+            'capacity': self.capacity,
+            'in_flight': count,
+            'in_flight_cost': round(in_flight, 1),
+            'throughput': round(self._throughput, 1) if self._throughput else None,
+        }
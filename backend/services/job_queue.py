@@ -0,0 +1,445 @@
+"""
+任务队列 - 视频分析 / 可视化在后台执行，请求只负责提交和查询
+
+- 提交后立即返回 job_id，有界的后台线程池按提交顺序领取任务执行
+- 进度（已处理帧数 / 总帧数）在执行过程中按间隔写回，结果和错误持久化
+- MemoryJobStore：进程内存储，单进程部署使用
+- SQLiteJobStore：SQLite 文件存储，多个 gunicorn worker 共享同一个队列，
+  任何一个 worker 都能查询到任务状态，领取任务时用事务保证只被执行一次
+- 取消：排队中的任务直接取消；执行中的任务标记为 cancelling，执行进程写回进度时
+  发现标记后触发 CancelToken，流水线在下一个批次之前停下（ffmpeg 进程随之终止）
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Optional
+
+from backend.core.cancellation import CancelToken, OperationCancelled
+from backend.core.process_memory import worker_exited
+
+# 任务状态
+QUEUED = 'queued'
+RUNNING = 'running'
+CANCELLING = 'cancelling'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+def _json_default(value):
+    """numpy 标量等对象转成内置类型"""
+    if hasattr(value, 'item'):
+        return value.item()
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError(f"无法序列化 {type(value).__name__}")
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, default=_json_default)
+
+
+class QueueFullError(RuntimeError):
+    """排队任务数达到上限"""
+
+
+def _new_job(kind, params, job_id=None):
+    now = time.time()
+    return {
+        'id': job_id or uuid.uuid4().hex,
+        'kind': kind,
+        'status': QUEUED,
+        'params': params,
+        'progress': {'done': 0, 'total': 0},
+        'result': None,
+        'error': None,
+        'worker': None,
+        'created_at': now,
+        'started_at': None,
+        'finished_at': None,
+    }
+
+
+class MemoryJobStore:
+    """进程内任务存储"""
+
+    def __init__(self):
+        self._jobs: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def add(self, job):
+        with self._lock:
+            self._jobs[job['id']] = dict(job)
+
+    def get(self, job_id) -> Optional[dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+
+    def update_if(self, job_id, expected_status, **fields) -> bool:
+        """只在任务当前状态为 expected_status 时更新，返回是否更新"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job['status'] != expected_status:
+                return False
+            job.update(fields)
+            return True
+
+    def count(self, status, created_before=None) -> int:
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job['status'] == status
+                       and (created_before is None or job['created_at'] < created_before))
+
+    def claim_next(self, worker) -> Optional[dict]:
+        """领取最早提交的排队任务"""
+        with self._lock:
+            queued = [job for job in self._jobs.values() if job['status'] == QUEUED]
+            if not queued:
+                return None
+            job = min(queued, key=lambda j: j['created_at'])
+            job.update(status=RUNNING, worker=worker, started_at=time.time())
+            return dict(job)
+
+    def recover(self):
+        """进程内存储随进程消失，无需恢复"""
+        return 0
+
+    def purge(self, older_than):
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job['status'] in FINISHED_STATES and (job['finished_at'] or 0) < older_than]
+            for job_id in expired:
+                del self._jobs[job_id]
+            return expired
+
+
+class SQLiteJobStore:
+    """SQLite 任务存储（多进程共享）"""
+
+    JSON_FIELDS = ('params', 'progress', 'result')
+
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    params TEXT,
+                    progress TEXT,
+                    result TEXT,
+                    error TEXT,
+                    worker TEXT,
+                    created_at REAL,
+                    started_at REAL,
+                    finished_at REAL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)')
+
+    def _connect(self):
+        # 每个线程一个连接；fork 出的子进程（gunicorn preload）不能沿用父进程的连接
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _row_to_job(self, row):
+        if row is None:
+            return None
+        job = dict(row)
+        for field in self.JSON_FIELDS:
+            job[field] = json.loads(job[field]) if job[field] else None
+        return job
+
+    def add(self, job):
+        values = {k: _dumps(v) if k in self.JSON_FIELDS else v for k, v in job.items()}
+        columns = ', '.join(values)
+        placeholders = ', '.join('?' for _ in values)
+        self._connect().execute(f'INSERT INTO jobs ({columns}) VALUES ({placeholders})', list(values.values()))
+
+    def get(self, job_id):
+        row = self._connect().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return self._row_to_job(row)
+
+    def update(self, job_id, **fields):
+        if not fields:
+            return
+        values = {k: _dumps(v) if k in self.JSON_FIELDS else v for k, v in fields.items()}
+        assignments = ', '.join(f'{k} = ?' for k in values)
+        self._connect().execute(f'UPDATE jobs SET {assignments} WHERE id = ?', list(values.values()) + [job_id])
+
+    def update_if(self, job_id, expected_status, **fields):
+        values = {k: _dumps(v) if k in self.JSON_FIELDS else v for k, v in fields.items()}
+        assignments = ', '.join(f'{k} = ?' for k in values)
+        cursor = self._connect().execute(
+            f'UPDATE jobs SET {assignments} WHERE id = ? AND status = ?',
+            list(values.values()) + [job_id, expected_status]
+        )
+        return cursor.rowcount > 0
+
+    def count(self, status, created_before=None):
+        if created_before is None:
+            return self._connect().execute('SELECT COUNT(*) FROM jobs WHERE status = ?', (status,)).fetchone()[0]
+        return self._connect().execute(
+            'SELECT COUNT(*) FROM jobs WHERE status = ? AND created_at < ?', (status, created_before)
+        ).fetchone()[0]
+
+    def claim_next(self, worker):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1', (QUEUED,)
+            ).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+            started_at = time.time()
+            conn.execute('UPDATE jobs SET status = ?, worker = ?, started_at = ? WHERE id = ?',
+                         (RUNNING, worker, started_at, row['id']))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        job = self._row_to_job(row)
+        job.update(status=RUNNING, worker=worker, started_at=started_at)
+        return job
+
+    def recover(self):
+        """本机上执行进程已经退出的 running 任务标记为失败（服务重启或 worker 被杀）"""
+        recovered = 0
+        rows = self._connect().execute(
+            'SELECT id, status, worker FROM jobs WHERE status IN (?, ?)', (RUNNING, CANCELLING)
+        ).fetchall()
+        for row in rows:
+            if not worker_exited(row['worker']):
+                continue
+            if row['status'] == CANCELLING:
+                self.update(row['id'], status=CANCELLED, error='任务已取消', finished_at=time.time())
+            else:
+                self.update(row['id'], status=FAILED, error='执行任务的进程已退出，请重新提交',
+                            finished_at=time.time())
+            recovered += 1
+        return recovered
+
+    def purge(self, older_than):
+        conn = self._connect()
+        rows = conn.execute(
+            'SELECT id FROM jobs WHERE status IN (?, ?, ?) AND finished_at < ?', FINISHED_STATES + (older_than,)
+        ).fetchall()
+        expired = [row['id'] for row in rows]
+        conn.executemany('DELETE FROM jobs WHERE id = ?', [(job_id,) for job_id in expired])
+        return expired
+
+
+class JobQueue:
+    """有界线程池 + 任务存储"""
+
+    def __init__(self, store, handlers: Dict[str, Callable], workers=1, max_pending=20,
+                 progress_interval=0.5, poll_interval=1.0, retention_seconds=24 * 3600,
+                 on_purge: Optional[Callable[[str], None]] = None, job_timeout=None):
+        """
+        Args:
+            store: MemoryJobStore / SQLiteJobStore
+            handlers: {任务类型: handler(params, progress_callback, cancel_token) -> 可 JSON 序列化的结果}，
+                progress_callback(已处理, 总数, 统计=None)，统计（dict）随进度一起保存；
+                cancel_token 为 CancelToken，任务被取消或超时后触发
+            workers: 本进程执行任务的线程数（模型由服务对象持有，默认 1 个线程串行使用）
+            max_pending: 排队任务数上限，超过时 submit 抛出 QueueFullError
+            progress_interval: 进度写回存储的最小间隔（秒）
+            poll_interval: 空闲时检查新任务的间隔（秒），其他进程提交的任务靠轮询领取
+            retention_seconds: 已结束任务的保留时间
+            on_purge: 清理过期任务时的回调（删除任务关联的文件）
+            job_timeout: 单个任务的最长执行时间（秒），或 {任务类型: 秒}；None 时不限制
+        """
+        self.store = store
+        self.handlers = dict(handlers)
+        self.workers = max(1, int(workers))
+        self.max_pending = int(max_pending)
+        self.progress_interval = float(progress_interval)
+        self.poll_interval = float(poll_interval)
+        self.retention_seconds = float(retention_seconds)
+        self.on_purge = on_purge
+        self.job_timeout = job_timeout
+        # 本进程正在执行的任务的取消令牌
+        self._tokens: Dict[str, CancelToken] = {}
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._wakeup = threading.Event()
+        self._last_purge = 0.0
+        self._threads = []
+        self._started = False
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """启动工作线程（每个进程只启动一次）"""
+        with self._start_lock:
+            if self._started:
+                return self
+            # 在实际执行任务的进程中确定标识（preload 模式下队列对象在 master 中创建）
+            self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+            recovered = self.store.recover()
+            if recovered:
+                print(f"⚠️ {recovered} 个中断的任务已标记为失败")
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker_loop, name=f'job-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._started = True
+        return self
+
+    def submit(self, kind, params, job_id=None) -> str:
+        """提交任务，返回 job_id（可由调用方预先生成，用于关联任务文件）"""
+        if kind not in self.handlers:
+            raise ValueError(f"未知的任务类型: {kind}")
+        if self.store.count(QUEUED) >= self.max_pending:
+            raise QueueFullError("排队任务过多，请稍后再试")
+        job = _new_job(kind, params, job_id)
+        self.store.add(job)
+        self.start()
+        self._wakeup.set()
+        return job['id']
+
+    def status(self) -> dict:
+        """队列概况；会访问任务存储，存储不可用时抛出异常（就绪检查依赖这一点）"""
+        return {
+            'queued': self.store.count(QUEUED),
+            'running': self.store.count(RUNNING),
+            'max_pending': self.max_pending,
+            'workers': self.workers,
+            'started': self._started,
+        }
+
+    def get(self, job_id) -> Optional[dict]:
+        """任务状态（不含提交参数）"""
+        job = self.store.get(job_id)
+        if job is None:
+            return None
+        job.pop('params', None)
+        progress = job.get('progress') or {'done': 0, 'total': 0}
+        if job['status'] == SUCCEEDED:
+            progress['percent'] = 100.0
+        else:
+            progress['percent'] = round(100.0 * progress['done'] / progress['total'], 1) \
+                if progress.get('total') else 0.0
+        job['progress'] = progress
+        if job['status'] == QUEUED:
+            # 排在第几位（1 表示下一个执行）
+            job['queue_position'] = self.store.count(QUEUED, created_before=job['created_at']) + 1
+        return job
+
+    def cancel(self, job_id) -> Optional[str]:
+        """
+        取消任务
+
+        Returns:
+            str: 取消后的状态（cancelled / cancelling，已结束的任务返回原状态）；任务不存在时返回 None
+        """
+        if self.store.update_if(job_id, QUEUED, status=CANCELLED, error='任务已取消',
+                                finished_at=time.time()):
+            return CANCELLED
+        if self.store.update_if(job_id, RUNNING, status=CANCELLING):
+            # 本进程执行的任务立即触发；其他进程在下次写回进度时发现标记
+            token = self._tokens.get(job_id)
+            if token is not None:
+                token.cancel('任务已取消')
+            return CANCELLING
+        job = self.store.get(job_id)
+        return job['status'] if job else None
+
+    def _worker_loop(self):
+        while True:
+            job = self.store.claim_next(self.worker_id)
+            if job is None:
+                self._purge_expired()
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            self._run(job)
+
+    def _run(self, job):
+        job_id = job['id']
+        last_report = [0.0]
+        has_score = [False]
+        timeout = self.job_timeout.get(job['kind']) if isinstance(self.job_timeout, dict) else self.job_timeout
+        token = CancelToken(timeout)
+        self._tokens[job_id] = token
+
+        def progress_callback(done, total, stats=None):
+            now = time.time()
+            # 第一次得到得分估计时立即写回，不等进度间隔
+            first_score = bool(stats) and stats.get('best_score') is not None and not has_score[0]
+            if first_score or now - last_report[0] >= self.progress_interval or (total and done >= total):
+                last_report[0] = now
+                has_score[0] = has_score[0] or first_score
+                progress = {'done': int(done), 'total': int(total or 0)}
+                if stats:
+                    progress['stats'] = stats
+                self.store.update(job_id, progress=progress)
+                # 其他进程发起的取消
+                current = self.store.get(job_id)
+                if current is not None and current['status'] == CANCELLING:
+                    token.cancel('任务已取消')
+
+        print(f"▶️ 开始任务 {job_id} ({job['kind']})")
+        try:
+            result = self.handlers[job['kind']](job['params'], progress_callback, token)
+        except OperationCancelled:
+            result = None
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            self.store.update(job_id, status=FAILED, error=str(e), finished_at=time.time())
+            print(f"❌ 任务 {job_id} 失败: {e}")
+            return
+        finally:
+            self._tokens.pop(job_id, None)
+
+        if token.cancelled:
+            self.store.update(job_id, status=CANCELLED, error='任务已取消', finished_at=time.time())
+            print(f"⏹️ 任务 {job_id} 已取消")
+            return
+        if token.expired:
+            self.store.update(job_id, status=FAILED, error='处理超时', finished_at=time.time())
+            print(f"⏱️ 任务 {job_id} 超时")
+            return
+
+        success = not (isinstance(result, dict) and result.get('success') is False)
+        self.store.update(
+            job_id,
+            status=SUCCEEDED if success else FAILED,
+            result=result,
+            error=None if success else result.get('error'),
+            finished_at=time.time(),
+        )
+        print(f"✅ 任务 {job_id} 结束: {'成功' if success else '失败'}")
+
+    def _purge_expired(self):
+        # 空闲时最多每分钟清理一次
+        now = time.time()
+        if now - self._last_purge < 60:
+            return
+        self._last_purge = now
+        for job_id in self.store.purge(now - self.retention_seconds):
+            if self.on_purge is not None:
+                try:
+                    self.on_purge(job_id)
+                except Exception as e:
+                    print(f"⚠️ 清理任务 {job_id} 的文件失败: {e}")
@@ -4,6 +4,9 @@
 """
 import os
 import sys
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
 
 # 添加项目根目录到路径
@@ -19,23 +22,46 @@ from backend.core import (
     TrajectoryVisualizer,
     VideoGenerator,
     VolleyballDetector,
-    VolleyballDetection
+    VolleyballDetection,
+    BatchSizeTuner,
+    LandmarkStore,
+    PreviewGenerator,
+    OperationCancelled,
+    DeadlineExceeded
 )
-from config.settings import TEMPLATES_DIR, DEFAULT_TEMPLATE
+from backend.core.cancellation import check_cancelled
+from config.settings import (
+    TEMPLATES_DIR, DEFAULT_TEMPLATE, DETECTOR_CONFIG, QUANTIZATION_CONFIG, BATCH_TUNING_CONFIG,
+    HIGH_ACCURACY_CONFIG, FFMPEG_CONFIG, ENCODE_PROFILES, DEFAULT_ENCODE_PROFILE,
+    VISUALIZATION_CONFIG, CHUNKED_ENCODING_CONFIG, LANDMARK_CACHE_CONFIG, HLS_CONFIG,
+    PREVIEW_CONFIG, WARMUP_CONFIG, VIDEO_CONFIG
+)
+from backend.core.video_writer import probe_ffmpeg, warmup_encoder
 import cv2
 
 
+class ModelsBusy(Exception):
+    """本进程的模型正被其他视频占用，且等待超过了调用方允许的时间"""
+
+
 class VolleyballService:
     """排球动作识别服务类"""
     
-    def __init__(self, scorer_version='v3', enable_ball_detection=True):
+    def __init__(self, scorer_version='v3', enable_ball_detection=True, preload=False):
         """初始化服务
         
         Args:
             scorer_version: 评分器版本 ('v1', 'v2', 'v3')，默认 'v3'
             enable_ball_detection: 是否启用球体检测（仅V3支持），默认True
+            preload: 在 gunicorn master 中（fork 之前）创建时为 True：只加载只读的模型权重，
+                以写时复制方式与各 worker 共享；MediaPipe 计算图等进程内状态由 init_process()
+                在每个 worker 中创建
         """
-        self.pose_detector = PoseDetector()
+        # 各模型加载耗时（秒），随就绪状态一起返回
+        self.load_timings = {}
+        # 本进程的模型（MediaPipe 计算图、检测器）同时只服务一个视频，见 exclusive_models()
+        self._model_lock = threading.RLock()
+        self.pose_detector = None
         self.video_processor = VideoProcessor()
         
         # 使用新的模板路径
@@ -56,20 +82,31 @@ class VolleyballService:
             self.scorer = VolleyballScorer(template_path=str(template_path))
             print("✅ 使用基础评分系统 V1")
         
-        self.sequence_analyzer = SequenceAnalyzer()
+        self.sequence_analyzer = SequenceAnalyzer(create_pose_detector=False)
         self.trajectory_visualizer = TrajectoryVisualizer()
-        self.video_generator = VideoGenerator()
         
         # 球体检测器（仅在V3且启用时初始化）
         self.enable_ball_detection = enable_ball_detection and scorer_version == 'v3'
         if self.enable_ball_detection:
             try:
+                t0 = time.perf_counter()
                 # VolleyballDetector 自动使用默认配置（YOLOv7）
                 # 不需要传递 backend 参数，它内部会设置
                 self.ball_detector = VolleyballDetector(
-                    score_threshold=0.45,  # 检测置信度阈值
-                    max_results=3          # 最多返回3个检测结果
+                    score_threshold=DETECTOR_CONFIG["score_threshold"],  # 检测置信度阈值
+                    max_results=DETECTOR_CONFIG["max_results"],          # 最多返回3个检测结果
+                    input_sizes=DETECTOR_CONFIG["input_sizes"],
+                    max_input_size=DETECTOR_CONFIG["max_input_size"],
+                    adaptive_input_size=DETECTOR_CONFIG["adaptive_input_size"],
+                    probe_frames=DETECTOR_CONFIG["probe_frames"],
+                    min_ball_pixels=DETECTOR_CONFIG["min_ball_pixels"],
+                    quantize=QUANTIZATION_CONFIG["enabled"],
+                    quantization_options=QUANTIZATION_CONFIG,
+                    accelerated=DETECTOR_CONFIG["accelerated"],
+                    batch_tuner=BatchSizeTuner(**BATCH_TUNING_CONFIG),
+                    high_accuracy_options=HIGH_ACCURACY_CONFIG
                 )
+                self.load_timings['ball_detector'] = time.perf_counter() - t0
                 print("✅ 球体检测已启用（YOLOv7）")
             except Exception as e:
                 print(f"⚠️ 球体检测初始化失败: {e}")
@@ -80,13 +117,127 @@ class VolleyballService:
                 self.ball_detector = None
         else:
             self.ball_detector = None
+
+        # 可视化视频复用同一个球体检测器（避免每次请求重新加载模型）
+        self.landmark_store = LandmarkStore(
+            LANDMARK_CACHE_CONFIG["directory"], max_entries=LANDMARK_CACHE_CONFIG["max_entries"]
+        ) if LANDMARK_CACHE_CONFIG["enabled"] else None
+        self.video_generator = VideoGenerator(
+            ball_detector=self.ball_detector, chunked_encoding=CHUNKED_ENCODING_CONFIG,
+            landmark_store=self.landmark_store,
+            hls_options={"segment_seconds": HLS_CONFIG["segment_seconds"]}
+        )
+        # 分析结束后用保留的标注帧生成动画预览和雪碧图
+        self.preview_generator = PreviewGenerator(
+            PREVIEW_CONFIG["directory"],
+            num_frames=PREVIEW_CONFIG["num_frames"],
+            width=PREVIEW_CONFIG["width"],
+            fps=PREVIEW_CONFIG["fps"],
+            quality=PREVIEW_CONFIG["quality"],
+            max_bytes=PREVIEW_CONFIG["max_bytes"],
+            sprite_columns=PREVIEW_CONFIG["sprite_columns"]
+        ) if PREVIEW_CONFIG["enabled"] else None
+        # 启动时探测一次 ffmpeg 编码能力，之后的请求直接使用选出的编码配置
+        t0 = time.perf_counter()
+        self.ffmpeg_capabilities = probe_ffmpeg(cache_file=FFMPEG_CONFIG["capability_cache"])
+        self.load_timings['ffmpeg'] = time.perf_counter() - t0
+
+        if not preload:
+            self.init_process()
+
+    def init_process(self):
+        """
+        创建进程内状态：MediaPipe 计算图（自带线程，不能跨 fork 使用）
+
+        preload 模式下在每个 worker fork 之后调用；重复调用时不会重建已有的计算图
+        """
+        if self.pose_detector is None:
+            t0 = time.perf_counter()
+            self.pose_detector = PoseDetector()
+            self.load_timings['pose'] = time.perf_counter() - t0
+        if self.sequence_analyzer.pose_detector is None:
+            t0 = time.perf_counter()
+            self.sequence_analyzer.pose_detector = PoseDetector()
+            self.load_timings['sequence_pose'] = time.perf_counter() - t0
+
+    @contextmanager
+    def exclusive_models(self, cancel_token=None, poll_interval=0.2, wait=None):
+        """
+        独占本进程的模型：MediaPipe 计算图带有跨帧的跟踪状态且不是线程安全的，
+        请求线程、任务队列的执行线程都经过这里，同一进程内同时只有一个视频在推理
+
+        Args:
+            cancel_token: 等待期间检查，已取消 / 超时时抛出 OperationCancelled
+            wait: 最多等待的秒数，None 时一直等待；超过后抛出 ModelsBusy
+                （同步接口用它快速失败，不在请求线程里排在后台任务后面）
+        """
+        deadline = None if wait is None else time.monotonic() + float(wait)
+        while True:
+            timeout = poll_interval
+            if deadline is not None:
+                timeout = min(timeout, max(0.0, deadline - time.monotonic()))
+            if self._model_lock.acquire(timeout=timeout):
+                break
+            check_cancelled(cancel_token)
+            if deadline is not None and time.monotonic() >= deadline:
+                raise ModelsBusy("模型正在处理其他视频")
+        try:
+            yield
+        finally:
+            self._model_lock.release()
+
+    def warmup(self, on_step=None):
+        """
+        启动预热：用空白帧跑一遍姿态检测、各推理尺寸的排球检测和一次 ffmpeg 测试编码，
+        MediaPipe 计算图初始化、torch 内核选择、batch 调优等开销不再落到第一个请求上
+
+        Args:
+            on_step: 每个组件预热完成后调用 on_step()（例如 gunicorn worker 心跳）
+
+        Returns:
+            dict: {组件: {load_seconds, warmup_seconds, ...}}
+        """
+        with self.exclusive_models():
+            return self._warmup(on_step)
+
+    def _warmup(self, on_step=None):
+        frame_shape = tuple(WARMUP_CONFIG["frame_shape"])
+        report = {}
+
+        def record(name, warmup_seconds, **extra):
+            report[name] = {
+                'load_seconds': round(self.load_timings.get(name, 0.0), 3),
+                'warmup_seconds': round(warmup_seconds, 3) if warmup_seconds is not None else None,
+                **extra
+            }
+            if on_step is not None:
+                on_step()
+
+        # 单帧分析和序列分析各自持有一个 MediaPipe 计算图
+        iterations = WARMUP_CONFIG["pose_iterations"]
+        record('pose', self.pose_detector.warmup(frame_shape, iterations))
+        record('sequence_pose', self.sequence_analyzer.pose_detector.warmup(frame_shape, iterations))
+
+        if self.ball_detector is not None:
+            sizes = self.ball_detector.warmup(
+                WARMUP_CONFIG["ball_input_sizes"], frame_shape, tune_batch=WARMUP_CONFIG["tune_batch"],
+                on_step=on_step
+            )
+            record('ball_detector', sum(sizes.values()),
+                   input_sizes={str(size): round(seconds, 3) for size, seconds in sizes.items()})
+
+        if WARMUP_CONFIG["ffmpeg"]:
+            record('ffmpeg', warmup_encoder(),
+                   encoder=(self.ffmpeg_capabilities.get('selected') or {}).get('encoder'))
+        return report
     
-    def analyze_single_frame(self, image):
+    def analyze_single_frame(self, image, high_accuracy=None):
         """
         分析单帧图像
         
         Args:
             image: 图像数据（numpy array）
+            high_accuracy: 是否启用球检测高精度模式，None 时使用配置默认值
             
         Returns:
             dict: 分析结果，包含：
@@ -95,6 +246,10 @@ class VolleyballService:
                 - pose_image: 标注后的图像
                 - ball_detection: 球体检测结果（如果启用）
         """
+        with self.exclusive_models():
+            return self._analyze_single_frame(image, high_accuracy)
+
+    def _analyze_single_frame(self, image, high_accuracy=None):
         try:
             # 检测姿态（返回tuple: landmarks, annotated_image）
             landmarks, pose_image = self.pose_detector.detect_pose(image)
@@ -113,7 +268,9 @@ class VolleyballService:
             if self.enable_ball_detection and self.ball_detector:
                 try:
                     # 使用 detect() 方法而不是 detect_ball()
-                    ball_detections = self.ball_detector.detect(image)
+                    ball_detections = self.ball_detector.detect(
+                        image, self.ball_detector.new_session(high_accuracy)
+                    )
                     if ball_detections and len(ball_detections) > 0:
                         # 使用置信度最高的检测结果
                         ball_detection = max(ball_detections, key=lambda x: x.score)
@@ -144,7 +301,8 @@ class VolleyballService:
                 "pose_image": image
             }
     
-    def analyze_video(self, video_path, mode="single"):
+    def analyze_video(self, video_path, mode="single", high_accuracy=None, progress_callback=None,
+                      cancel_token=None, model_wait=None):
         """
         分析视频
         
@@ -153,21 +311,53 @@ class VolleyballService:
             mode: 分析模式
                 - "single": 单帧分析（提取关键帧）
                 - "sequence": 序列分析（连续帧）
+            high_accuracy: 是否启用球检测高精度模式（TTA / 集成），None 时使用配置默认值
+            progress_callback: progress_callback(已处理帧数, 总帧数, 统计)，序列模式下逐帧调用；
+                统计含已解码 / 已分析帧数、当前最佳帧得分、球检出率（见 SequenceAnalyzer.analyze_sequence）
+            cancel_token: CancelToken，解码和每个检测批次之间检查；取消 / 超时时返回
+                {"success": False, "cancelled": True, "timeout": 是否超时}
+            model_wait: 等待模型的最长秒数，None 时一直等待；超过时返回
+                {"success": False, "busy": True}
                 
         Returns:
             dict: 分析结果
         """
         if mode == "single":
-            return self._analyze_video_single_frame(video_path)
+            try:
+                check_cancelled(cancel_token)
+                with self.exclusive_models(cancel_token, wait=model_wait):
+                    result = self._analyze_video_single_frame(video_path, high_accuracy)
+            except OperationCancelled as e:
+                return self._cancelled_result(e)
+            except ModelsBusy as e:
+                return self._busy_result(e)
+            if progress_callback is not None:
+                score = result.get('score') or {}
+                progress_callback(1, 1, {
+                    'frames_decoded': 1,
+                    'frames_processed': 1,
+                    'ball_detection_rate': None,
+                    'best_score': score.get('total_score'),
+                    'best_frame_idx': 0,
+                })
+            return result
         elif mode == "sequence":
-            return self._analyze_video_sequence(video_path)
+            try:
+                with self.exclusive_models(cancel_token, wait=model_wait):
+                    return self._analyze_video_sequence(video_path, high_accuracy=high_accuracy,
+                                                        progress_callback=progress_callback,
+                                                        cancel_token=cancel_token)
+            except OperationCancelled as e:
+                return self._cancelled_result(e)
+            except ModelsBusy as e:
+                return self._busy_result(e)
         else:
             return {
                 "success": False,
                 "error": f"未知的分析模式: {mode}"
             }
     
-    def _analyze_video_single_frame(self, video_path):
+    def _analyze_video_single_frame(self, video_path, high_accuracy=None):
         """单帧模式分析视频"""
         try:
             # 提取关键帧
@@ -177,7 +367,7 @@ class VolleyballService:
             )
             
             # 分析关键帧
-            result = self.analyze_single_frame(key_frame)
+            result = self.analyze_single_frame(key_frame, high_accuracy)
             result["video_info"] = self.video_processor.get_video_info(video_path)
             result["analysis_mode"] = "single_frame"
             
@@ -189,7 +379,27 @@ class VolleyballService:
                 "error": f"视频分析失败: {str(e)}"
             }
     
-    def _analyze_video_sequence_with_ball(self, video_path):
+    def _cancelled_result(self, error):
+        """取消 / 超时时的返回结果"""
+        print(f"⏹️ 处理已停止: {error.reason}")
+        return {
+            "success": False,
+            "cancelled": True,
+            "timeout": isinstance(error, DeadlineExceeded),
+            "error": error.reason
+        }
+    
+    def _busy_result(self, error):
+        """等待模型超时（同步接口）时的返回结果"""
+        print(f"⏳ 模型忙，拒绝同步请求: {error}")
+        return {
+            "success": False,
+            "busy": True,
+            "error": f"{error}，请稍后重试或提交后台任务（/api/jobs）"
+        }
+    
+    def _analyze_video_sequence_with_ball(self, video_path, high_accuracy=None, progress_callback=None,
+                                          cancel_token=None):
         """带球体检测的序列分析（V3专用）"""
         try:
             print("🎬 开始视频序列分析（含球体检测）...")
@@ -209,38 +419,73 @@ class VolleyballService:
             # 每隔几帧采样一次（避免处理过多帧）
             sample_interval = max(1, fps // 5)  # 每秒采样5帧
             
+            # 每个视频单独探测排球尺度（自适应推理尺寸）
+            ball_session = self.ball_detector.new_session(high_accuracy) if self.ball_detector else None
             frames_data = []
+            # 逐帧评分结果（分析过程中即可报告当前最佳得分，结束后序列评分直接复用）
+            frame_results = []
+            stats = {
+                'frames_decoded': 0,
+                'frames_processed': 0,
+                'ball_detection_rate': None,
+                'best_score': None,
+                'best_frame_idx': None,
+            }
+            has_ball_count = 0
             frame_idx = 0
+            # 等待球检测的采样帧：攒够检测器的 batch 再一起推理（批量、OOM 回退、GPU 流水线、批次间取消检查）；
+            # 每项同时持有原始帧和标注帧，缓冲长度另外限制在 max_pending_frames 以内
+            pending = []
+            max_pending = max(1, int(VIDEO_CONFIG.get('max_pending_frames', 16)))
+
+            def score_pending():
+                nonlocal has_ball_count
+                balls = self._detect_ball_batch(pending, ball_session, cancel_token)
+                for (idx, landmarks, annotated_image, _), ball_detection in zip(pending, balls):
+                    frames_data.append({
+                        'landmarks': landmarks,
+                        'ball': ball_detection,
+                        'frame': annotated_image,
+                        'frame_idx': idx
+                    })
+                    
+                    frame_result = None
+                    if landmarks is not None:
+                        frame_result = self.scorer.score_pose_with_ball(landmarks, ball_detection)
+                        has_ball_count += bool(frame_result.get('has_ball', False))
+                        if stats['best_score'] is None or frame_result['total_score'] > stats['best_score']:
+                            stats['best_score'] = frame_result['total_score']
+                            stats['best_frame_idx'] = idx
+                    frame_results.append(frame_result)
+                stats['frames_processed'] = len(frames_data)
+                stats['ball_detection_rate'] = has_ball_count / len(frames_data)
+                pending.clear()
             
             while cap.isOpened():
+                check_cancelled(cancel_token)
                 ret, frame = cap.read()
                 if not ret:
                     break
                 
                 # 采样
                 if frame_idx % sample_interval == 0:
-                    # 人体检测
+                    # 人体检测（逐帧，MediaPipe 按时间顺序跟踪）
                     landmarks, annotated_image = self.pose_detector.detect_pose(frame)
-                    
-                    # 球体检测
-                    ball_detection = None
-                    if self.ball_detector and landmarks:
-                        try:
-                            # 使用 detect() 方法
-                            ball_detections = self.ball_detector.detect(frame)
-                            if ball_detections and len(ball_detections) > 0:
-                                ball_detection = max(ball_detections, key=lambda x: x.score)
-                        except Exception as e:
-                            print(f"⚠️ 第{frame_idx}帧球体检测失败: {e}")
-                    
-                    frames_data.append({
-                        'landmarks': landmarks,
-                        'ball': ball_detection,
-                        'frame': annotated_image,
-                        'frame_idx': frame_idx
-                    })
+                    pending.append((frame_idx, landmarks, annotated_image, frame))
+                    batch_size = min(self.ball_detector.get_batch_size(ball_session.input_size), max_pending) \
+                        if ball_session is not None else 1
+                    if len(pending) >= batch_size:
+                        score_pending()
                 
                 frame_idx += 1
+                if progress_callback is not None:
+                    stats['frames_decoded'] = frame_idx
+                    progress_callback(frame_idx, max(total_frames, frame_idx), dict(stats))
+            
+            if pending:
+                score_pending()
+                if progress_callback is not None:
+                    progress_callback(frame_idx, max(total_frames, frame_idx), dict(stats))
             
             cap.release()
             
@@ -251,9 +496,10 @@ class VolleyballService:
                 }
             
             print(f"✅ 已处理 {len(frames_data)} 帧")
+            preview = self._build_preview([item['frame'] for item in frames_data])
             
             # 使用V3评分器进行序列评分
-            sequence_result = self.scorer.score_sequence_with_ball(frames_data)
+            sequence_result = self.scorer.score_sequence_with_ball(frames_data, frame_results)
             
             # 构建返回结果
             best_frame_idx = sequence_result.get('best_frame_idx', 0)
@@ -278,9 +524,16 @@ class VolleyballService:
                 "ball_detection_rate": sequence_result.get('ball_detection_rate', 0),
                 "has_ball_frames": sequence_result.get('has_ball_frames', 0),
                 "total_frames": len(frames_data),
-                "video_info": self.video_processor.get_video_info(video_path)
+                "preview": preview,
+                "video_info": self.video_processor.get_video_info(video_path),
+                "diagnostics": {
+                    "ball_detector": self.ball_detector.get_diagnostics(ball_session)
+                } if self.ball_detector else {}
             }
             
+        except OperationCancelled as e:
+            cap.release()
+            return self._cancelled_result(e)
         except Exception as e:
             import traceback
             traceback.print_exc()
@@ -289,15 +542,56 @@ class VolleyballService:
                 "error": f"带球检测的序列分析失败: {str(e)}"
             }
     
-    def _analyze_video_sequence(self, video_path):
+    def _detect_ball_batch(self, pending, ball_session, cancel_token=None):
+        """
+        对一批采样帧做球检测（只检测有人体姿态的帧）
+
+        Args:
+            pending: [(帧索引, landmarks, 标注图, 原始帧), ...]
+            ball_session: 本视频的 DetectionSession，为 None 时不检测
+
+        Returns:
+            list: 每帧置信度最高的 VolleyballDetection，未检测到时为 None
+        """
+        balls = [None] * len(pending)
+        if ball_session is None:
+            return balls
+        indices = [i for i, item in enumerate(pending) if item[1]]
+        if not indices:
+            return balls
+        try:
+            detections = self.ball_detector.detect_batch(
+                [pending[i][3] for i in indices], cancel_token=cancel_token, session=ball_session
+            )
+        except OperationCancelled:
+            raise
+        except Exception as e:
+            print(f"⚠️ 第{pending[0][0]}-{pending[-1][0]}帧球体检测失败: {e}")
+            return balls
+        for i, ball_detections in zip(indices, detections):
+            if ball_detections:
+                balls[i] = max(ball_detections, key=lambda x: x.score)
+        return balls
+    
+    def _analyze_video_sequence(self, video_path, high_accuracy=None, progress_callback=None, cancel_token=None):
         """序列模式分析视频"""
         try:
             # V3版本：同时检测人和球
             if self.scorer_version == 'v3' and self.enable_ball_detection:
-                return self._analyze_video_sequence_with_ball(video_path)
+                return self._analyze_video_sequence_with_ball(video_path, high_accuracy, progress_callback,
+                                                              cancel_token)
             
             # 使用序列分析器
-            analysis_result = self.sequence_analyzer.analyze_sequence(video_path)
+            # 需要报告进度时逐帧评分，得到当前最佳帧得分
+            frame_scorer = None
+            if progress_callback is not None:
+                score_pose = getattr(self.scorer, 'score_pose', None) or self.scorer.score_pose_with_ball
+                frame_scorer = lambda landmarks: score_pose(landmarks).get('total_score', 0)
+            analysis_result = self.sequence_analyzer.analyze_sequence(
+                video_path, high_accuracy=high_accuracy, progress_callback=progress_callback,
+                frame_scorer=frame_scorer,
+                cancel_token=cancel_token
+            )
             
             if not analysis_result.get("success", False):
                 return analysis_result
@@ -358,6 +652,8 @@ class VolleyballService:
             if annotated_frames and best_frame_idx < len(annotated_frames):
                 analysis_result["pose_image"] = annotated_frames[best_frame_idx]
             
+            analysis_result["preview"] = self._build_preview(annotated_frames)
+            
             # 生成轨迹可视化
             trajectories = analysis_result.get("trajectories", {})
             if trajectories:
@@ -379,14 +675,28 @@ class VolleyballService:
             
             return analysis_result
             
+        except OperationCancelled as e:
+            return self._cancelled_result(e)
         except Exception as e:
             return {
                 "success": False,
                 "error": f"序列分析失败: {str(e)}"
             }
     
+    def _build_preview(self, annotated_frames):
+        """用分析保留的标注帧生成预览；失败不影响分析结果"""
+        if self.preview_generator is None or not annotated_frames:
+            return None
+        try:
+            return self.preview_generator.generate(annotated_frames)
+        except Exception as e:
+            print(f"⚠️ 预览生成失败: {e}")
+            return None
+    
     def generate_visualization_video(self, video_path, output_path, vis_type="overlay",
-                                     detect_ball=False, highlight_ball=False):
+                                     detect_ball=False, highlight_ball=False, profile=None,
+                                     max_height=None, output_fps=None, progress_callback=None,
+                                     cancel_token=None):
         """
         生成可视化视频
         
@@ -398,25 +708,142 @@ class VolleyballService:
                 - "skeleton": 纯骨架
                 - "comparison": 对比视频
                 - "trajectory": 轨迹追踪
+            profile: 编码档位名称（preview / share / archive），None 时使用默认档位
+            max_height: 输出最大高度，None 时使用 VISUALIZATION_CONFIG 默认值
+            output_fps: 输出帧率上限，None 时使用 VISUALIZATION_CONFIG 默认值
+            progress_callback: progress_callback(已渲染帧数, 预计总帧数)
+            cancel_token: CancelToken，每帧检查；取消 / 超时时终止编码并返回 cancelled 结果
                 
         Returns:
             dict: 生成结果
         """
         try:
-            self.video_generator.generate_video(
-                video_path=video_path,
-                output_path=output_path,
-                video_type=vis_type,
-                detect_ball=detect_ball,
-                highlight_ball=highlight_ball
-            )
+            profile = profile or DEFAULT_ENCODE_PROFILE
+            max_height = max_height or VISUALIZATION_CONFIG["max_height"]
+            output_fps = output_fps or VISUALIZATION_CONFIG["output_fps"]
+            with self.exclusive_models(cancel_token):
+                self.video_generator.generate_video(
+                    video_path=video_path,
+                    output_path=output_path,
+                    video_type=vis_type,
+                    detect_ball=detect_ball,
+                    highlight_ball=highlight_ball,
+                    encode_profile=ENCODE_PROFILES[profile],
+                    max_height=max_height,
+                    output_fps=output_fps,
+                    progress_callback=progress_callback,
+                    cancel_token=cancel_token
+                )
             
             return {
                 "success": True,
                 "output_path": output_path,
-                "video_type": vis_type
+                "video_type": vis_type,
+                "profile": profile,
+                "max_height": max_height,
+                "output_fps": output_fps
+            }
+            
+        except OperationCancelled as e:
+            return self._cancelled_result(e)
+        except Exception as e:
+            return {
+                "success": False,
+                "error": f"视频生成失败: {str(e)}"
+            }
+    
+    def generate_visualization_videos(self, video_path, output_paths,
+                                      detect_ball=False, highlight_ball=False, profile=None,
+                                      max_height=None, output_fps=None, progress_callback=None,
+                                      cancel_token=None, content_digest=None, model_wait=None):
+        """
+        一次分析生成多种可视化视频
+        
+        Args:
+            video_path: 原始视频路径
+            output_paths: {可视化类型: 输出视频路径}，路径为 .m3u8 时输出 HLS 分片
+            profile: 编码档位名称（preview / share / archive），None 时使用默认档位
+            max_height / output_fps / progress_callback / cancel_token: 同 generate_visualization_video
+            content_digest: 视频文件的 SHA-256（上传时已计算），用于关键点缓存
+            model_wait: 同 analyze_video
+                
+        Returns:
+            dict: 生成结果，videos 为 {可视化类型: 输出视频路径}
+        """
+        try:
+            profile = profile or DEFAULT_ENCODE_PROFILE
+            max_height = max_height or VISUALIZATION_CONFIG["max_height"]
+            output_fps = output_fps or VISUALIZATION_CONFIG["output_fps"]
+            with self.exclusive_models(cancel_token, wait=model_wait):
+                videos, info = self.video_generator.generate_videos(
+                    video_path=video_path,
+                    outputs=output_paths,
+                    detect_ball=detect_ball,
+                    highlight_ball=highlight_ball,
+                    encode_profile=ENCODE_PROFILES[profile],
+                    max_height=max_height,
+                    output_fps=output_fps,
+                    return_info=True,
+                    progress_callback=progress_callback,
+                    cancel_token=cancel_token,
+                    content_digest=content_digest
+                )
+            
+            return {
+                "success": True,
+                "videos": videos,
+                "profile": profile,
+                "max_height": max_height,
+                "output_fps": output_fps,
+                "landmarks_id": info["landmarks_id"],
+                "from_landmark_cache": info["from_cache"]
+            }
+            
+        except OperationCancelled as e:
+            return self._cancelled_result(e)
+        except ModelsBusy as e:
+            return self._busy_result(e)
+        except Exception as e:
+            return {
+                "success": False,
+                "error": f"视频生成失败: {str(e)}"
+            }
+    
+    def render_from_landmarks(self, landmarks_id, output_paths, highlight_ball=False, profile=None,
+                              progress_callback=None, cancel_token=None):
+        """
+        用缓存的关键点序列渲染骨架 / 轨迹视频（不需要原视频）
+        
+        Args:
+            landmarks_id: 之前生成可视化视频时返回的 landmarks_id
+            output_paths: {可视化类型: 输出视频路径}，只支持 skeleton / trajectory
+            profile: 编码档位名称，None 时使用默认档位
+                
+        Returns:
+            dict: 生成结果，videos 为 {可视化类型: 输出视频路径}
+        """
+        if self.landmark_store is None:
+            return {"success": False, "error": "关键点缓存未启用"}
+        sequence = self.landmark_store.get(landmarks_id)
+        if sequence is None:
+            return {"success": False, "not_found": True, "error": "关键点序列不存在或已过期，请重新上传视频"}
+        
+        try:
+            profile = profile or DEFAULT_ENCODE_PROFILE
+            videos = self.video_generator.render_from_landmarks(
+                sequence, output_paths, highlight_ball=highlight_ball,
+                encode_profile=ENCODE_PROFILES[profile], progress_callback=progress_callback,
+                cancel_token=cancel_token
+            )
+            return {
+                "success": True,
+                "videos": videos,
+                "profile": profile,
+                "landmarks_id": landmarks_id
             }
             
+        except OperationCancelled as e:
+            return self._cancelled_result(e)
         except Exception as e:
             return {
                 "success": False,
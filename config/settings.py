@@ -33,7 +33,226 @@ VIDEO_CONFIG = {
     "max_file_size_mb": 50,
     "supported_formats": [".mp4", ".avi", ".mov", ".mkv"],
     "frame_extraction_fps": 2,  # 每秒提取帧数
-    "max_duration_seconds": 30
+    "max_duration_seconds": 30,
+    # 序列分析中等待球检测的采样帧上限：每帧同时缓存原始帧和标注帧，
+    # 不随检测器（自动调优后最多 128）的 batch 变大
+    "max_pending_frames": 16
+}
+
+# 上传暂存：请求体按块直接写入唯一命名的文件，大小上限取 VIDEO_CONFIG["max_file_size_mb"]
+UPLOAD_CONFIG = {
+    "spool_dir": DATA_DIR / "uploads"   # 与任务上传目录同一文件系统，认领时只需改名
+}
+
+# 排球检测器配置
+DETECTOR_CONFIG = {
+    "score_threshold": 0.45,
+    "max_results": 3,
+    "input_sizes": [320, 416, 512, 640],  # 自适应推理尺寸候选（32 的倍数）
+    "max_input_size": 640,                # 推理尺寸上限
+    "adaptive_input_size": True,          # 按视频的排球尺度自动选择推理尺寸
+    "probe_frames": 8,                    # 用前几帧的检测框探测排球尺度
+    "min_ball_pixels": 24,                # 推理尺度下排球最小边长（像素）
+    "accelerated": "auto"                 # 有 GPU 时启用 fp16 + channels_last 流水线推理
+}
+
+# 检测器 INT8 量化配置（仅 CPU 部署生效）
+QUANTIZATION_CONFIG = {
+    "enabled": False,                                  # 是否尝试使用 INT8 检测器
+    "calibration_dir": DATA_DIR / "calibration" / "frames",   # 从上传视频中采集的校准帧
+    "labeled_dir": DATA_DIR / "calibration" / "labeled",      # 带标注的帧（labels.json）
+    "calibration_frames": 64,                          # 校准所需帧数
+    "collect_from_uploads": True,                      # 校准帧不足时从上传视频中采集
+    "collect_every_n_frames": 15,                      # 每隔多少帧采集一次
+    "max_accuracy_drop": 0.02                          # 允许的命中率下降，超过则继续用 FP32
+}
+
+# 检测 batch 大小自动调优配置
+BATCH_TUNING_CONFIG = {
+    "enabled": True,
+    "cache_file": DATA_DIR / "cache" / "batch_tuning.json",  # 按主机/模型持久化的调优结果
+    "candidates": [4, 8, 16, 32, 64, 128],   # 预热时测试的 batch 大小
+    "memory_ceiling_mb": None,               # 推理可用内存上限，None 时按比例估算
+    "memory_fraction": 0.6,                  # 每个 worker 可用内存占比
+    "default_batch": 16,                     # 尚无调优结果时的保守值（调优只在预热阶段进行）
+    "repeats": 2,
+    "bench_frame_shape": [720, 1280, 3],     # 基准测试帧尺寸 (H, W, C)
+    "workers": int(os.environ.get("GUNICORN_WORKERS", "1"))  # 同一容器内的 worker 进程数，平分内存上限
+}
+
+# 高精度模式（教练复盘）：只对置信度模糊的帧追加 TTA / 多权重集成推理
+HIGH_ACCURACY_CONFIG = {
+    "enabled": False,          # 默认关闭；分析请求可传 high_accuracy=1 单独开启
+    "ambiguous_low": 0.15,     # 最高置信度落在 [low, high) 的帧才精修
+    "ambiguous_high": 0.6,
+    "tta": True,               # 测试时增强（左右翻转 + 多尺度）
+    "ensemble_weights": [],    # 额外参与集成的 YOLOv7 权重路径
+    "fusion_iou": 0.55,        # 加权框融合的 IoU 阈值
+    "max_boxes": 5             # 每个来源每帧参与融合的框数
+}
+
+# FFmpeg 配置
+FFMPEG_CONFIG = {
+    "capability_cache": DATA_DIR / "cache" / "ffmpeg_capabilities.json"  # 编码器探测结果（按 ffmpeg 可执行文件缓存）
+}
+
+# 可视化视频编码档位（preset 使用 x264 名称，硬件编码器自动映射）
+ENCODE_PROFILES = {
+    "preview": {   # 快速预览：低分辨率，边下边播
+        "preset": "ultrafast",
+        "crf": 28,
+        "tune": "fastdecode",
+        "threads": 0,          # 0 = ffmpeg 自动
+        "faststart": True,
+        "max_height": 480
+    },
+    "share": {     # 默认：速度和画质平衡
+        "preset": "fast",
+        "crf": 23,
+        "tune": None,
+        "threads": 0,
+        "faststart": True,
+        "max_height": None
+    },
+    "archive": {   # 存档：慢速高画质
+        "preset": "slow",
+        "crf": 18,
+        "tune": None,
+        "threads": 0,
+        "faststart": True,
+        "max_height": None
+    }
+}
+DEFAULT_ENCODE_PROFILE = "share"
+
+# 关键点序列缓存：骨架 / 轨迹视频可直接用缓存的关键点渲染，不再解码原视频
+LANDMARK_CACHE_CONFIG = {
+    "enabled": True,
+    "directory": DATA_DIR / "cache" / "landmarks",
+    "max_entries": 200         # 最多保留的序列数，按最后访问时间淘汰
+}
+
+# HLS 分片输出：fMP4 分片边编码边发布，前端不必等整个文件生成完
+HLS_CONFIG = {
+    "enabled": True,
+    "directory": OUTPUT_DIR / "hls",      # 每次渲染一个子目录 <render_id>/<vis_type>/
+    "segment_seconds": 2,                 # 分片时长（强制关键帧间隔）
+    "first_segment_timeout": 60,          # 等待首个分片发布的最长时间（秒）
+    "segment_max_age": 31536000,          # 分片 / init.mp4 的缓存时间（内容不变，可长期缓存）
+    "live_playlist_max_age": 1            # 仍在生成中的播放列表缓存时间
+}
+
+# 分析结果图像（姿态图、轨迹图）写成文件按地址返回，不再以 base64 内嵌在 JSON 中
+IMAGE_CONFIG = {
+    "directory": OUTPUT_DIR / "images",
+    "format": "jpeg",          # jpeg / webp
+    "quality": 90,
+    "max_age": 31536000,       # 文件名为内容哈希，内容不变，可长期缓存
+    "inline_base64": False     # 兼容旧客户端：同时返回 *_base64 字段
+}
+
+# 分析结果的轻量预览（动画 WebP + 雪碧图），分析结束即可返回
+PREVIEW_CONFIG = {
+    "enabled": True,
+    "directory": OUTPUT_DIR / "previews",
+    "num_frames": 12,          # 均匀抽取的标注帧数
+    "width": 320,              # 预览宽度
+    "fps": 6,                  # 动画播放帧率
+    "quality": 60,             # 初始 WebP / JPEG 质量
+    "max_bytes": 400 * 1024,   # 动画预览体积上限，超出时降低质量
+    "sprite_columns": 4        # 雪碧图每行格数
+}
+
+# 长视频分段并行编码：按 GOP 对齐切段，多个 ffmpeg 进程并行编码后无损拼接
+CHUNKED_ENCODING_CONFIG = {
+    "enabled": True,
+    "segment_seconds": 4,      # 每段时长（取 GOP 的整数倍）
+    "gop_seconds": 2,          # 固定关键帧间隔
+    "min_segments": 3,         # 不足这么多段的短视频仍然单进程编码
+    "max_workers": None,       # 并行编码进程数，None 时按本 worker 分到的 CPU 数（线程预算）
+    "hardware_workers": 2      # 硬件编码器的并行会话上限
+}
+
+# 可视化视频输出尺寸和帧率（默认值面向手机端播放）
+VISUALIZATION_CONFIG = {
+    "max_height": 720,          # 默认输出最大高度（只缩小不放大）
+    "output_fps": 15,           # 默认输出帧率上限
+    "max_height_limit": 2160,   # 请求可指定的最大高度上限
+    "output_fps_limit": 60      # 请求可指定的帧率上限
+}
+
+# 后台任务队列：分析 / 可视化提交后立即返回 job_id，客户端轮询进度和结果
+JOB_CONFIG = {
+    "backend": "sqlite",                        # sqlite（多个 worker 共享）/ memory（单进程）
+    "db_path": DATA_DIR / "jobs" / "jobs.db",
+    "upload_dir": DATA_DIR / "jobs" / "uploads",  # 排队期间保存上传的视频
+    "workers": 1,               # 每个进程执行任务的线程数（模型调用在进程内串行，见 exclusive_models）
+    "max_pending": 20,          # 排队任务数上限，超过时返回 429
+    "progress_interval": 0.5,   # 进度写回间隔（秒）
+    "poll_interval": 1.0,       # 空闲时检查新任务的间隔（秒）
+    "retention_hours": 24,      # 已结束任务（及上传文件）的保留时间
+    "events_interval": 0.5,     # SSE 进度推送检查间隔（秒）
+    "events_max_seconds": 90,   # 单个 SSE 连接的最长时间，到时关闭、客户端自动重连（每个连接占用一个 gunicorn 线程）
+    "events_heartbeat": 15      # 无新事件时的心跳间隔（秒），防止代理断开空闲连接
+}
+
+# 处理截止时间：超时后分析 / 渲染在下一个批次之前停下，终止 ffmpeg 并释放 worker
+DEADLINE_CONFIG = {
+    "request_seconds": 110,     # 同步接口，需小于 gunicorn 超时（120 秒）
+    "job_seconds": 900,         # 后台任务
+    "hls_seconds": 900,         # HLS 后台渲染
+    # 同步接口（/api/analyze/video、MP4 /api/visualize/video）等待模型的最长时间：
+    # 模型被后台任务占用时返回 503 + Retry-After，不在请求线程里排队
+    "model_wait_seconds": 2,
+    "model_busy_retry_after": 10
+}
+
+# 准入控制：按 帧数 × 分辨率（百万像素）× 模式系数 估算成本，限制同时处理的重型请求
+# 轻量接口（战术问答、单帧分析、结果文件等）不受限制
+ADMISSION_CONFIG = {
+    "enabled": True,
+    "backend": "sqlite",                        # sqlite（多个 worker 共享）/ memory（单进程）
+    "db_path": DATA_DIR / "jobs" / "admission.db",
+    "capacity": 4000,           # 在途总成本上限（百万像素·帧），约两段 30 秒 1080p 视频同时分析
+    "max_wait_seconds": 10,     # 同步接口放不下时的最长排队时间，之后返回 429 + Retry-After
+    "poll_interval": 0.2,       # 排队期间重试的间隔（秒）
+    "min_retry_after": 5,       # Retry-After 范围（秒），按观测到的处理速度估算
+    "max_retry_after": 120,
+    "factors": {
+        "analyze_sequence": 1.0,        # 逐帧姿态 + 排球检测
+        "high_accuracy": 2.0,           # 高精度模式在上面的基础上乘以此系数
+        "visualize": 1.0,               # 可视化视频：分析一遍
+        "per_vis_type": 0.5,            #   每种输出视频的渲染 + 编码
+        "landmarks_per_vis_type": 0.5   # 关键点渲染（不解码原视频，按默认输出尺寸估算）
+    }
+}
+
+# gunicorn worker 进程（见 gunicorn.conf.py）
+WORKER_CONFIG = {
+    # preload：master 加载模型权重后再 fork，各 worker 以写时复制方式共享；
+    # gunicorn.conf.py 开启 preload_app 时设置 VOLLEYBALL_PRELOAD=1
+    "preload": os.environ.get("VOLLEYBALL_PRELOAD") == "1"
+}
+
+# 线程预算：容器可用 CPU 按 worker 数平分，限制每个 worker 的 torch / OpenCV / ffmpeg 线程数
+THREAD_BUDGET_CONFIG = {
+    "enabled": True,
+    "workers": int(os.environ.get("GUNICORN_WORKERS", "1")),  # 同一容器内的 worker 进程数
+    "cpus": None,               # 可用 CPU 数，None 时从 cgroup 配额 / CPU 亲和性读取
+    "torch_threads": None,      # 以下为 None 时取每个 worker 分到的 CPU 数（至少 1）
+    "opencv_threads": None,
+    "ffmpeg_threads": None      # 编码档位的 threads 非 0 时以档位为准
+}
+
+# 启动预热：worker 启动后用空白帧跑一遍各模型，预热结束后才开始接受请求；
+# 预热出错、模型未加载或任务存储不可用时 /api/ready 返回 503
+WARMUP_CONFIG = {
+    "enabled": True,
+    "frame_shape": (720, 1280, 3),  # 空白帧尺寸 (H, W, 3)
+    "pose_iterations": 2,           # 每个 MediaPipe 计算图的推理次数
+    "ball_input_sizes": None,       # 预热的推理尺寸，None 时使用 DETECTOR_CONFIG["input_sizes"]
+    "tune_batch": True,             # 同时完成各推理尺寸的 batch 调优
+    "ffmpeg": True                  # 用选出的编码配置跑一次测试编码
 }
 
 # 评分配置
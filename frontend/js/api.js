@@ -7,6 +7,16 @@
 const API_BASE_URL = '/api';
 
 class VolleyballAPI {
+    constructor() {
+        // 正在等待的后台任务；页面关闭时取消，服务端不再为已离开的用户继续处理
+        this.activeJobs = new Set();
+        window.addEventListener('pagehide', () => {
+            this.activeJobs.forEach(jobId => {
+                navigator.sendBeacon(`${API_BASE_URL}/jobs/${jobId}/cancel`);
+            });
+        });
+    }
+    
     /**
      * 上传视频并分析
      * @param {File} videoFile - 视频文件对象
@@ -59,13 +69,23 @@ class VolleyballAPI {
     /**
      * 生成可视化视频
      * @param {File} videoFile - 视频文件对象
-     * @param {string} visType - 可视化类型
+     * @param {string|string[]} visType - 可视化类型；传数组时一次生成多种（结果在 videos 字段中）
+     * @param {Object} options - 可选 { profile, maxHeight, outputFps, format }（format: 'mp4' / 'hls'）
      * @returns {Promise<Object>} 生成结果
      */
-    async visualizeVideo(videoFile, visType = 'overlay') {
+    async visualizeVideo(videoFile, visType = 'overlay', options = {}) {
         const formData = new FormData();
         formData.append('video', videoFile);
-        formData.append('vis_type', visType);
+        if (Array.isArray(visType)) {
+            formData.append('vis_types', visType.join(','));
+        } else {
+            formData.append('vis_type', visType);
+        }
+        // 可选：编码档位、输出最大高度、输出帧率（不传时使用服务端默认值）
+        if (options.profile) formData.append('profile', options.profile);
+        if (options.maxHeight) formData.append('max_height', options.maxHeight);
+        if (options.outputFps) formData.append('output_fps', options.outputFps);
+        if (options.format) formData.append('format', options.format);
         
         try {
             // 增加超时时间到5分钟（视频生成需要较长时间）
@@ -104,6 +124,176 @@ class VolleyballAPI {
         }
     }
     
+    /**
+     * 用缓存的关键点序列生成骨架 / 轨迹视频（不需要重新上传视频）
+     * @param {string} landmarksId - visualizeVideo 返回的 landmarks_id
+     * @param {string|string[]} visType - 'skeleton' / 'trajectory' 或数组
+     * @param {Object} options - 可选 { profile }
+     * @returns {Promise<Object>} 生成结果
+     */
+    async visualizeLandmarks(landmarksId, visType = 'skeleton', options = {}) {
+        try {
+            const response = await fetch(`${API_BASE_URL}/visualize/landmarks`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({
+                    landmarks_id: landmarksId,
+                    vis_types: Array.isArray(visType) ? visType.join(',') : visType,
+                    profile: options.profile
+                })
+            });
+            const data = await response.json();
+            if (!response.ok) {
+                throw new Error(data.error || `HTTP ${response.status}`);
+            }
+            return data;
+        } catch (error) {
+            console.error('关键点渲染失败:', error);
+            return {
+                success: false,
+                error: error.message
+            };
+        }
+    }
+    
+    /**
+     * 提交后台任务（分析或生成可视化视频），立即返回 job_id
+     * @param {string} type - 'analyze' / 'visualize'
+     * @param {File} videoFile - 视频文件对象
+     * @param {Object} fields - 其他表单字段（如 { mode } 或 { vis_type, profile }）
+     * @returns {Promise<Object>} { success, job_id, status_url }
+     */
+    async submitJob(type, videoFile, fields = {}) {
+        const formData = new FormData();
+        formData.append('type', type);
+        formData.append('video', videoFile);
+        Object.entries(fields).forEach(([key, value]) => {
+            if (value !== undefined && value !== null) formData.append(key, value);
+        });
+        
+        try {
+            const response = await fetch(`${API_BASE_URL}/jobs`, {
+                method: 'POST',
+                body: formData
+            });
+            const data = await response.json();
+            if (!response.ok) {
+                throw new Error(data.error || `HTTP ${response.status}`);
+            }
+            return data;
+        } catch (error) {
+            console.error('提交任务失败:', error);
+            return {
+                success: false,
+                error: error.message
+            };
+        }
+    }
+    
+    /**
+     * 查询任务状态
+     * @param {string} jobId - submitJob 返回的 job_id
+     * @returns {Promise<Object>} { status, progress: { done, total, percent }, result, error }
+     */
+    async getJob(jobId) {
+        const response = await fetch(`${API_BASE_URL}/jobs/${jobId}`);
+        const data = await response.json();
+        if (!response.ok) {
+            throw new Error(data.error || `HTTP ${response.status}`);
+        }
+        return data;
+    }
+    
+    /**
+     * 取消任务
+     * @param {string} jobId - submitJob 返回的 job_id
+     * @returns {Promise<Object>} { success, status }
+     */
+    async cancelJob(jobId) {
+        try {
+            const response = await fetch(`${API_BASE_URL}/jobs/${jobId}/cancel`, { method: 'POST' });
+            return await response.json();
+        } catch (error) {
+            console.error('取消任务失败:', error);
+            return {
+                success: false,
+                error: error.message
+            };
+        }
+    }
+    
+    /**
+     * 等待任务结束：优先用 SSE（/jobs/<id>/events）接收进度，不支持时轮询
+     * @param {string} jobId - submitJob 返回的 job_id
+     * @param {Object} handlers - 可选 { onProgress(job), onScore(score) }；
+     *     score 为 { best_score, best_frame_idx, ball_detection_rate }，分析中得到第一帧评分即回调
+     * @param {number} interval - 轮询间隔（毫秒）
+     * @returns {Promise<Object>} 任务结果（与同步接口的响应相同）
+     */
+    async waitForJob(jobId, handlers = {}, interval = 1000) {
+        this.activeJobs.add(jobId);
+        let job;
+        try {
+            job = window.EventSource
+                ? await this._watchJobEvents(jobId, handlers)
+                : await this._pollJob(jobId, handlers, interval);
+        } finally {
+            this.activeJobs.delete(jobId);
+        }
+        if (job.status === 'succeeded') {
+            return job.result;
+        }
+        return {
+            success: false,
+            error: job.error || '任务失败'
+        };
+    }
+    
+    _watchJobEvents(jobId, { onProgress, onScore } = {}) {
+        return new Promise((resolve) => {
+            const source = new EventSource(`${API_BASE_URL}/jobs/${jobId}/events`);
+            source.addEventListener('progress', (e) => {
+                if (onProgress) onProgress(JSON.parse(e.data));
+            });
+            source.addEventListener('score', (e) => {
+                if (onScore) onScore(JSON.parse(e.data));
+            });
+            source.addEventListener('done', (e) => {
+                source.close();
+                resolve(JSON.parse(e.data));
+            });
+            source.onerror = () => {
+                // 服务端定期关闭连接时 EventSource 会自动重连；连接已彻底关闭（如 404）时改为轮询
+                if (source.readyState === EventSource.CLOSED) {
+                    resolve(this._pollJob(jobId, { onProgress, onScore }));
+                }
+            };
+        });
+    }
+    
+    async _pollJob(jobId, { onProgress, onScore } = {}, interval = 1000) {
+        try {
+            while (true) {
+                const job = await this.getJob(jobId);
+                if (onProgress) onProgress(job);
+                const stats = job.progress && job.progress.stats;
+                if (onScore && stats && stats.best_score !== null && stats.best_score !== undefined) {
+                    onScore(stats);
+                }
+                if (['succeeded', 'failed', 'cancelled'].includes(job.status)) {
+                    return job;
+                }
+                await new Promise(resolve => setTimeout(resolve, interval));
+            }
+        } catch (error) {
+            console.error('查询任务失败:', error);
+            return {
+                status: 'failed',
+                error: error.message
+            };
+        }
+    }
+    
     /**
      * 获取战术题库
      * @returns {Promise<Object>} 题库数据
@@ -1508,12 +1508,34 @@ async function startAnalysis() {
     
     // 显示加载状态
     showLoading(true);
+    const loadingDiv = document.getElementById('loading');
+    const loadingHtml = loadingDiv.innerHTML;
     
     try {
-        // 调用API分析视频
-        const result = await api.analyzeVideo(window.uploadedVideoFile, mode);
+        // 调用API分析视频：序列分析耗时较长，提交后台任务并实时显示进度和当前最佳得分
+        let result;
+        if (mode === 'sequence') {
+            loadingDiv.innerHTML = `
+                <div class="bg-white rounded-2xl p-8 text-center max-w-md">
+                    <div class="animate-spin rounded-full h-16 w-16 border-b-4 border-volleyball-orange mx-auto mb-4"></div>
+                    <p class="text-lg font-semibold text-gray-700">AI正在分析中...</p>
+                    <p id="vis-progress" class="text-sm text-gray-500 mt-2">正在上传视频</p>
+                    <p id="analysis-score-estimate" class="text-sm text-volleyball-blue mt-2"></p>
+                </div>
+            `;
+            const job = await api.submitJob('analyze', window.uploadedVideoFile, { mode });
+            result = job.success
+                ? await api.waitForJob(job.job_id, {
+                    onProgress: updateJobProgress,
+                    onScore: updateScoreEstimate
+                })
+                : job;
+        } else {
+            result = await api.analyzeVideo(window.uploadedVideoFile, mode);
+        }
         
         // 隐藏加载状态
+        loadingDiv.innerHTML = loadingHtml;
         showLoading(false);
         
         if (result.success) {
@@ -1524,6 +1546,7 @@ async function startAnalysis() {
             showToast(`分析失败: ${result.error}`, 'error');
         }
     } catch (error) {
+        loadingDiv.innerHTML = loadingHtml;
         showLoading(false);
         showToast(`分析过程出错: ${error.message}`, 'error');
     }
@@ -1557,13 +1580,23 @@ async function startVisualization() {
         <div class="bg-white rounded-2xl p-8 text-center max-w-md">
             <div class="animate-spin rounded-full h-16 w-16 border-b-4 border-volleyball-blue mx-auto mb-4"></div>
             <p class="text-lg font-semibold text-gray-700">正在生成${visTypeNames[visType]}视频...</p>
-            <p class="text-sm text-gray-500 mt-2">这可能需要30秒到2分钟，请耐心等待</p>
+            <p id="vis-progress" class="text-sm text-gray-500 mt-2">这可能需要30秒到2分钟，请耐心等待</p>
         </div>
     `;
     
     try {
         // 调用API生成可视化视频
-        const result = await api.visualizeVideo(window.uploadedVideoFileForVis, visType);
+        // 浏览器能播放 HLS 时请求分片输出，首个分片生成后即可开始播放；
+        // 否则提交后台任务并轮询进度
+        let result;
+        if (canPlayHls()) {
+            result = await api.visualizeVideo(window.uploadedVideoFileForVis, visType, { format: 'hls' });
+        } else {
+            const job = await api.submitJob('visualize', window.uploadedVideoFileForVis, { vis_type: visType });
+            result = job.success
+                ? await api.waitForJob(job.job_id, { onProgress: updateJobProgress })
+                : job;
+        }
         
         // 恢复加载状态
         loadingDiv.innerHTML = `
@@ -1587,6 +1620,53 @@ async function startVisualization() {
     }
 }
 
+/**
+ * 在加载提示中显示后台任务进度
+ */
+function updateJobProgress(job) {
+    const progressText = document.getElementById('vis-progress');
+    if (!progressText) return;
+    if (job.status === 'queued') {
+        progressText.textContent = `排队中（前面还有 ${Math.max(0, job.queue_position - 1)} 个任务）`;
+    } else if (job.status === 'running') {
+        progressText.textContent = `已处理 ${job.progress.done} / ${job.progress.total} 帧（${job.progress.percent}%）`;
+    }
+}
+
+/**
+ * 在加载提示中显示分析过程中的当前最佳得分
+ */
+function updateScoreEstimate(score) {
+    const estimateText = document.getElementById('analysis-score-estimate');
+    if (!estimateText) return;
+    let text = `当前最佳帧得分：${Math.round(score.best_score)}`;
+    if (score.ball_detection_rate !== null && score.ball_detection_rate !== undefined) {
+        text += ` · 球检出率 ${Math.round(score.ball_detection_rate * 100)}%`;
+    }
+    estimateText.textContent = text;
+}
+
+/**
+ * 浏览器是否能播放 HLS（hls.js 或原生支持）
+ */
+function canPlayHls() {
+    if (window.Hls && window.Hls.isSupported()) return true;
+    return document.createElement('video').canPlayType('application/vnd.apple.mpegurl') !== '';
+}
+
+/**
+ * 把 HLS 播放列表挂到 video 元素上
+ */
+function attachHlsSource(videoElement, playlistUrl) {
+    if (window.Hls && window.Hls.isSupported()) {
+        const hls = new window.Hls();
+        hls.loadSource(playlistUrl);
+        hls.attachMedia(videoElement);
+    } else {
+        videoElement.src = playlistUrl;
+    }
+}
+
 /**
  * 显示可视化结果
  */
@@ -1622,19 +1702,19 @@ function displayVisualizationResults(result) {
             <!-- 视频播放器 -->
             <div class="bg-black rounded-xl overflow-hidden">
                 <video id="result-video" controls autoplay class="w-full">
-                    <source src="${result.video_url}" type="video/mp4">
+                    ${result.format === 'hls' ? '' : `<source src="${result.video_url}" type="video/mp4">`}
                     您的浏览器不支持视频播放。
                 </video>
             </div>
             
             <!-- 操作按钮 -->
             <div class="grid grid-cols-2 gap-3">
-                <a href="${result.video_url}" 
+                ${result.format === 'hls' ? '' : `<a href="${result.video_url}" 
                    download="${result.filename}"
                    class="px-6 py-3 bg-green-500 text-white rounded-xl text-center font-semibold hover:shadow-lg transition-all flex items-center justify-center gap-2">
                     <span>⬇️</span>
                     下载视频
-                </a>
+                </a>`}
                 <button onclick="resetVisualization()" 
                         class="px-6 py-3 border-2 border-gray-300 rounded-xl hover:bg-gray-50 transition-all font-semibold">
                     重新生成
@@ -1651,6 +1731,10 @@ function displayVisualizationResults(result) {
         </div>
     `;
     
+    if (result.format === 'hls') {
+        attachHlsSource(document.getElementById('result-video'), result.playlist_url);
+    }
+    
     resultsDiv.classList.remove('hidden');
 }
 
@@ -1745,27 +1829,42 @@ function displayAnalysisResults(result) {
         </div>
         
         <!-- 姿态图像 -->
-        ${result.pose_image_base64 ? `
+        ${result.pose_image_url || result.pose_image_base64 ? `
             <div class="mb-6">
                 <h4 class="text-lg font-semibold mb-3 flex items-center gap-2">
                     <span>🎨</span>
                     姿态检测结果
                 </h4>
-                <img src="data:image/jpeg;base64,${result.pose_image_base64}" 
+                <img src="${result.pose_image_url || `data:image/jpeg;base64,${result.pose_image_base64}`}" 
                      class="w-full rounded-xl border-2 border-gray-200"
                      alt="姿态检测">
             </div>
         ` : ''}
         
+        <!-- 动作预览（序列模式，分析结束即可查看） -->
+        ${result.preview && result.preview.animation_url ? `
+            <div class="mb-6">
+                <h4 class="text-lg font-semibold mb-3 flex items-center gap-2">
+                    <span>🎞️</span>
+                    动作预览
+                </h4>
+                <img src="${result.preview.animation_url}" 
+                     class="w-full rounded-xl border-2 border-gray-200"
+                     loading="lazy"
+                     alt="动作预览">
+            </div>
+        ` : ''}
+        
         <!-- 轨迹分析（序列模式） -->
-        ${result.trajectory_plot_base64 ? `
+        ${result.trajectory_plot_url || result.trajectory_plot_base64 ? `
             <div class="mb-6">
                 <h4 class="text-lg font-semibold mb-3 flex items-center gap-2">
                     <span>📈</span>
                     运动轨迹分析
                 </h4>
-                <img src="data:image/jpeg;base64,${result.trajectory_plot_base64}" 
+                <img src="${result.trajectory_plot_url || `data:image/jpeg;base64,${result.trajectory_plot_base64}`}" 
                      class="w-full rounded-xl border-2 border-gray-200"
+                     loading="lazy"
                      alt="轨迹分析">
             </div>
         ` : ''}
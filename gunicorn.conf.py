@@ -0,0 +1,65 @@
+"""
+gunicorn 配置（gunicorn -c gunicorn.conf.py backend.api.flask_api:app）
+
+preload 模式（默认开启，GUNICORN_PRELOAD=0 关闭；检测到 GPU 时自动关闭）：
+- master 导入应用时加载 YOLO 权重、评分模板等只读数据，fork 后各 worker 以写时复制方式共享，
+  不再每个 worker 各加载一份
+- 加载完成后 gc.freeze()：已有对象移出 GC 跟踪，子进程的垃圾回收不会写这些对象而触发页面复制
+- MediaPipe 计算图、torch 线程数等进程内状态在 worker 初始化后由 init_worker() 创建，
+  预热在 worker 开始接受请求之前同步完成
+- 模型在 GPU 上时 CUDA 不能在 fork 之前初始化（检测器有 GPU 时会放到 cuda:0），
+  因此有可用 GPU 时不启用 preload，各 worker 自行加载
+
+每个 worker 的独占内存（uss）见 /api/health 和 /api/ready 的 memory 字段
+"""
+import gc
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("GUNICORN_WORKERS", "4"))
+# 线程预算按 worker 数平分 CPU（见 THREAD_BUDGET_CONFIG）
+os.environ["GUNICORN_WORKERS"] = str(workers)
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120"))
+# 线程 worker：任务进度的 SSE 连接（/api/jobs/<id>/events）会保持数十秒，
+# sync worker 下每个连接独占一个进程，几个客户端就能占满所有 worker，
+# 取消、就绪检查、上传等请求都无法得到处理；模型调用由服务内的锁串行化
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.environ.get("GUNICORN_THREADS", "8"))
+accesslog = "-"
+errorlog = "-"
+
+
+def _gpu_available():
+    """用 NVML 检查 GPU，不在 master 中初始化 CUDA（否则 fork 出的 worker 无法再使用 CUDA）"""
+    os.environ.setdefault("PYTORCH_NVML_BASED_CUDA_CHECK", "1")
+    try:
+        import torch
+    except ImportError:
+        return False
+    return torch.cuda.is_available()
+
+
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1"
+if preload_app and _gpu_available():
+    print("ℹ️ 检测到 GPU，关闭 preload（CUDA 不能在 fork 之前初始化）")
+    preload_app = False
+if preload_app:
+    # 应用在 master 中导入，据此只加载可共享的只读部分（见 WORKER_CONFIG["preload"]）
+    os.environ["VOLLEYBALL_PRELOAD"] = "1"
+
+
+def when_ready(server):
+    """master 完成应用加载、即将 fork worker"""
+    if preload_app:
+        gc.collect()
+        gc.freeze()
+        server.log.info("preload: %d 个对象已冻结，worker 以写时复制方式共享模型权重",
+                        gc.get_freeze_count())
+
+
+def post_worker_init(worker):
+    """worker 进程内初始化（fork 之后）"""
+    if preload_app:
+        from backend.api.flask_api import init_worker
+        # 预热期间定期通知 master，避免超过 timeout 被判定为无响应
+        init_worker(heartbeat=worker.notify)
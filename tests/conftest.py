@@ -0,0 +1,7 @@
+"""测试公共配置：从仓库根目录导入 backend / config"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
@@ -0,0 +1,160 @@
+"""准入控制：在途成本存储与 AdmissionController"""
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from backend.core.cancellation import CancelToken, OperationCancelled
+from backend.services.admission import (
+    AdmissionController, AdmissionRejected, MemoryAdmissionStore, SQLiteAdmissionStore, estimate_cost,
+)
+
+WORKER = f'{socket.gethostname()}:{os.getpid()}'
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryAdmissionStore()
+    return SQLiteAdmissionStore(tmp_path / 'admission.db')
+
+
+def _dead_pid():
+    proc = subprocess.Popen([sys.executable, '-c', 'pass'])
+    proc.wait()
+    return proc.pid
+
+
+def test_estimate_cost():
+    # 300 帧 1080p，系数 0.5
+    assert estimate_cost(300, 1920, 1080, factor=0.5) == pytest.approx(300 * 1920 * 1080 / 1e6 * 0.5)
+    # 元数据缺失时取最小成本
+    assert estimate_cost(0, 0, 0, min_cost=2.0) == 2.0
+
+
+# ----------------- 存储 -----------------
+
+def test_capacity_and_release(store):
+    assert store.try_acquire('a', 60.0, 100.0, WORKER) == (True, 60.0)
+    admitted, in_flight = store.try_acquire('b', 50.0, 100.0, WORKER)
+    assert not admitted and in_flight == 60.0
+    assert store.try_acquire('c', 40.0, 100.0, WORKER) == (True, 100.0)
+    assert store.usage() == (2, 100.0)
+
+    store.release('a')
+    assert store.try_acquire('b', 50.0, 100.0, WORKER) == (True, 90.0)
+    store.release('b')
+    store.release('c')
+    store.release('missing')
+    assert store.usage() == (0, 0)
+
+
+def test_idle_store_admits_oversized_request(store):
+    # 空闲时总是放行，单个超大请求不会永远饿死
+    assert store.try_acquire('huge', 500.0, 100.0, WORKER) == (True, 500.0)
+    assert store.try_acquire('next', 1.0, 100.0, WORKER)[0] is False
+
+
+def test_sqlite_shared_between_store_instances(tmp_path):
+    db_path = tmp_path / 'admission.db'
+    first, second = SQLiteAdmissionStore(db_path), SQLiteAdmissionStore(db_path)
+    assert first.try_acquire('a', 80.0, 100.0, WORKER)[0]
+    assert second.try_acquire('b', 30.0, 100.0, WORKER) == (False, 80.0)
+    first.release('a')
+    assert second.try_acquire('b', 30.0, 100.0, WORKER) == (True, 30.0)
+
+
+def test_sqlite_concurrent_acquire_never_exceeds_capacity(tmp_path):
+    db_path = tmp_path / 'admission.db'
+    SQLiteAdmissionStore(db_path)
+    admitted = []
+    lock = threading.Lock()
+
+    def acquire(i):
+        own = SQLiteAdmissionStore(db_path)
+        ok, _ = own.try_acquire(f't{i}', 10.0, 50.0, WORKER)
+        if ok:
+            with lock:
+                admitted.append(i)
+
+    threads = [threading.Thread(target=acquire, args=(i,)) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(admitted) == 5
+    assert SQLiteAdmissionStore(db_path).usage() == (5, 50.0)
+
+
+def test_sqlite_purges_tickets_of_dead_workers(tmp_path):
+    store = SQLiteAdmissionStore(tmp_path / 'admission.db')
+    assert store.try_acquire('dead', 90.0, 100.0, f'{socket.gethostname()}:{_dead_pid()}')[0]
+    # 其他主机上的票据无法判断进程存活，保留到 max_ticket_seconds
+    assert store.try_acquire('remote', 5.0, 100.0, 'other-host:1')[0]
+    assert store.try_acquire('new', 50.0, 100.0, WORKER) == (True, 55.0)
+    assert store.usage() == (2, 55.0)
+
+
+def test_sqlite_purges_expired_tickets(tmp_path):
+    store = SQLiteAdmissionStore(tmp_path / 'admission.db', max_ticket_seconds=0.05)
+    assert store.try_acquire('old', 90.0, 100.0, 'other-host:1')[0]
+    time.sleep(0.1)
+    assert store.try_acquire('new', 50.0, 100.0, WORKER) == (True, 50.0)
+
+
+# ----------------- AdmissionController -----------------
+
+def test_admit_releases_on_exit_and_on_error():
+    store = MemoryAdmissionStore()
+    controller = AdmissionController(store, capacity=100.0, max_wait=0)
+    with controller.admit(60.0):
+        assert store.usage() == (1, 60.0)
+    assert store.usage() == (0, 0)
+
+    with pytest.raises(RuntimeError):
+        with controller.admit(60.0):
+            raise RuntimeError('处理失败')
+    assert store.usage() == (0, 0)
+
+
+def test_acquire_rejects_after_wait():
+    controller = AdmissionController(MemoryAdmissionStore(), capacity=100.0, max_wait=0.1, poll_interval=0.02)
+    controller.acquire(80.0)
+    start = time.monotonic()
+    with pytest.raises(AdmissionRejected) as info:
+        controller.acquire(50.0)
+    assert time.monotonic() - start < 1.0
+    assert info.value.retry_after == controller.min_retry_after
+
+
+def test_acquire_waits_for_release():
+    controller = AdmissionController(MemoryAdmissionStore(), capacity=100.0, max_wait=2.0, poll_interval=0.02)
+    ticket = controller.acquire(80.0)
+    threading.Timer(0.1, controller.release, args=(ticket,)).start()
+    assert controller.acquire(50.0)
+
+
+def test_acquire_stops_waiting_when_cancelled():
+    controller = AdmissionController(MemoryAdmissionStore(), capacity=100.0, max_wait=5.0, poll_interval=0.02)
+    controller.acquire(80.0)
+    token = CancelToken()
+    threading.Timer(0.05, token.cancel).start()
+    with pytest.raises(OperationCancelled):
+        controller.acquire(50.0, cancel_token=token)
+
+
+def test_retry_after_uses_observed_throughput():
+    controller = AdmissionController(MemoryAdmissionStore(), capacity=100.0,
+                                     min_retry_after=1, max_retry_after=30)
+    ticket = controller.acquire(100.0)
+    # 100 成本用了 10 秒：处理速度 10 / 秒
+    controller.release(ticket, cost=100.0, seconds=10.0)
+    assert controller.retry_after(50.0) == 5
+    assert controller.retry_after(1000.0) == 30
+    assert controller.retry_after(0.0) == 1
+    assert controller.status()['throughput'] == 10.0
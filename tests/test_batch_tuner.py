@@ -0,0 +1,91 @@
+"""批大小调优"""
+import json
+import time
+
+import pytest
+
+from backend.core import batch_tuner
+from backend.core.batch_tuner import BatchSizeTuner
+
+
+def _tuner(tmp_path, **kwargs):
+    kwargs.setdefault('memory_ceiling_mb', 1e6)
+    kwargs.setdefault('repeats', 1)
+    return BatchSizeTuner(tmp_path / 'batch_tuning.json', **kwargs)
+
+
+def test_tune_stops_after_throughput_knee(tmp_path):
+    # 每帧耗时：batch 4 / 8 越大越快，16 明显变慢
+    per_frame = {4: 0.002, 8: 0.001, 16: 0.004, 32: 0.0001}
+    calls = []
+
+    def run_batch(n):
+        calls.append(n)
+        time.sleep(per_frame[n] * n)
+
+    tuner = _tuner(tmp_path, candidates=(4, 8, 16, 32))
+    key = tuner.make_key('best.pt', 640, 'cpu')
+    assert tuner.tune(key, run_batch) == 8
+    assert 32 not in calls
+    assert tuner.describe(key)['source'] == 'tuned'
+
+    # 结果持久化，重启后直接复用
+    assert _tuner(tmp_path).get(key) == 8
+
+
+def test_tune_stops_at_out_of_memory(tmp_path):
+    def run_batch(n):
+        if n >= 16:
+            raise RuntimeError('CUDA out of memory. Tried to allocate 2.00 GiB')
+
+    tuner = _tuner(tmp_path, candidates=(4, 8, 16, 32))
+    assert tuner.tune('key', run_batch) in (4, 8)
+    measured = [m['batch'] for m in json.loads(tuner.cache_file.read_text())['key']['measurements']]
+    assert measured == [4, 8]
+
+
+def test_tune_reraises_other_errors(tmp_path):
+    def run_batch(n):
+        raise ValueError('坏输入')
+
+    with pytest.raises(ValueError):
+        _tuner(tmp_path).tune('key', run_batch)
+
+
+def test_tune_disabled_returns_default(tmp_path):
+    tuner = _tuner(tmp_path, enabled=False, default_batch=12)
+    assert tuner.tune('key', lambda n: None) == 12
+    assert tuner.describe('key') == {'batch_size': 12, 'source': 'default'}
+
+
+def test_back_off_halves_and_persists(tmp_path):
+    tuner = _tuner(tmp_path)
+    assert tuner.back_off('key', 32) == 16
+    assert tuner.back_off('key', 1) == 1
+    assert _tuner(tmp_path).describe('key')['source'] == 'backoff'
+
+
+def test_store_merges_entries_from_other_processes(tmp_path):
+    first, second = _tuner(tmp_path), _tuner(tmp_path)
+    first.back_off('a', 32)
+    second.back_off('b', 64)
+    merged = _tuner(tmp_path)
+    assert merged.get('a') == 16 and merged.get('b') == 32
+
+
+def test_cpu_memory_ceiling_split_by_workers(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch_tuner, 'read_memory_limit_mb', lambda: 8000.0)
+    tuner = BatchSizeTuner(tmp_path / 'batch_tuning.json', memory_fraction=0.5, workers=4)
+    assert tuner._memory_ceiling_mb('cpu') == pytest.approx(1000.0)
+
+
+def test_peak_rss_sampler_records_peak():
+    before = batch_tuner._read_proc_status_mb('VmRSS')
+    if before is None:
+        pytest.skip('没有 /proc/self/status')
+    with batch_tuner.PeakRSSSampler() as sampler:
+        # 写满的内存块才会计入 RSS
+        block = b'\x01' * (64 * 1024 * 1024)
+        time.sleep(0.05)
+        del block
+    assert sampler.peak_mb - before >= 48
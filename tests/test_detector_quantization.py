@@ -0,0 +1,106 @@
+"""INT8 检测器：量化区域划分与缓存键"""
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+torch = pytest.importorskip('torch')
+# 与 volleyball_detector 相同：yolov7 代码按顶层包 models / utils 导入
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend', 'core'))
+
+import torch.nn as nn  # noqa: E402
+from torch.ao.nn.quantized import Quantize  # noqa: E402
+from torch.ao.quantization import convert  # noqa: E402
+
+from backend.core import detector_quantization as dq  # noqa: E402
+from models.common import SP, Concat, Conv  # noqa: E402
+from utils.torch_utils import fuse_conv_and_bn  # noqa: E402
+
+
+class _TinyModel(nn.Module):
+    """按 Model.forward_once 路由的最小模型：两个 LeakyReLU Conv + SP + Concat + 浮点头"""
+
+    def __init__(self):
+        super().__init__()
+        layers = [
+            (Conv(3, 8, 3, 2, act=nn.LeakyReLU(0.1)), -1),
+            (Conv(8, 8, 1, 1, act=nn.LeakyReLU(0.1)), -1),
+            (SP(), -1),
+            (Concat(1), [-1, 1]),
+            (nn.Conv2d(16, 4, 1), -1),
+        ]
+        for i, (layer, f) in enumerate(layers):
+            layer.f, layer.i, layer.type, layer.np = f, i, type(layer).__name__, 0
+        self.model = nn.Sequential(*[layer for layer, _ in layers])
+        self.save = [1]
+
+    def fuse(self):
+        for m in self.model.modules():
+            if type(m) is Conv and hasattr(m, 'bn'):
+                m.conv = fuse_conv_and_bn(m.conv, m.bn)
+                delattr(m, 'bn')
+                m.forward = m.fuseforward
+        return self
+
+    def forward(self, x):
+        y = []
+        for m in self.model:
+            if m.f != -1:
+                x = y[m.f] if isinstance(m.f, int) else [x if j == -1 else y[j] for j in m.f]
+            x = m(x)
+            y.append(x if m.i in self.save else None)
+        return x
+
+
+def test_consecutive_layers_share_one_int8_region():
+    engine = dq.select_quantized_engine()
+    if engine is None:
+        pytest.skip('没有可用的量化后端')
+    torch.backends.quantized.engine = engine
+    model = _TinyModel().eval()
+    images = torch.rand(4, 3, 32, 32)
+
+    hub = dq._prepare_quantizable(SimpleNamespace(model=model), engine)
+    with torch.inference_mode():
+        reference = hub.model(images)
+    convert(hub.model, inplace=True)
+    with torch.inference_mode():
+        output = hub.model(images)
+
+    # 只在模型输入处量化一次，Concat 改为带观察器的 INT8 拼接，检测头收到反量化后的浮点输入
+    assert sum(isinstance(m, Quantize) for m in hub.model.modules()) == 1
+    assert isinstance(hub.model.model[3], dq._QuantConcat)
+    assert not output.is_quantized
+    assert torch.allclose(output, reference, atol=0.1)
+
+
+def test_cache_signature_tracks_calibration_data_and_threshold(tmp_path):
+    weights = tmp_path / 'best.pt'
+    weights.write_bytes(b'weights')
+    calibration = tmp_path / 'calibration'
+    calibration.mkdir()
+    labeled = tmp_path / 'labeled'
+
+    def signature(**kwargs):
+        options = {'calibration_frames': 2, 'input_sizes': [640], 'max_accuracy_drop': 0.02}
+        options.update(kwargs)
+        return dq._cache_signature(weights, calibration, labeled, **options)
+
+    base = signature()
+    assert signature(max_accuracy_drop=0.05) != base
+    assert signature(input_sizes=[320, 640]) != base
+
+    (calibration / 'calib_1.jpg').write_bytes(b'a')
+    with_frame = signature()
+    assert with_frame != base
+    # 只统计参与校准的前 calibration_frames 张
+    (calibration / 'calib_2.jpg').write_bytes(b'b')
+    two_frames = signature()
+    (calibration / 'calib_3.jpg').write_bytes(b'c')
+    assert signature() == two_frames
+    assert signature(calibration_frames=3) != two_frames
+
+    labeled.mkdir()
+    (labeled / 'labels.json').write_text('{}')
+    assert signature() != two_frames
@@ -0,0 +1,87 @@
+"""高精度模式：加权框融合与模糊帧精修"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+pytest.importorskip('torch')
+# 与 volleyball_detector 相同：yolov7 代码按顶层包 models / utils 导入
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend', 'core'))
+
+from backend.core.detector_refinement import AccuracyRefiner, weighted_box_fusion  # noqa: E402
+
+
+class _Preds:
+    def __init__(self, pred):
+        self.pred = [np.asarray(p, dtype=float).reshape(-1, 6) for p in pred]
+
+
+class _FakeDetector:
+    """TTA 返回预先给定的检测框"""
+
+    def __init__(self, tta_pred):
+        self.tta_pred = tta_pred
+        self.calls = []
+
+    def predict_batch(self, frames, size, augment=False, conf=None):
+        self.calls.append({'frames': len(frames), 'augment': augment, 'conf': conf})
+        return _Preds(self.tta_pred)
+
+
+def _box(x, y, conf, w=10):
+    return [x, y, x + w, y + w, conf, 0]
+
+
+def test_wbf_scales_confidence_by_source_agreement():
+    fused = weighted_box_fusion([[(0, 0, 10, 10, 0.55)], []])
+    assert fused[0][1] == pytest.approx(0.275)
+    assert fused[0][2] == 1
+
+    fused = weighted_box_fusion([[(0, 0, 10, 10, 0.6)], [(1, 1, 11, 11, 0.4)]])
+    assert len(fused) == 1
+    assert fused[0][1] == pytest.approx(0.5)
+    assert fused[0][2] == 2
+    # 坐标按置信度加权
+    assert fused[0][0][0] == pytest.approx(0.4)
+
+
+def test_wbf_keeps_separate_objects_apart():
+    fused = weighted_box_fusion([[(0, 0, 10, 10, 0.9), (100, 100, 110, 110, 0.3)]])
+    assert [round(conf, 2) for _, conf, _ in fused] == [0.9, 0.3]
+
+
+def _refiner(tta_pred):
+    return AccuracyRefiner(_FakeDetector(tta_pred), score_threshold=0.45,
+                           ambiguous_low=0.15, ambiguous_high=0.6)
+
+
+def test_refine_keeps_fast_detection_missed_by_tta():
+    # 快速模型 0.55 已过阈值（快速模式会采用），TTA 没有检出
+    refiner = _refiner(tta_pred=[[]])
+    stats = refiner.new_stats()
+    results = refiner.refine([np.zeros((32, 32, 3), np.uint8)], _Preds([[_box(0, 0, 0.55)]]), 640, stats)
+    assert results == [((0, 0, 10, 10), pytest.approx(0.55))]
+    assert stats['ambiguous_frames'] == 1
+    assert stats['accepted_after_refine'] == 0
+
+
+def test_refine_recovers_low_confidence_detection_confirmed_by_tta():
+    refiner = _refiner(tta_pred=[[_box(1, 1, 0.58)]])
+    stats = refiner.new_stats()
+    results = refiner.refine([np.zeros((32, 32, 3), np.uint8)], _Preds([[_box(0, 0, 0.4)]]), 640, stats)
+    (x, y, w, h), score = results[0]
+    assert score == pytest.approx(0.49)
+    # 融合框坐标在两个来源之间
+    assert 0 <= x <= 1 and 9 <= w <= 10
+    assert stats['accepted_after_refine'] == 1
+    assert refiner.detector.calls == [{'frames': 1, 'augment': True, 'conf': 0.15}]
+
+
+def test_refine_routes_confident_and_empty_frames_without_extra_passes():
+    refiner = _refiner(tta_pred=[])
+    frames = [np.zeros((32, 32, 3), np.uint8)] * 2
+    results = refiner.refine(frames, _Preds([[_box(0, 0, 0.9)], [_box(0, 0, 0.1)]]), 640)
+    assert results[0][1] == pytest.approx(0.9)
+    assert results[1] == ((0, 0, 0, 0), 0.0)
+    assert refiner.detector.calls == []
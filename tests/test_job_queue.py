@@ -0,0 +1,256 @@
+"""任务存储与任务队列"""
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from backend.services.job_queue import (
+    CANCELLED, CANCELLING, FAILED, QUEUED, RUNNING, SUCCEEDED,
+    JobQueue, MemoryJobStore, QueueFullError, SQLiteJobStore, _new_job,
+)
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryJobStore()
+    return SQLiteJobStore(tmp_path / 'jobs.db')
+
+
+def _dead_pid():
+    """一个已经退出的进程号"""
+    proc = subprocess.Popen([sys.executable, '-c', 'pass'])
+    proc.wait()
+    return proc.pid
+
+
+def _wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+# ----------------- 存储 -----------------
+
+def test_add_get_roundtrip(store):
+    job = _new_job('video', {'path': '/tmp/a.mp4', 'fps': 30})
+    store.add(job)
+    loaded = store.get(job['id'])
+    assert loaded['status'] == QUEUED
+    assert loaded['params'] == {'path': '/tmp/a.mp4', 'fps': 30}
+    assert loaded['progress'] == {'done': 0, 'total': 0}
+    assert store.get('missing') is None
+
+
+def test_update_serializes_json_fields(store):
+    job = _new_job('video', {})
+    store.add(job)
+    store.update(job['id'], progress={'done': 3, 'total': 10}, result={'score': 87.5})
+    loaded = store.get(job['id'])
+    assert loaded['progress'] == {'done': 3, 'total': 10}
+    assert loaded['result'] == {'score': 87.5}
+
+
+def test_update_if_only_matches_expected_status(store):
+    job = _new_job('video', {})
+    store.add(job)
+    assert store.update_if(job['id'], RUNNING, status=CANCELLING) is False
+    assert store.get(job['id'])['status'] == QUEUED
+    assert store.update_if(job['id'], QUEUED, status=CANCELLED) is True
+    assert store.get(job['id'])['status'] == CANCELLED
+    assert store.update_if('missing', QUEUED, status=CANCELLED) is False
+
+
+def test_claim_next_in_submission_order(store):
+    first, second = _new_job('video', {}), _new_job('video', {})
+    second['created_at'] = first['created_at'] + 1
+    store.add(second)
+    store.add(first)
+
+    claimed = store.claim_next('host:1')
+    assert claimed['id'] == first['id']
+    assert claimed['status'] == RUNNING
+    assert claimed['worker'] == 'host:1'
+    assert store.get(first['id'])['status'] == RUNNING
+    assert store.claim_next('host:1')['id'] == second['id']
+    assert store.claim_next('host:1') is None
+
+
+def test_count_created_before(store):
+    jobs = [_new_job('video', {}) for _ in range(3)]
+    for i, job in enumerate(jobs):
+        job['created_at'] = 100.0 + i
+        store.add(job)
+    assert store.count(QUEUED) == 3
+    assert store.count(QUEUED, created_before=102.0) == 2
+    assert store.count(RUNNING) == 0
+
+
+def test_purge_only_finished_jobs(store):
+    old, recent, running = _new_job('video', {}), _new_job('video', {}), _new_job('video', {})
+    for job in (old, recent, running):
+        store.add(job)
+    store.update(old['id'], status=SUCCEEDED, finished_at=100.0)
+    store.update(recent['id'], status=FAILED, finished_at=300.0)
+    store.update(running['id'], status=RUNNING)
+
+    assert store.purge(older_than=200.0) == [old['id']]
+    assert store.get(old['id']) is None
+    assert store.get(recent['id']) is not None
+    assert store.get(running['id']) is not None
+
+
+# ----------------- SQLite 多连接 / 恢复 -----------------
+
+def test_sqlite_claim_is_exclusive_across_connections(tmp_path):
+    db_path = tmp_path / 'jobs.db'
+    SQLiteJobStore(db_path)
+    jobs = [_new_job('video', {}) for _ in range(20)]
+    writer = SQLiteJobStore(db_path)
+    for job in jobs:
+        writer.add(job)
+
+    claimed = []
+    lock = threading.Lock()
+
+    def consume(worker):
+        # 每个线程各自的存储对象，模拟不同的 worker 进程
+        own = SQLiteJobStore(db_path)
+        while True:
+            job = own.claim_next(worker)
+            if job is None:
+                return
+            with lock:
+                claimed.append(job['id'])
+
+    threads = [threading.Thread(target=consume, args=(f'host:{i}',)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(claimed) == sorted(job['id'] for job in jobs)
+
+
+def test_sqlite_shared_between_store_instances(tmp_path):
+    db_path = tmp_path / 'jobs.db'
+    job = _new_job('video', {'a': 1})
+    SQLiteJobStore(db_path).add(job)
+    assert SQLiteJobStore(db_path).get(job['id'])['params'] == {'a': 1}
+
+
+def test_sqlite_recover_marks_jobs_of_dead_workers(tmp_path):
+    store = SQLiteJobStore(tmp_path / 'jobs.db')
+    host = socket.gethostname()
+    dead = f'{host}:{_dead_pid()}'
+
+    running, cancelling, alive, remote = (_new_job('video', {}) for _ in range(4))
+    for job in (running, cancelling, alive, remote):
+        store.add(job)
+    store.update(running['id'], status=RUNNING, worker=dead)
+    store.update(cancelling['id'], status=CANCELLING, worker=dead)
+    store.update(alive['id'], status=RUNNING, worker=f'{host}:{os.getpid()}')
+    # 其他主机上的进程无法判断存活，保持不变
+    store.update(remote['id'], status=RUNNING, worker=f'{host}-other:1')
+
+    assert store.recover() == 2
+    assert store.get(running['id'])['status'] == FAILED
+    assert store.get(running['id'])['finished_at'] is not None
+    assert store.get(cancelling['id'])['status'] == CANCELLED
+    assert store.get(alive['id'])['status'] == RUNNING
+    assert store.get(remote['id'])['status'] == RUNNING
+
+
+def test_memory_recover_is_noop():
+    assert MemoryJobStore().recover() == 0
+
+
+# ----------------- 队列 -----------------
+
+def test_queue_runs_job_and_reports_progress():
+    def handler(params, progress_callback, cancel_token):
+        for i in range(params['frames']):
+            progress_callback(i + 1, params['frames'])
+        return {'success': True, 'frames': params['frames']}
+
+    queue = JobQueue(MemoryJobStore(), {'video': handler}, progress_interval=0, poll_interval=0.05)
+    job_id = queue.submit('video', {'frames': 4})
+
+    assert _wait_for(lambda: queue.get(job_id)['status'] == SUCCEEDED)
+    job = queue.get(job_id)
+    assert job['result'] == {'success': True, 'frames': 4}
+    assert job['progress']['percent'] == 100.0
+    assert 'params' not in job
+
+
+def test_queue_failed_result_marks_job_failed():
+    queue = JobQueue(MemoryJobStore(), {'video': lambda p, cb, t: {'success': False, 'error': '无法读取视频'}},
+                     poll_interval=0.05)
+    job_id = queue.submit('video', {})
+    assert _wait_for(lambda: queue.get(job_id)['status'] == FAILED)
+    assert queue.get(job_id)['error'] == '无法读取视频'
+
+
+def test_queue_rejects_unknown_kind_and_full_queue():
+    store = MemoryJobStore()
+    queue = JobQueue(store, {'video': lambda p, cb, t: None}, max_pending=1)
+    with pytest.raises(ValueError):
+        queue.submit('unknown', {})
+    # 不启动工作线程，任务留在队列中
+    store.add(_new_job('video', {}))
+    with pytest.raises(QueueFullError):
+        queue.submit('video', {})
+
+
+def test_queue_status_reads_store():
+    store = MemoryJobStore()
+    queue = JobQueue(store, {'video': lambda p, cb, t: None}, max_pending=3)
+    store.add(_new_job('video', {}))
+    assert queue.status() == {'queued': 1, 'running': 0, 'max_pending': 3, 'workers': 1, 'started': False}
+
+    # 存储不可用时抛出异常，由就绪检查报告
+    def broken(*args, **kwargs):
+        raise OSError('database is locked')
+    store.count = broken
+    with pytest.raises(OSError):
+        queue.status()
+
+
+def test_queue_cancel_queued_and_running():
+    started = threading.Event()
+
+    def handler(params, progress_callback, cancel_token):
+        started.set()
+        while True:
+            cancel_token.check()
+            time.sleep(0.01)
+
+    queue = JobQueue(MemoryJobStore(), {'video': handler}, poll_interval=0.05)
+    running_id = queue.submit('video', {})
+    queued_id = queue.submit('video', {})
+    assert started.wait(5)
+
+    assert queue.cancel(queued_id) == CANCELLED
+    assert queue.get(queued_id)['status'] == CANCELLED
+    assert queue.cancel(running_id) == CANCELLING
+    assert _wait_for(lambda: queue.get(running_id)['status'] == CANCELLED)
+    assert queue.cancel('missing') is None
+
+
+def test_queue_timeout_per_kind():
+    def handler(params, progress_callback, cancel_token):
+        while True:
+            cancel_token.check()
+            time.sleep(0.01)
+
+    queue = JobQueue(MemoryJobStore(), {'hls': handler}, poll_interval=0.05, job_timeout={'hls': 0.1})
+    job_id = queue.submit('hls', {})
+    assert _wait_for(lambda: queue.get(job_id)['status'] == FAILED)
+    assert queue.get(job_id)['error'] == '处理超时'
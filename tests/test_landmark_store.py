@@ -0,0 +1,50 @@
+"""关键点序列缓存"""
+import pytest
+
+from backend.core.landmark_store import LandmarkStore
+
+DIGEST = 'ab' * 32
+
+
+@pytest.fixture
+def store(tmp_path):
+    return LandmarkStore(tmp_path / 'landmarks', max_entries=2)
+
+
+def _frames():
+    return [{'landmarks': {'nose': {'x': 0.5, 'y': 0.5}}, 'ball': []}]
+
+
+def test_make_id_and_validation():
+    landmarks_id = LandmarkStore.make_id(DIGEST, 2, 300)
+    assert landmarks_id == f'{DIGEST[:24]}-2-300'
+    assert LandmarkStore.make_id(DIGEST, 2, 300, height=720) == f'{landmarks_id}-720'
+    assert LandmarkStore.is_valid_id(landmarks_id)
+    assert not LandmarkStore.is_valid_id('../etc/passwd')
+    assert not LandmarkStore.is_valid_id('')
+
+
+def test_put_get_records_ball_detection(store):
+    landmarks_id = LandmarkStore.make_id(DIGEST, 1, 100)
+    store.put(landmarks_id, 30.0, 640, 360, _frames())
+    sequence = store.get(landmarks_id)
+    assert sequence['frames'] == _frames()
+    assert (sequence['width'], sequence['height']) == (640, 360)
+    assert not LandmarkStore.has_ball_data(sequence)
+
+    store.put(landmarks_id, 30.0, 640, 360, _frames(), ball_detection=True)
+    assert LandmarkStore.has_ball_data(store.get(landmarks_id))
+
+
+def test_sequence_without_flag_has_no_ball_data():
+    # 旧版本写入的缓存没有 ball_detection 字段
+    assert not LandmarkStore.has_ball_data({'frames': []})
+
+
+def test_prune_keeps_max_entries(store):
+    ids = [LandmarkStore.make_id(DIGEST, i, 100) for i in (1, 2, 3)]
+    for landmarks_id in ids:
+        store.put(landmarks_id, 30.0, 64, 36, _frames())
+    remaining = [landmarks_id for landmarks_id in ids if store.get(landmarks_id) is not None]
+    assert len(remaining) == 2
+    assert store.get('invalid id') is None
@@ -0,0 +1,170 @@
+"""响应格式（schema 1 / 2）与 JSON 编码"""
+import json
+
+import numpy as np
+import pytest
+from flask import Flask
+
+from backend.api import schema
+from backend.api.schema import (
+    FastJSONProvider, compact_analysis_result, compact_ball_detection, compact_ball_detections,
+    compact_frames, compact_landmarks, format_analysis_result, parse_schema_version,
+)
+
+
+def _landmark(x, y, z=0.0, visibility=1.0):
+    return {'x': x, 'y': y, 'z': z, 'visibility': visibility}
+
+
+def _detection(score, x, y):
+    return {'label': 'volleyball', 'score': score, 'bbox': [1.6, 2.2, 30.9, 40.1], 'center': {'x': x, 'y': y}}
+
+
+@pytest.mark.parametrize('value, expected', [
+    (None, (2, None)),
+    ('', (2, None)),
+    ('1', (1, None)),
+    (2, (2, None)),
+])
+def test_parse_schema_version(value, expected):
+    assert parse_schema_version(value) == expected
+
+
+@pytest.mark.parametrize('value', ['3', 'abc', 0])
+def test_parse_schema_version_rejects_unsupported(value):
+    version, error = parse_schema_version(value)
+    assert version is None and error
+
+
+def test_compact_landmarks_rounds_columns():
+    compact = compact_landmarks({
+        'nose': _landmark(0.123456, 0.654321, -0.1, 0.99876),
+        'left_wrist': _landmark(0.5, 0.25),
+    })
+    assert compact['names'] == ['nose', 'left_wrist']
+    assert compact['x'] == [0.1235, 0.5]
+    assert compact['y'] == [0.6543, 0.25]
+    assert compact['z'] == [-0.1, 0.0]
+    assert compact['visibility'] == [0.999, 1.0]
+    assert compact_landmarks(None) is None
+    assert compact_landmarks({}) is None
+
+
+def test_compact_frames_keeps_rows_without_pose():
+    frames = [
+        {'frame_idx': 0, 'has_pose': True, 'landmarks': {'nose': _landmark(0.1, 0.2)}},
+        {'frame_idx': 5, 'has_pose': False, 'landmarks': None},
+        {'frame_idx': 10, 'landmarks': {'nose': _landmark(0.3, 0.4)}},
+    ]
+    compact = compact_frames(frames)
+    assert compact['count'] == 3
+    assert compact['frame_idx'] == [0, 5, 10]
+    assert compact['has_pose'] == [True, False, True]
+    assert compact['landmarks']['names'] == ['nose']
+    assert compact['landmarks']['x'] == [[0.1], None, [0.3]]
+    assert compact['landmarks']['visibility'] == [[1.0], None, [1.0]]
+
+
+def test_compact_ball_detections_flattens_table():
+    frames = [
+        {'frame_idx': 0, 'ball_detections': [_detection(0.91234, 0.123456, 0.5)]},
+        {'frame_idx': 1, 'ball_detections': []},
+        {'frame_idx': 2, 'ball_detections': [_detection(0.5, 0.1, 0.2), _detection(0.4, 0.3, 0.4)]},
+    ]
+    table = compact_ball_detections(frames)
+    assert table['frame'] == [0, 2, 2]
+    assert table['score'] == [0.912, 0.5, 0.4]
+    assert table['center_x'] == [0.1235, 0.1, 0.3]
+    assert table['bbox'][0] == [1, 2, 30, 40]
+
+
+def test_compact_ball_detection_accepts_dict_and_none():
+    compact = compact_ball_detection(_detection(0.87654, 0.25, None))
+    assert compact == {'label': 'volleyball', 'score': 0.877, 'bbox': [1, 2, 30, 40], 'center': [0.25, None]}
+    assert compact_ball_detection(None) is None
+
+
+def test_compact_analysis_result_sequence():
+    frames = [
+        {'frame_idx': 0, 'has_pose': True, 'landmarks': {'nose': _landmark(0.1, 0.2)},
+         'ball_detections': [_detection(0.9, 0.5, 0.5)]},
+    ]
+    result = compact_analysis_result({
+        'success': True,
+        'score': 80,
+        'landmarks': {'nose': _landmark(0.1, 0.2)},
+        'frames_data': frames,
+        'ball_detection_enabled': True,
+        'trajectories': {'nose': {'x': [0.123456, None], 'y': [0.5, 0.6], 'visibility': [0.99876, None]}},
+        'ball_trajectory': {'x': [0.1, None], 'y': [0.2, None], 'confidence': [0.87654, None]},
+    })
+    assert result['schema_version'] == 2
+    assert 'frames_data' not in result
+    assert result['frames']['count'] == 1
+    assert result['ball_detections']['frame'] == [0]
+    assert result['trajectories']['nose'] == {'x': [0.1235, None], 'y': [0.5, 0.6], 'visibility': [0.999, None]}
+    assert result['ball_trajectory']['confidence'] == [0.877, None]
+    # 所有字段都是 JSON 原生类型
+    json.dumps(result, allow_nan=False)
+
+
+def test_compact_analysis_result_drops_ball_table_when_disabled():
+    result = compact_analysis_result({
+        'landmarks': None,
+        'frames_data': [{'frame_idx': 0, 'landmarks': None}],
+        'ball_detection_enabled': False,
+        'ball_detections': [[]],
+    })
+    assert 'ball_detections' not in result
+    assert result['landmarks'] is None
+
+
+def test_legacy_analysis_result_keeps_str_landmarks():
+    landmarks = {'nose': _landmark(0.1, 0.2)}
+    result = format_analysis_result({'landmarks': landmarks, 'frames_data': []}, version=1)
+    assert result['schema_version'] == 1
+    assert result['landmarks'] == str(landmarks)
+    assert result['frames_data'] == []
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.json = FastJSONProvider(app)
+    return app
+
+
+@pytest.mark.parametrize('use_orjson', [True, False])
+def test_json_provider_encodes_numpy(app, monkeypatch, use_orjson):
+    if use_orjson and schema.orjson is None:
+        pytest.skip('orjson 未安装')
+    if not use_orjson:
+        monkeypatch.setattr(schema, 'orjson', None)
+    payload = {'score': np.float32(0.5), 'frames': np.int64(3), 'bbox': np.array([1, 2, 3, 4]), 'name': '扣球'}
+    assert json.loads(app.json.dumps(payload)) == {'score': 0.5, 'frames': 3, 'bbox': [1, 2, 3, 4], 'name': '扣球'}
+    with app.app_context():
+        response = app.json.response(payload)
+    assert response.mimetype == 'application/json'
+    assert json.loads(response.get_data(as_text=True))['bbox'] == [1, 2, 3, 4]
+
+
+def test_json_provider_rejects_unknown_objects(app, monkeypatch):
+    monkeypatch.setattr(schema, 'orjson', None)
+    with pytest.raises(TypeError):
+        app.json.dumps({'value': object()})
+
+
+def test_respond_msgpack(app):
+    msgpack = pytest.importorskip('msgpack')
+    payload = {'score': np.float64(0.25), 'ids': np.array([1, 2])}
+    with app.test_request_context(headers={'Accept': schema.MSGPACK_MIMETYPE}):
+        response = schema.respond(payload)
+    assert response.mimetype == schema.MSGPACK_MIMETYPE
+    assert msgpack.unpackb(response.get_data()) == {'score': 0.25, 'ids': [1, 2]}
+
+
+def test_respond_json_by_default(app):
+    with app.test_request_context():
+        response, status = schema.respond({'value': np.int32(7)}, status=201)
+    assert status == 201
+    assert response.get_json() == {'value': 7}
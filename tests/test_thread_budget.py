@@ -0,0 +1,23 @@
+"""线程预算"""
+import pytest
+
+from backend.core.thread_budget import plan_thread_budget
+
+
+@pytest.mark.parametrize('workers, cpus, per_worker', [
+    (1, 8, 8),
+    (4, 8, 2),
+    (4, 2, 1),     # CPU 少于 worker 时每个 worker 至少 1 个线程
+    (3, 2.5, 1),
+    (0, 4, 4),     # worker 数至少为 1
+])
+def test_plan_thread_budget(workers, cpus, per_worker):
+    budget = plan_thread_budget(workers=workers, cpus=cpus)
+    assert budget['per_worker'] == per_worker
+    assert budget['torch'] == budget['opencv'] == budget['ffmpeg'] == per_worker
+    assert budget['cpu_source'] == 'config'
+
+
+def test_plan_thread_budget_overrides():
+    budget = plan_thread_budget(workers=2, cpus=8, torch_threads=3, ffmpeg_threads=1)
+    assert (budget['torch'], budget['opencv'], budget['ffmpeg']) == (3, 4, 1)
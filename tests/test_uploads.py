@@ -0,0 +1,106 @@
+"""暂存上传：SpoolFile / SpoolingRequest / claim_upload"""
+import hashlib
+import io
+import os
+
+import pytest
+from flask import Flask, jsonify, request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from backend.api.uploads import SpoolFile, claim_upload, configure_uploads
+
+
+def test_spool_file_tracks_size_and_hash(tmp_path):
+    spool = SpoolFile(tmp_path / 'a.mp4', max_bytes=1024)
+    spool.write(b'abc')
+    spool.write(b'def' * 10)
+    spool.flush()
+    assert spool.size == 33
+    assert spool.hexdigest() == hashlib.sha256(b'abc' + b'def' * 10).hexdigest()
+    spool.seek(0)
+    assert spool.read() == b'abc' + b'def' * 10
+    spool.close()
+
+
+def test_spool_file_rejects_oversized_upload(tmp_path):
+    spool = SpoolFile(tmp_path / 'a.mp4', max_bytes=10)
+    spool.write(b'x' * 10)
+    with pytest.raises(RequestEntityTooLarge):
+        spool.write(b'y')
+    # 超出上限的数据不写入、不计入哈希
+    assert spool.hexdigest() == hashlib.sha256(b'x' * 10).hexdigest()
+    spool.close()
+
+
+def test_spool_file_without_limit(tmp_path):
+    spool = SpoolFile(tmp_path / 'a.mp4')
+    spool.write(b'z' * 4096)
+    assert spool.size == 4096
+    spool.close()
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    spool_dir = tmp_path / 'spool'
+    configure_uploads(app, spool_dir, max_file_size_mb=0.01, form_overhead_bytes=4096)
+    jobs_dir = tmp_path / 'jobs'
+
+    @app.route('/claim', methods=['POST'])
+    def claim():
+        upload = claim_upload(request.files['video'], str(jobs_dir / 'input.mp4'))
+        return jsonify(path=upload.path, filename=upload.filename, sha256=upload.sha256, size=upload.size)
+
+    @app.route('/ignore', methods=['POST'])
+    def ignore():
+        request.files['video']
+        return jsonify(spooled=os.listdir(spool_dir))
+
+    app.spool_dir = spool_dir
+    return app
+
+
+def _post(client, url, data, filename='serve.mp4'):
+    return client.post(url, data={'video': (io.BytesIO(data), filename)}, content_type='multipart/form-data')
+
+
+def test_claim_moves_spool_into_job_dir(app):
+    data = os.urandom(5000)
+    response = _post(app.test_client(), '/claim', data, filename='../my serve.MP4')
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['filename'] == 'my_serve.MP4'
+    assert body['size'] == len(data)
+    assert body['sha256'] == hashlib.sha256(data).hexdigest()
+    with open(body['path'], 'rb') as f:
+        assert f.read() == data
+    assert list(app.spool_dir.glob('*')) == []
+
+
+def test_unclaimed_spool_is_removed_after_request(app):
+    response = _post(app.test_client(), '/ignore', b'abc')
+    assert response.status_code == 200
+    # 处理期间暂存文件存在，扩展名取自客户端文件名
+    spooled = response.get_json()['spooled']
+    assert len(spooled) == 1 and spooled[0].endswith('.mp4')
+    assert list(app.spool_dir.glob('*')) == []
+
+
+@pytest.mark.parametrize('size', [
+    12000,   # 请求体在上限内，单个文件超限：写入过程中中止
+    20000,   # Content-Length 超过请求体上限：读取前拒绝
+])
+def test_oversized_upload_is_rejected(app, size):
+    response = _post(app.test_client(), '/claim', b'x' * size)
+    assert response.status_code == 413
+    assert list(app.spool_dir.glob('*')) == []
+
+
+def test_claim_without_spooling_requires_destination(tmp_path):
+    from werkzeug.datastructures import FileStorage
+    storage = FileStorage(io.BytesIO(b'data'), filename='a.mp4')
+    with pytest.raises(ValueError):
+        claim_upload(storage)
+    upload = claim_upload(storage, str(tmp_path / 'a.mp4'))
+    assert upload.size == 4
+    assert upload.sha256 == hashlib.sha256(b'data').hexdigest()